@@ -0,0 +1,42 @@
+"""Atomic replacement of files written by storages, journals and metrics."""
+
+import os
+import tempfile
+from pathlib import Path
+from typing import Union
+
+# mode of the new files as open() creates them, mkstemp() makes them private,
+# the umask can only be read by setting it, so it's done once on import
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+_FILE_MODE = 0o666 & ~_UMASK
+
+
+def write_atomic(
+    path: Union[str, Path], data: Union[bytes, str], fsync: bool = True
+) -> None:
+    """Write the file at once, readers never see a partial one.
+    Data goes to a unique temporary file in the same dir which then replaces
+    the file, so concurrent writers don't clash and a crash in the middle
+    of writing can't leave a broken file. str data is written in utf-8.
+    Without fsync the file may be lost on a crash of the host, but not broken.
+    The file gets the usual mode of new files, not the private one of mkstemp().
+    """
+    path = Path(path)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=path.name + ".", suffix=".tmp"
+    )
+    try:
+        os.chmod(tmp_path, _FILE_MODE)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
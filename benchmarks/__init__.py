@@ -0,0 +1 @@
+"""Benchmarks of the monitoring pipeline on synthetic catalogue pages."""
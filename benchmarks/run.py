@@ -0,0 +1,243 @@
+"""Run benchmarks of the pipeline stages and of the whole main() run.
+
+Usage: python -m benchmarks.run --items 50 --pages 5 --latency 0.01 --output bench.json
+Results are printed or written as json, so they can be compared between versions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable
+from unittest.mock import patch
+
+from benchmarks.server import CatalogueServer
+from benchmarks.synthetic import make_project_config
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    """Run fn repeat times and return its durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return {
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.fmean(durations),
+        "repeat": repeat,
+    }
+
+
+def prepare_workspace(workspace: Path, server: CatalogueServer, args) -> None:
+    """Create project configs and the schema in the workspace dir."""
+    configs_dir = workspace / "projects_configs"
+    configs_dir.mkdir(parents=True)
+    shutil.copytree(ROOT_DIR / "schema", workspace / "schema")
+    for project_index in range(args.projects):
+        config = make_project_config(
+            f"bench_{project_index}",
+            server.base_url,
+            modules=args.modules,
+            pages=args.pages,
+            fields=args.fields,
+        )
+        (configs_dir / f"bench_{project_index}.json").write_text(
+            json.dumps(config), encoding="utf-8"
+        )
+
+
+def bench_stages(main_module, server: CatalogueServer, args) -> dict:
+    """Benchmark fetch, parse, extract, diff and store of one module."""
+    from extraction import ExtractionPlan
+    from json_items_handlers import JsonItemsLocalStorage, item_fingerprint
+
+    module = make_project_config("stages", server.base_url, 1, args.pages, args.fields)[
+        "modules"
+    ][0]
+    plan = ExtractionPlan(module)
+    urls = list(main_module.get_module_urls(module))
+    request = main_module.RequestHandler()
+    results = {}
+
+    pages = []
+
+    def fetch():
+        pages.clear()
+        pages.extend(request.read_url(url).content for url in urls)
+
+    results["fetch"] = measure(fetch, args.repeat)
+    results["fetch"]["bytes"] = sum(len(page) for page in pages)
+    request.close()
+
+    for mode in ("full", "targeted"):
+        results[f"parse_{mode}"] = measure(
+            lambda: [plan.parse_items(page, mode=mode) for page in pages], args.repeat
+        )
+    elements = [item for page in pages for item in plan.parse_items(page)[0]]
+
+    scraped = []
+
+    def extract():
+        scraped.clear()
+        scraped.extend(main_module.scrap_single_item(item, plan) for item in elements)
+
+    results["extract"] = measure(extract, args.repeat)
+    results["extract"]["items"] = len(scraped)
+
+    # a part of the stored items has another price
+    step = max(1, round(1 / args.change_fraction)) if args.change_fraction else 0
+    stored = {
+        sku: item_fingerprint(
+            {**item[sku], "price": "0"} if step and i % step == 0 else item[sku]
+        )
+        for i, (sku, item) in enumerate(scraped)
+    }
+    storage_dir = tempfile.mkdtemp(prefix="bench_store_")
+    try:
+        with patch.object(JsonItemsLocalStorage, "_file_dir", storage_dir):
+            storage = JsonItemsLocalStorage("output_stages.json")
+
+            def diff():
+                storage.discard()
+                return main_module.apply_changes(scraped, storage, dict(stored))
+
+            results["diff"] = measure(diff, args.repeat)
+            results["diff"]["changed"] = len(diff())
+
+            def store():
+                storage.stage_items({sku: item[sku] for sku, item in scraped})
+                storage.save_to_json_file({})
+                storage.flush()
+
+            results["store"] = measure(store, args.repeat)
+    finally:
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+    for name, result in results.items():
+        result["stage"] = name
+    return results
+
+
+def bench_pipeline(main_module, server: CatalogueServer, args) -> dict:
+    """Benchmark main() with empty storages and again after prices changed."""
+    from metrics import metrics
+
+    results = {}
+    for run in ("cold", "warm"):
+        if run == "warm":
+            server.change_prices(args.change_fraction)
+        requests_before = server.requests
+        before = metrics.snapshot()
+        start = time.perf_counter()
+        main_module.main(request_delay=0)
+        seconds = time.perf_counter() - start
+        stages = defaultdict(lambda: defaultdict(int))
+        for stage in metrics.summary(before, metrics.snapshot()):
+            for field in ("calls", "errors", "seconds", "bytes", "items"):
+                stages[stage["stage"]][field] += stage[field]
+        items = args.projects * args.modules * args.pages * args.items
+        results[run] = {
+            "seconds": seconds,
+            "requests": server.requests - requests_before,
+            "items": items,
+            "items_per_second": items / seconds,
+            "stages": {stage: dict(values) for stage, values in stages.items()},
+        }
+    return results
+
+
+def git_revision() -> str:
+    """Return the current commit of the repo if git is available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--projects", type=int, default=2)
+    parser.add_argument("--modules", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--items", type=int, default=50, help="items per page")
+    parser.add_argument("--fields", type=int, default=4, help="fields per item")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="server delay of every response"
+    )
+    parser.add_argument(
+        "--change-fraction",
+        type=float,
+        default=0.05,
+        help="part of items with changed prices in the warm run and the diff stage",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--skip-pipeline", action="store_true", help="benchmark only the stages"
+    )
+    parser.add_argument("--output", help="json file for the results, stdout by default")
+    return parser.parse_args(argv)
+
+
+def run(argv=None) -> dict:
+    """Run all benchmarks and return the results."""
+    args = parse_args(argv)
+    workspace = Path(tempfile.mkdtemp(prefix="bench_"))
+    # main reads its settings and opens its log relative to the current dir on import
+    os.chdir(workspace)
+    os.environ.setdefault("METRICS_DIR", str(workspace / "metrics"))
+    # emails are sent at once to the stub below, without the queue worker
+    os.environ.setdefault("NOTIFICATION_QUEUE_FILE", "")
+    sys.path.insert(0, str(ROOT_DIR))
+    import main as main_module
+
+    # emails are not part of the benchmark
+    main_module.notifier.send_messages = len
+
+    with CatalogueServer(
+        modules=args.modules,
+        pages=args.pages,
+        items=args.items,
+        fields=args.fields,
+        latency=args.latency,
+    ) as server:
+        prepare_workspace(workspace, server, args)
+        results = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": vars(args),
+            "stages": bench_stages(main_module, server, args),
+        }
+        if not args.skip_pipeline:
+            results["pipeline"] = bench_pipeline(main_module, server, args)
+    os.chdir(ROOT_DIR)
+    shutil.rmtree(workspace, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+    return results
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,104 @@
+"""Local http server with synthetic catalogue pages."""
+
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic import item_sku, make_listing_page
+
+PAGE_PATH = re.compile(r"^/m(\d+)/page_(\d+)$")
+
+
+class CatalogueServer:
+    """Serve listing pages of the synthetic catalogue on localhost.
+
+    Every response is delayed by latency seconds to simulate a remote host.
+    change_prices() changes prices of a part of the items, so the next run
+    finds changed items.
+    """
+
+    def __init__(
+        self,
+        modules: int = 1,
+        pages: int = 5,
+        items: int = 50,
+        fields: int = 4,
+        latency: float = 0.0,
+    ):
+        self.modules = modules
+        self.pages = pages
+        self.items = items
+        self.fields = fields
+        self.latency = latency
+        self.requests = 0
+        self._revisions: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def page(self, module_index: int, page: int) -> bytes:
+        """Return the page body as it is served now."""
+        return make_listing_page(
+            module_index, page, self.pages, self.items, self.fields, self._revisions
+        )
+
+    def change_prices(self, fraction: float) -> int:
+        """Change prices of the fraction of all items, return the number of them."""
+        if not fraction:
+            return 0
+        step = max(1, round(1 / fraction))
+        changed = 0
+        with self._lock:
+            for module_index in range(self.modules):
+                for page in range(1, self.pages + 1):
+                    for position in range(0, self.items, step):
+                        sku = item_sku(module_index, page, position)
+                        self._revisions[sku] = self._revisions.get(sku, 0) + 1
+                        changed += 1
+        return changed
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                match = PAGE_PATH.match(self.path)
+                if not match:
+                    return self._send(404, b"")
+                module_index, page = int(match[1]), int(match[2])
+                if module_index >= server.modules or not 1 <= page <= server.pages:
+                    return self._send(404, b"")
+                self._send(200, server.page(module_index, page))
+
+            def _send(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self) -> "CatalogueServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
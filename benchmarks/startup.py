@@ -0,0 +1,157 @@
+"""Benchmark of the startup time: import time of main and of its direct imports.
+
+Usage: python -m benchmarks.startup --repeat 10 --output startup.json
+Every repeat imports the module in a new interpreter with -X importtime,
+medians are reported. With --baseline the run fails if the import time grew
+more than --tolerance against a previous result.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+from benchmarks.run import ROOT_DIR, git_revision
+
+# modules which should be imported only when they are used
+LAZY_MODULES = ("boto3", "botocore", "jsonschema", "sqlite3")
+
+
+def parse_importtime(output: str) -> list[tuple[str, int, int, int]]:
+    """Parse -X importtime output to (module, depth, self us, cumulative us)."""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def direct_imports(entries: list[tuple], module: str) -> dict[str, int]:
+    """Return cumulative us of the modules imported by the module itself.
+    Nested imports are printed before the module which imports them.
+    """
+    children: dict[str, int] = {}
+    for name, depth, _, cumulative_us in entries:
+        if depth == 1:
+            children[name] = cumulative_us
+        elif depth == 0:
+            if name == module:
+                return children
+            children = {}
+    return {}
+
+
+def measure_import(module: str, cwd: Path) -> tuple[float, list[tuple]]:
+    """Import the module in a new interpreter, return its wall time and imports."""
+    env = {**os.environ, "PYTHONPATH": str(ROOT_DIR)}
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, parse_importtime(completed.stderr)
+
+
+def bench_startup(module: str, repeat: int, top: int) -> dict:
+    """Import the module repeat times and return medians of the timings."""
+    wall_times = []
+    import_times = []
+    imports = defaultdict(list)
+    loaded = set()
+    # main opens its log relative to the current dir on import
+    with tempfile.TemporaryDirectory(prefix="bench_") as workspace:
+        for _ in range(repeat):
+            wall_time, entries = measure_import(module, Path(workspace))
+            wall_times.append(wall_time)
+            import_times.extend(
+                cumulative_us
+                for name, depth, _, cumulative_us in entries
+                if name == module and depth == 0
+            )
+            for name, cumulative_us in direct_imports(entries, module).items():
+                imports[name].append(cumulative_us)
+            loaded.update(name.split(".")[0] for name, *_ in entries)
+    slowest = sorted(
+        ((statistics.median(times), name) for name, times in imports.items()),
+        reverse=True,
+    )[:top]
+    return {
+        "wall_seconds": statistics.median(wall_times),
+        "import_us": statistics.median(import_times),
+        "imports": [{"module": name, "us": us} for us, name in slowest],
+        "lazy_modules_loaded": sorted(set(LAZY_MODULES) & loaded),
+    }
+
+
+def check_regression(results: dict, baseline: dict, tolerance: float) -> Optional[str]:
+    """Return an error if the import time grew more than tolerance part."""
+    limit = baseline["startup"]["import_us"] * (1 + tolerance)
+    if results["startup"]["import_us"] > limit:
+        return (
+            f"import of {results['params']['module']} takes"
+            f" {results['startup']['import_us']:.0f} us, more than {limit:.0f} us"
+        )
+    new_lazy = set(results["startup"]["lazy_modules_loaded"]) - set(
+        baseline["startup"]["lazy_modules_loaded"]
+    )
+    if new_lazy:
+        return f"lazy modules are imported on startup: {', '.join(sorted(new_lazy))}"
+    return None
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to show")
+    parser.add_argument("--baseline", help="json file with a previous result")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed part of import time growth against the baseline",
+    )
+    parser.add_argument("--output", help="json file for the results, stdout by default")
+    return parser.parse_args(argv)
+
+
+def run(argv=None) -> dict:
+    """Run the benchmark and return the results."""
+    args = parse_args(argv)
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        "startup": bench_startup(args.module, args.repeat, args.top),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        error = check_regression(results, baseline, args.tolerance)
+        if error:
+            sys.exit(error)
+    return results
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,117 @@
+"""Synthetic catalogue pages and project configs shaped like the real ones."""
+
+import hashlib
+
+
+def item_sku(module_index: int, page: int, position: int) -> str:
+    """Return a sku of the item unique in the catalogue."""
+    return f"M{module_index}-P{page}-{position:04d}"
+
+
+def make_module_config(
+    base_url: str, module_index: int, pages: int, fields: int
+) -> dict:
+    """Make a paginated module config with sku, price, link and extra text fields."""
+    item_fields = {
+        "sku": {"tag": "span", "class": "cs-goods-sku", "text": True, "strip": True},
+        "price": {
+            "tag": "span",
+            "class": "cs-goods-price__value cs-goods-price__value_type_current",
+            "text": True,
+            "strip": True,
+        },
+        "link": {
+            "tag": "a",
+            "class": "cs-goods-title",
+            "attr": "href",
+            "prepend": base_url,
+        },
+    }
+    for field_index in range(max(0, fields - len(item_fields))):
+        item_fields[f"field_{field_index}"] = {
+            "tag": "span",
+            "class": f"cs-goods-data__field_{field_index}",
+            "text": True,
+            "strip": True,
+        }
+    return {
+        "paginator_pattern": f"{base_url}/m{module_index}/page_$page",
+        "paginator_count": pages,
+        "items_container": {"tag": "ul", "class": "cs-product-gallery"},
+        "single_item_container": {
+            "tag": "li",
+            "class": "cs-product-gallery__item js-productad",
+        },
+        "item_fields": item_fields,
+    }
+
+
+def make_project_config(
+    name: str, base_url: str, modules: int, pages: int, fields: int
+) -> dict:
+    """Make a project config with the modules."""
+    return {
+        "project_name": name,
+        "home_url": base_url,
+        "modules": [
+            make_module_config(base_url, module_index, pages, fields)
+            for module_index in range(modules)
+        ],
+    }
+
+
+def item_price(sku: str, revision: int = 0) -> str:
+    """Return a stable price of the item, a new revision changes it."""
+    digest = hashlib.blake2b(sku.encode(), digest_size=4).digest()
+    return f"{1000 + int.from_bytes(digest, 'big') % 90000 + revision}"
+
+
+def make_listing_page(
+    module_index: int,
+    page: int,
+    pages: int,
+    items: int,
+    fields: int,
+    revisions: dict[str, int] = None,
+    noise: int = 200,
+) -> bytes:
+    """Make a listing page with items between a header and a footer.
+    noise is a number of navigation links and footer paragraphs around the items,
+    real pages have a lot of markup outside of the items container.
+    """
+    revisions = revisions or {}
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Catalogue</title>",
+        "<script>var state = {};</script></head><body><header><nav>",
+    ]
+    parts.extend(
+        f'<a class="nav__link" href="/category/{i}">Category {i}</a>'
+        for i in range(noise)
+    )
+    parts.append('</nav></header><main><ul class="cs-product-gallery">')
+    for position in range(items):
+        sku = item_sku(module_index, page, position)
+        parts.append(
+            '<li class="cs-product-gallery__item js-productad">'
+            f'<a class="cs-goods-title" href="/p/{sku}.html">Радіатор {sku}</a>'
+            f'<span class="cs-goods-sku"> {sku} </span>'
+            '<span class="cs-goods-price__value cs-goods-price__value_type_current">'
+            f"{item_price(sku, revisions.get(sku, 0))} грн</span>"
+        )
+        parts.extend(
+            f'<span class="cs-goods-data__field_{field_index}">'
+            f" value {field_index} of {sku} </span>"
+            for field_index in range(max(0, fields - 3))
+        )
+        parts.append("</li>")
+    parts.append("</ul>")
+    if page < pages:
+        parts.append(
+            f'<a class="b-pager__link_type_next" href="page_{page + 1}">Next</a>'
+        )
+    parts.append("</main><footer>")
+    parts.extend(
+        f"<p class='footer__text'>Footer paragraph {i}</p>" for i in range(noise)
+    )
+    parts.append("</footer></body></html>")
+    return "".join(parts).encode("utf-8")
@@ -0,0 +1,232 @@
+"""Extraction plans compiled from module configs to scrap items with lxml."""
+
+import resource
+import time
+from typing import Callable, Optional, Tuple, Union
+
+from icecream import ic
+from lxml import etree
+from lxml.cssselect import CSSSelector
+from lxml.html import HtmlElement, HTMLParser, document_fromstring
+
+# matches an element with the class among others, like BeautifulSoup class_ does
+CLASS_TOKEN_PREDICATE = (
+    "contains(concat(' ', normalize-space(@class), ' '), $class_token)"
+)
+# several classes in one string are matched against the whole attribute
+CLASS_FULL_PREDICATE = "normalize-space(@class) = $class_full"
+
+# full - build the tree of the whole page,
+# targeted - build only the items container and stop parsing after it
+PARSE_MODES = ("full", "targeted")
+# bytes fed to the parser at once in the targeted mode
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+class TagSelector:
+    """Compiled XPath to find descendants by tag and class, like soup.find does."""
+
+    def __init__(self, tag: Optional[str] = None, class_name: Optional[str] = None):
+        expression = tag.lower() if tag else "*"
+        self._variables = {}
+        if class_name:
+            classes = class_name.split()
+            if len(classes) > 1:
+                expression += f"[{CLASS_FULL_PREDICATE}]"
+                self._variables["class_full"] = " ".join(classes)
+            else:
+                expression += f"[{CLASS_TOKEN_PREDICATE}]"
+                self._variables["class_token"] = f" {class_name.strip()} "
+        self._xpath = etree.XPath(f".//{expression}")
+        self._self_xpath = etree.XPath(f"self::{expression}")
+
+    def find_all(self, element: HtmlElement, limit: int = 0) -> list[HtmlElement]:
+        """Find all matching descendants of the element."""
+        result = self._xpath(element, **self._variables)
+        return result[:limit] if limit else result
+
+    def find(self, element: HtmlElement) -> Optional[HtmlElement]:
+        """Find the first matching descendant of the element or None."""
+        result = self._xpath(element, **self._variables)
+        return result[0] if result else None
+
+    def matches(self, element: HtmlElement) -> bool:
+        """Check if the element itself matches the tag and class."""
+        return bool(self._self_xpath(element, **self._variables))
+
+
+def to_bytes(source: Union[str, bytes], encoding: Optional[str]) -> Tuple[bytes, str]:
+    """Encode a str source, parsers get bytes to detect the charset themselves."""
+    if isinstance(source, str):
+        return source.encode("utf-8"), "utf-8"
+    return source, encoding
+
+
+def parse_html(
+    source: Union[str, bytes], encoding: Optional[str] = None
+) -> Optional[HtmlElement]:
+    """Parse html page to lxml tree, return None for an empty document.
+    Pass bytes of the response to skip decoding the page to str,
+    encoding is the charset from the response headers if there is any.
+    """
+    source, encoding = to_bytes(source, encoding)
+    try:
+        return document_fromstring(source, parser=HTMLParser(encoding=encoding))
+    except etree.ParserError:
+        return None
+
+
+def stream_element(
+    source: Union[str, bytes], selector: TagSelector, encoding: Optional[str] = None
+) -> Tuple[Optional[etree.ElementBase], int]:
+    """Parse the page until the first element matching the selector is closed.
+    The page is fed to the parser by chunks, the content before the element is
+    dropped while parsing and the chunks after the element are not parsed at all.
+    Return the element or None and the number of parsed elements.
+    """
+    source, encoding = to_bytes(source, encoding)
+    parser = etree.HTMLPullParser(events=("start", "end"), encoding=encoding)
+
+    def iter_events():
+        for offset in range(0, len(source), STREAM_CHUNK_SIZE):
+            parser.feed(source[offset : offset + STREAM_CHUNK_SIZE])
+            yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+
+    element, parsed = None, 0
+    try:
+        for event, elem in iter_events():
+            if event == "start":
+                parsed += 1
+                if element is None and selector.matches(elem):
+                    element = elem
+            elif elem is element:
+                return element, parsed
+            elif element is None:
+                # drop the parsed content outside the element to keep memory flat
+                elem.clear(keep_tail=True)
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+    except etree.LxmlError:
+        pass
+    return element, parsed
+
+
+def compile_field_ops(field_config: dict) -> list[Callable]:
+    """Compile field config to a flat list of operations applied to a found element.
+    The order is the same as before: text, strip, attr, prepend.
+    """
+    ops = []
+    if field_config.get("text"):
+        ops.append(lambda value: "".join(value.itertext()))
+    if field_config.get("strip"):
+        ops.append(lambda value: value.strip())
+    if field_config.get("attr"):
+        attr = field_config["attr"]
+        ops.append(lambda value: value.get(attr))
+    if field_config.get("prepend"):
+        prepend = field_config["prepend"]
+        ops.append(lambda value: prepend + value)
+    return ops
+
+
+class ExtractionPlan:
+    """Module config compiled once to selectors and field operations.
+
+    Compiling the config up front avoids walking item_fields with dict lookups
+    for every item, and lxml XPath avoids BeautifulSoup object overhead on pages
+    with hundreds of items.
+    """
+
+    def __init__(self, module: dict):
+        items_container = module.get("items_container")
+        single_item_container = module["single_item_container"]
+
+        self.items_container: Optional[Callable] = None
+        # selector to parse only the subtree with the items, there is no way
+        # to stream a page by a css selector, such modules are parsed fully
+        self.stream_selector: Optional[TagSelector] = None
+        if items_container:
+            # search for a container by tag and class or by selector
+            if items_container.get("tag"):
+                self.stream_selector = TagSelector(
+                    items_container["tag"], items_container.get("class")
+                )
+                self.items_container = self.stream_selector.find
+            else:
+                selector = CSSSelector(items_container["selector"])
+                self.items_container = lambda tree: next(iter(selector(tree)), None)
+        self.single_item = TagSelector(
+            single_item_container["tag"], single_item_container.get("class")
+        )
+        if not items_container:
+            # without a container the first single item is all we need
+            self.stream_selector = self.single_item
+        self.fields = [
+            (
+                name,
+                TagSelector(field_config.get("tag"), field_config.get("class")),
+                compile_field_ops(field_config),
+            )
+            for name, field_config in module["item_fields"].items()
+        ]
+
+    def find_items(self, tree: HtmlElement) -> list[HtmlElement]:
+        """Find all items on the page, only the first one if there is no container."""
+        if self.items_container is None:
+            return self.single_item.find_all(tree, limit=1)
+        container = self.items_container(tree)
+        if container is None:
+            return []
+        return self.single_item.find_all(container)
+
+    def parse_items(
+        self,
+        source: Union[str, bytes],
+        mode: str = "targeted",
+        encoding: Optional[str] = None,
+    ) -> Tuple[list[HtmlElement], dict]:
+        """Parse the page and find all items on it.
+        Return the items and parse stats: mode, bytes, parsed elements, seconds
+        and max RSS of the process in kilobytes after parsing.
+        """
+        started = time.perf_counter()
+        if mode == "targeted" and self.stream_selector is not None:
+            root, parsed = stream_element(source, self.stream_selector, encoding)
+            if root is None:
+                items = []
+            elif self.items_container is None:
+                items = [root]
+            else:
+                items = self.single_item.find_all(root)
+        else:
+            mode = "full"
+            tree = parse_html(source, encoding)
+            parsed = sum(1 for _ in tree.iter()) if tree is not None else 0
+            items = self.find_items(tree) if tree is not None else []
+
+        stats = {
+            "mode": mode,
+            "bytes": len(source),
+            "elements": parsed,
+            "seconds": round(time.perf_counter() - started, 6),
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+        return items, stats
+
+    def extract(self, item: HtmlElement) -> dict:
+        """Extract fields of a single item to a dict, empty fields are skipped."""
+        product_dict = {}
+        for name, selector, ops in self.fields:
+            result = selector.find(item)
+            # scrap data from the container
+            try:
+                for op in ops:
+                    result = op(result)
+            except (KeyError, AttributeError, TypeError) as e:
+                ic(e)
+                result = None
+            if isinstance(result, str) and result:
+                product_dict[name] = result
+        return product_dict
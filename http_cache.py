@@ -0,0 +1,92 @@
+"""Cache of http validators to skip pages that did not change since the last run."""
+
+import hashlib
+import json
+import threading
+
+from requests import Response
+
+from json_items_handlers import JsonItemsStorage
+
+
+def config_hash(config: dict) -> str:
+    """Return a hash of the config the pages are parsed with."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class ValidatorCache:
+    """Class to keep ETag, Last-Modified and body hash of every loaded url.
+
+    Entries are kept in a json items storage, so the cache lives next to the items
+    output on the local disk or on the S3 bucket.
+    Every entry keeps a hash of the config the page was parsed with, a page is
+    changed for another config, so changed item fields are applied to all pages.
+    """
+
+    def __init__(self, storage: JsonItemsStorage):
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = storage.read_json_file()
+        self._changed = False
+
+    def get_headers(self, url: str, config: str = "") -> dict:
+        """Return conditional request headers for the url parsed with the config."""
+        entry = self._entries.get(url, {})
+        headers = {}
+        if entry.get("config") != config:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def is_unchanged(self, url: str, response: Response, config: str = "") -> bool:
+        """Check if the page is the same as on the last run and remember its validators.
+        A page is unchanged on 304 response or when the body hash is the same,
+        the last one is for servers without ETag and Last-Modified support.
+        A page parsed with another config last time is changed.
+        """
+        if response.status_code == 304:
+            return self._entries.get(url, {}).get("config") == config
+        if response.status_code != 200:
+            return False
+
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        with self._lock:
+            entry = self._entries.get(url, {})
+            unchanged = (
+                entry.get("hash") == content_hash and entry.get("config") == config
+            )
+            self._entries[url] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "hash": content_hash,
+                "config": config,
+                "has_next": entry.get("has_next", True),
+            }
+            self._changed = True
+        return unchanged
+
+    def has_next(self, url: str) -> bool:
+        """Return if the page had a link to the next page when it was parsed."""
+        return self._entries.get(url, {}).get("has_next", True)
+
+    def set_has_next(self, url: str, has_next: bool) -> None:
+        """Remember if the page has a link to the next page."""
+        with self._lock:
+            self._entries.setdefault(url, {})["has_next"] = has_next
+            self._changed = True
+
+    def forget(self, url: str) -> None:
+        """Drop validators of the url, so the page is loaded in full next time."""
+        with self._lock:
+            if self._entries.pop(url, None) is not None:
+                self._changed = True
+
+    def save(self) -> None:
+        """Save the cache to the storage if anything changed."""
+        with self._lock:
+            if self._changed:
+                self.storage.save_to_json_file(self._entries)
+                self._changed = False
@@ -1,7 +1,28 @@
-"""Package for json items handlers on local and AWS S3 storages."""
+"""Package for json items handlers on local, AWS S3 and SQLite storages."""
 
+from importlib import import_module
+
+from .items_storage import JsonItemsStorage, item_fingerprint
 from .json_handler import JsonHandler
 from .local_items_storage import JsonItemsLocalStorage
-from .s3_items_storage import JsonItemsS3Storage
 
-__all__ = ["JsonHandler", "JsonItemsLocalStorage", "JsonItemsS3Storage"]
+# storages with their own dependencies are imported on the first use
+_LAZY_STORAGES = {
+    "JsonItemsS3Storage": ".s3_items_storage",
+    "SqliteItemsStorage": ".sqlite_items_storage",
+}
+
+__all__ = [
+    "JsonHandler",
+    "JsonItemsStorage",
+    "JsonItemsLocalStorage",
+    "JsonItemsS3Storage",
+    "SqliteItemsStorage",
+    "item_fingerprint",
+]
+
+
+def __getattr__(name: str):
+    if name in _LAZY_STORAGES:
+        return getattr(import_module(_LAZY_STORAGES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,320 @@
+"""Module with a base class for items storages with change accumulation."""
+
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from json_items_handlers import serialization
+from json_items_handlers.json_handler import JsonHandler
+
+load_dotenv()
+
+# format of written items files, any format is read: json, json-gzip, json-zstd, msgpack
+ITEMS_FILE_FORMAT = os.getenv("ITEMS_FILE_FORMAT", "json")
+# deltas are compacted into a new snapshot when there are this many of them
+SNAPSHOT_MAX_DELTAS = int(os.getenv("SNAPSHOT_MAX_DELTAS", 20))
+# removed items are kept as tombstones for this many days, 0 to drop them at once
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", 0))
+
+
+def item_fingerprint(item: dict) -> str:
+    """Return a stable hash of the item fields.
+    Fields are normalized by dumping them sorted, so the key order doesn't matter.
+    """
+    normalized = json.dumps(
+        item, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class JsonItemsStorage(JsonHandler):
+    """Base class for json files contains items.
+
+    The items file is a snapshot, changes made after it are appended to a deltas
+    file as records with old and new values of every changed sku, the current
+    state is the snapshot with all deltas replayed. Deltas are compacted into
+    a new snapshot every SNAPSHOT_MAX_DELTAS records or when they hold more
+    changes than half of the snapshot, so writes are proportional to the changes.
+    Changes are staged in memory with stage_items() and committed with one delta
+    by flush(), instead of rewriting the whole file for every changed item.
+    An index with a fingerprint of every item of the snapshot is kept, so changes
+    are found by comparing fingerprints without loading all items.
+    Removed items are dropped from the snapshot on compaction, with tombstone
+    retention they are moved to a tombstones file with the removal time.
+    Subclasses implement reading and writing of raw files.
+    Files are written in the compact _file_format and keep their names,
+    the format is detected on read.
+    """
+
+    _file_dir: str = "items_list_output"
+    _file_format: str = ITEMS_FILE_FORMAT
+    _snapshot_max_deltas: int = SNAPSHOT_MAX_DELTAS
+    _tombstone_retention_days: int = TOMBSTONE_RETENTION_DAYS
+    # called after every file read and write of all storages with the operation
+    # ("read" or "write"), file name, size in bytes and duration in seconds
+    io_hooks: list[Callable[[str, str, int, float], None]] = []
+
+    def __init__(self, file_name: str):
+        super().__init__(file_name)
+        self._pending: dict = {}
+        self._fingerprints: Optional[dict[str, str]] = None
+        self._items: Optional[dict] = None
+        self._deltas: Optional[list[dict]] = None
+        # all changes written by this instance: sku -> {"old": ..., "new": ...}
+        self.changes: dict[str, dict] = {}
+
+    @property
+    def index_file_name(self) -> str:
+        """Name of the fingerprints index file, output.json -> output.index.json."""
+        file_name = Path(self._file_name)
+        return file_name.stem + ".index" + file_name.suffix
+
+    @property
+    def deltas_file_name(self) -> str:
+        """Name of the deltas file, output.json -> output.deltas.json."""
+        file_name = Path(self._file_name)
+        return file_name.stem + ".deltas" + file_name.suffix
+
+    @property
+    def tombstones_file_name(self) -> str:
+        """Name of the tombstones file, output.json -> output.tombstones.json."""
+        file_name = Path(self._file_name)
+        return file_name.stem + ".tombstones" + file_name.suffix
+
+    def _read_file(self, file_name: str) -> Optional[bytes]:
+        """Read a file from the storage, return None if it is not exists."""
+        raise NotImplementedError
+
+    def _write_file(self, file_name: str, data: bytes) -> None:
+        """Write a file to the storage replacing it at once."""
+        raise NotImplementedError
+
+    def _read(self, file_name: str) -> Optional[bytes]:
+        """Read a file and report it to the io hooks."""
+        start = time.perf_counter()
+        data = self._read_file(file_name)
+        seconds = time.perf_counter() - start
+        for hook in self.io_hooks:
+            hook("read", file_name, len(data) if data is not None else 0, seconds)
+        return data
+
+    def _write(self, file_name: str, data: bytes) -> None:
+        """Write a file and report it to the io hooks."""
+        start = time.perf_counter()
+        self._write_file(file_name, data)
+        seconds = time.perf_counter() - start
+        for hook in self.io_hooks:
+            hook("write", file_name, len(data), seconds)
+
+    def _read_deltas(self) -> list[dict]:
+        """Read delta records written after the snapshot."""
+        if self._deltas is None:
+            data = self._read(self.deltas_file_name)
+            self._deltas = serialization.loads(data) if data is not None else []
+        return self._deltas
+
+    def _save_deltas(self) -> None:
+        """Save delta records."""
+        self._write(
+            self.deltas_file_name, serialization.dumps(self._deltas, self._file_format)
+        )
+
+    @staticmethod
+    def _replay(state: dict, deltas: list[dict]) -> dict:
+        """Apply delta records to the state, a removed sku has no new value.
+        Replaying a delta already included in the state doesn't change it.
+        """
+        for delta in deltas:
+            for sku, change in delta["changes"].items():
+                if change["new"] is None:
+                    state.pop(sku, None)
+                else:
+                    state[sku] = change["new"]
+        return state
+
+    def read_json_file(self):
+        """Read items, create the file if it is not exists.
+        Return the snapshot with all deltas replayed.
+        """
+        data = self._read(self._file_name)
+        if data is None:
+            self.save_to_json_file({})
+            return {}
+        self._deltas = None
+        self._items = self._replay(serialization.loads(data), self._read_deltas())
+        return dict(self._items)
+
+    def save_to_json_file(self, data) -> None:
+        """Save data as a new snapshot and drop deltas included in it.
+        An index of the old snapshot is rewritten for the new one, files without
+        an index like http validators don't get it.
+        """
+        has_index = (
+            self._fingerprints is not None
+            or self._read(self.index_file_name) is not None
+        )
+        self._write(self._file_name, serialization.dumps(data, self._file_format))
+        self._items = dict(data)
+        if has_index:
+            self._fingerprints = {
+                sku: item_fingerprint(item) for sku, item in self._items.items()
+            }
+            self._save_fingerprints()
+        if self._read_deltas():
+            self._deltas = []
+            self._save_deltas()
+
+    def append_to_json_file(self, data) -> None:
+        """Append changed items of the data to the deltas."""
+        if self._items is None:
+            self.read_json_file()
+        changes = {
+            sku: {"old": self._items.get(sku), "new": item}
+            for sku, item in data.items()
+            if self._items.get(sku) != item
+        }
+        self._append_delta(changes)
+
+    def _append_delta(self, changes: dict[str, dict]) -> None:
+        """Append a delta record, apply it to the state and compact if it's time."""
+        if not changes:
+            return
+        deltas = self._read_deltas()
+        delta = {"at": datetime.now().isoformat(timespec="seconds"), "changes": changes}
+        deltas.append(delta)
+        self._replay(self._items, [delta])
+        if self._fingerprints is not None:
+            for sku, change in changes.items():
+                if change["new"] is None:
+                    self._fingerprints.pop(sku, None)
+                else:
+                    self._fingerprints[sku] = item_fingerprint(change["new"])
+        for sku, change in changes.items():
+            old = self.changes.get(sku, change)["old"]
+            self.changes[sku] = {"old": old, "new": change["new"]}
+
+        changes_count = sum(len(delta["changes"]) for delta in deltas)
+        if (
+            len(deltas) >= self._snapshot_max_deltas
+            or changes_count > len(self._items) // 2
+        ):
+            self.compact()
+        else:
+            self._save_deltas()
+
+    def compact(self) -> None:
+        """Write the current state as a new snapshot with its index.
+        The snapshot and the index are written before the deltas are dropped,
+        after a crash in between the deltas are just replayed once more.
+        """
+        if self._items is None:
+            self.read_json_file()
+        if self._tombstone_retention_days:
+            self._save_tombstones()
+        if self._fingerprints is None:
+            self._fingerprints = {
+                sku: item_fingerprint(item) for sku, item in self._items.items()
+            }
+        self._write(
+            self._file_name, serialization.dumps(self._items, self._file_format)
+        )
+        self._save_fingerprints()
+        self._deltas = []
+        self._save_deltas()
+
+    def read_tombstones(self) -> dict[str, dict]:
+        """Read removed items by sku with their removal time, saved on compaction."""
+        data = self._read(self.tombstones_file_name)
+        return serialization.loads(data) if data is not None else {}
+
+    def _save_tombstones(self) -> None:
+        """Move items removed in the deltas to tombstones and drop expired ones."""
+        tombstones = self.read_tombstones()
+        for delta in self._read_deltas():
+            for sku, change in delta["changes"].items():
+                if change["new"] is not None:
+                    tombstones.pop(sku, None)
+                elif change["old"] is not None:
+                    tombstones[sku] = {"removed_at": delta["at"], "item": change["old"]}
+        expired_at = datetime.now() - timedelta(days=self._tombstone_retention_days)
+        self._write(
+            self.tombstones_file_name,
+            serialization.dumps(
+                {
+                    sku: tombstone
+                    for sku, tombstone in tombstones.items()
+                    if tombstone["removed_at"] >= expired_at.isoformat()
+                },
+                self._file_format,
+            ),
+        )
+
+    def read_fingerprints(self) -> dict[str, str]:
+        """Read fingerprints of all stored items by sku.
+        The index is of the snapshot, fingerprints of items in deltas are replayed
+        on top of it. Items files written before the index existed are migrated
+        on the first read, the index is built from the items and saved.
+        """
+        data = self._read(self.index_file_name)
+        if data is not None:
+            self._fingerprints = serialization.loads(data)
+            for delta in self._read_deltas():
+                for sku, change in delta["changes"].items():
+                    if change["new"] is None:
+                        self._fingerprints.pop(sku, None)
+                    else:
+                        self._fingerprints[sku] = item_fingerprint(change["new"])
+        else:
+            self._fingerprints = {
+                sku: item_fingerprint(item)
+                for sku, item in self.read_json_file().items()
+            }
+            self._save_fingerprints()
+        return dict(self._fingerprints)
+
+    def _save_fingerprints(self) -> None:
+        """Save fingerprints index."""
+        self._write(
+            self.index_file_name,
+            serialization.dumps(self._fingerprints, self._file_format),
+        )
+
+    def read_changes(self) -> dict[str, dict]:
+        """Return changes written by this instance by sku with old and new values."""
+        return dict(self.changes)
+
+    def close(self) -> None:
+        """Release resources of the storage, files have nothing to release."""
+
+    @property
+    def pending_count(self) -> int:
+        """Number of staged items waiting for flush."""
+        return len(self._pending)
+
+    def stage_items(self, data: dict) -> None:
+        """Stage items to be written to the storage on the next flush."""
+        self._pending.update(data)
+
+    def stage_removed(self, skus: Iterable[str]) -> None:
+        """Stage items to be removed from the storage on the next flush."""
+        self._pending.update(dict.fromkeys(skus))
+
+    def discard(self) -> None:
+        """Drop all staged items without writing them."""
+        self._pending = {}
+
+    def flush(self) -> bool:
+        """Write all staged items to the storage as one delta.
+        Return True if there was anything to write.
+        """
+        if not self._pending:
+            return False
+        self.append_to_json_file(self._pending)
+        self._pending = {}
+        return True
@@ -1,12 +1,13 @@
 """Module to work with json items files on local storage."""
 
-import json
 from pathlib import Path
+from typing import Optional
 
-from json_items_handlers.json_handler import JsonHandler
+from atomic_file import write_atomic
+from json_items_handlers.items_storage import JsonItemsStorage
 
 
-class JsonItemsLocalStorage(JsonHandler):
+class JsonItemsLocalStorage(JsonItemsStorage):
     """Class to work with json files contains items on local storage."""
 
     _file_dir: str = "items_list_output"
@@ -16,23 +17,13 @@ class JsonItemsLocalStorage(JsonHandler):
         # Check if the directory exists, and create it if it doesn't.
         Path(self._file_dir).mkdir(parents=True, exist_ok=True)
 
-    def read_json_file(self):
-        """Read json items file, create it if it is not exists."""
-        if not self.full_path.exists():
-            with open(self.full_path, "w", encoding="utf-8") as f:
-                json.dump({}, f)
-        with open(self.full_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data
-
-    def save_to_json_file(self, data) -> None:
-        """Save data to json file."""
-        with open(self.full_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-
-    def append_to_json_file(self, data) -> None:
-        """Append data to json file."""
-        existing_data = self.read_json_file()
-        existing_data.update(data)
-        with open(self.full_path, "w", encoding="utf-8") as f:
-            json.dump(existing_data, f, indent=2, ensure_ascii=False)
+    def _read_file(self, file_name: str) -> Optional[bytes]:
+        """Read a file from the storage dir, return None if it is not exists."""
+        try:
+            return (Path(self._file_dir) / file_name).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_file(self, file_name: str, data: bytes) -> None:
+        """Write a file to the storage dir replacing it at once."""
+        write_atomic(Path(self._file_dir) / file_name, data)
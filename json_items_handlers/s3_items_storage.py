@@ -1,69 +1,159 @@
 """Module to work with files on the AWS S3 bucket."""
 
-import json
+import hashlib
 import os
+import threading
+from collections import OrderedDict
+from typing import Optional
 
-import boto3
 from dotenv import load_dotenv
 from icecream import ic
 
-from json_items_handlers.json_handler import JsonHandler
+from json_items_handlers.items_storage import JsonItemsStorage
 
 load_dotenv()
 
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 10))
+# total size of objects kept in memory to skip downloads of not modified ones,
+# the least recently used objects are dropped first
+S3_OBJECTS_CACHE_BYTES = int(os.getenv("S3_OBJECTS_CACHE_BYTES", 64 * 1024 * 1024))
 
+_client = None
+_client_lock = threading.Lock()
 
-class JsonItemsS3Storage(JsonHandler):
+
+def get_s3_client():
+    """Return the S3 client shared by all storages, create it on the first call.
+    boto3 clients are thread safe, so one connection pool serves all projects.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                from botocore.config import Config
+
+                _client = boto3.client(
+                    service_name="s3",
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS),
+                )
+    return _client
+
+
+def content_etag(data: bytes) -> str:
+    """Return the ETag S3 assigns to the data uploaded with a single PUT."""
+    return '"' + hashlib.md5(data).hexdigest() + '"'
+
+
+def is_not_found(e: Exception) -> bool:
+    """Check if the error of an S3 call is a missing object."""
+    response = getattr(e, "response", {})
+    code = response.get("Error", {}).get("Code")
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return code in ("NoSuchKey", "404") or status == 404
+
+
+class JsonItemsS3Storage(JsonItemsStorage):
     """Class to work with json files contains items on AWS S3 bucket."""
 
     _file_dir: str = "items_list_output"
+    # last read or written object by key: (etag, data), the least recently
+    # used first, all objects take up to _objects_cache_bytes
+    _objects_cache: OrderedDict[str, tuple[str, bytes]] = OrderedDict()
+    _objects_cache_size: int = 0
+    _objects_cache_bytes: int = S3_OBJECTS_CACHE_BYTES
+    _objects_cache_lock = threading.Lock()
 
     def __init__(self, file_name: str):
         super().__init__(file_name)
         self.bucket_name = AWS_STORAGE_BUCKET_NAME
-        self.aws_access_key_id = AWS_ACCESS_KEY_ID
-        self.aws_secret_access_key = AWS_SECRET_ACCESS_KEY
-        self.s3 = boto3.resource(
-            service_name="s3",
-            aws_access_key_id=self.aws_access_key_id,
-            aws_secret_access_key=self.aws_secret_access_key,
-        )
-        self.s3_object = self.s3.Object(
-            bucket_name=self.bucket_name,
-            key=self.set_full_path(),
-        )
 
     def set_full_path(self) -> str:
         """Set full path to file on the S3 bucket."""
         return "/".join([self._file_dir, self._file_name])
 
-    def read_json_file(self):
-        """Read a json file from the S3 bucket."""
-        try:
-            content = json.loads(self.s3_object.get()["Body"].read().decode("utf-8"))
-            return content
-        except Exception as e:
-            ic("read_json_file", e)
-            self.save_to_json_file({})
-            return {}
+    def _get_key(self, file_name: str) -> str:
+        """Get S3 key of the file in the storage dir."""
+        return "/".join([self._file_dir, file_name])
+
+    @classmethod
+    def clear_objects_cache(cls) -> None:
+        with cls._objects_cache_lock:
+            cls._objects_cache.clear()
+            cls._objects_cache_size = 0
+
+    @classmethod
+    def _get_cached(cls, key: str) -> Optional[tuple[str, bytes]]:
+        with cls._objects_cache_lock:
+            cached = cls._objects_cache.get(key)
+            if cached:
+                cls._objects_cache.move_to_end(key)
+            return cached
 
-    def save_to_json_file(self, data) -> None:
-        """Save a json file to the S3 bucket."""
+    @classmethod
+    def _cache_object(cls, key: str, etag: Optional[str], data: bytes) -> None:
+        """Cache the object, drop it without etag or if it's too large to cache."""
+        with cls._objects_cache_lock:
+            old = cls._objects_cache.pop(key, None)
+            if old:
+                cls._objects_cache_size -= len(old[1])
+            if not etag or len(data) > cls._objects_cache_bytes:
+                return
+            cls._objects_cache[key] = (etag, data)
+            cls._objects_cache_size += len(data)
+            while cls._objects_cache_size > cls._objects_cache_bytes:
+                _, (_, dropped) = cls._objects_cache.popitem(last=False)
+                cls._objects_cache_size -= len(dropped)
+
+    def _read_file(self, file_name: str) -> Optional[bytes]:
+        """Read a file from the S3 bucket, return None if it is not exists.
+        The object is only downloaded if its ETag differs from the cached one.
+        Other errors are raised, so a file is never taken for a missing one
+        and overwritten because of a failed request.
+        """
+        key = self._get_key(file_name)
+        cached = self._get_cached(key)
+        params = {"Bucket": self.bucket_name, "Key": key}
+        if cached:
+            params["IfNoneMatch"] = cached[0]
         try:
-            self.s3_object.put(
-                Body=json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
-            )
+            response = get_s3_client().get_object(**params)
         except Exception as e:
-            ic("save_to_json_file", e)
+            status = getattr(e, "response", {}).get("ResponseMetadata", {})
+            if cached and status.get("HTTPStatusCode") == 304:
+                return cached[1]
+            self._cache_object(key, None, b"")
+            if is_not_found(e):
+                return None
+            ic("read_file", file_name, e)
+            raise
+        data = response["Body"].read()
+        self._cache_object(key, response.get("ETag"), data)
+        return data
 
-    def append_to_json_file(self, data) -> None:
-        """Append data to the existing json file on S3 bucket."""
+    def _write_file(self, file_name: str, data: bytes) -> None:
+        """Write a file to the S3 bucket, skip it if the content is unchanged.
+        A single PUT replaces the object atomically, readers never see a partial file.
+        Errors are raised, so files written after this one, like emptied deltas
+        after a snapshot, are not written over a failed one.
+        """
+        key = self._get_key(file_name)
+        etag = content_etag(data)
+        cached = self._get_cached(key)
+        if cached and cached[0] == etag:
+            return
         try:
-            existing_data = self.read_json_file()
-            existing_data.update(data)
-            self.save_to_json_file(existing_data)
+            response = get_s3_client().put_object(
+                Bucket=self.bucket_name, Key=key, Body=data
+            )
         except Exception as e:
-            ic("append_to_json_file", e)
+            # the object may be written anyway, its cached content is unknown
+            self._cache_object(key, None, b"")
+            ic("write_file", file_name, e)
+            raise
+        self._cache_object(key, response.get("ETag", etag), data)
@@ -0,0 +1,57 @@
+"""Module to serialize items files in different on-disk formats."""
+
+import gzip
+import json
+from typing import Any
+
+FORMATS = ("json", "json-gzip", "json-zstd", "msgpack")
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# msgpack fixmap, map16 and map32 markers of items files and indexes,
+# fixarray, array16 and array32 markers of deltas files,
+# json always starts with an ascii character
+MSGPACK_MARKERS = frozenset(range(0x80, 0xA0)) | {0xDC, 0xDD, 0xDE, 0xDF}
+
+
+def _import_optional(module_name: str, file_format: str):
+    """Import a module needed only by one of the formats."""
+    try:
+        return __import__(module_name)
+    except ImportError as e:
+        raise ImportError(
+            f"{module_name} package is required for the {file_format} format"
+        ) from e
+
+
+def dumps(data: Any, file_format: str = "json") -> bytes:
+    """Serialize data to bytes in the format."""
+    if file_format == "msgpack":
+        msgpack = _import_optional("msgpack", file_format)
+        return msgpack.packb(data, use_bin_type=True)
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown file format {file_format}, use one of {FORMATS}")
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if file_format == "json-gzip":
+        # fixed mtime keeps the output of the same data identical
+        return gzip.compress(raw, mtime=0)
+    if file_format == "json-zstd":
+        zstandard = _import_optional("zstandard", file_format)
+        return zstandard.ZstdCompressor().compress(raw)
+    return raw
+
+
+def loads(raw: bytes) -> Any:
+    """Deserialize data from bytes in any of the formats.
+    The format is detected by the leading bytes, so files written in
+    another format or before compact files (indented json) are still read.
+    """
+    if raw.startswith(GZIP_MAGIC):
+        return json.loads(gzip.decompress(raw))
+    if raw.startswith(ZSTD_MAGIC):
+        zstandard = _import_optional("zstandard", "json-zstd")
+        return json.loads(zstandard.ZstdDecompressor().decompressobj().decompress(raw))
+    if raw and raw[0] in MSGPACK_MARKERS:
+        msgpack = _import_optional("msgpack", "msgpack")
+        return msgpack.unpackb(raw, raw=False)
+    return json.loads(raw)
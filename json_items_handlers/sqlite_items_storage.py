@@ -0,0 +1,280 @@
+"""Module to work with items stored in a SQLite database."""
+
+import json
+import sqlite3
+from collections.abc import MutableMapping
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+from json_items_handlers.items_storage import JsonItemsStorage, item_fingerprint
+
+# max number of sku parameters in one query, the lowest sqlite limit is 999
+SQLITE_MAX_VARIABLES = 900
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    project TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    data TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (project, sku)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS items_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    old_data TEXT,
+    new_data TEXT,
+    changed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_history_project_sku
+    ON items_history (project, sku, changed_at);
+"""
+
+
+class SqliteFingerprintIndex(MutableMapping):
+    """Fingerprints of the project items by sku looked up in the database.
+
+    Fingerprints set after the last flush of the storage are kept in memory
+    until it writes the staged items, so memory is bounded by the staged items
+    and not by the number of items of the project.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, project: str):
+        # not the storage itself, so the storage and its index are not a cycle
+        self.connection = connection
+        self.project = project
+        # sku -> fingerprint, None for a deleted sku
+        self._unsaved: dict[str, Optional[str]] = {}
+
+    def __getitem__(self, sku: str) -> str:
+        if sku in self._unsaved:
+            fingerprint = self._unsaved[sku]
+        else:
+            row = self.connection.execute(
+                "SELECT fingerprint FROM items WHERE project = ? AND sku = ?",
+                (self.project, sku),
+            ).fetchone()
+            fingerprint = row[0] if row else None
+        if fingerprint is None:
+            raise KeyError(sku)
+        return fingerprint
+
+    def __setitem__(self, sku: str, fingerprint: str) -> None:
+        self._unsaved[sku] = fingerprint
+
+    def __delitem__(self, sku: str) -> None:
+        self[sku]
+        self._unsaved[sku] = None
+
+    def __iter__(self) -> Iterator[str]:
+        yield from (sku for sku, value in self._unsaved.items() if value is not None)
+        rows = self.connection.execute(
+            "SELECT sku FROM items WHERE project = ?", (self.project,)
+        )
+        yield from (sku for (sku,) in rows if sku not in self._unsaved)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def clear_unsaved(self) -> None:
+        """Forget fingerprints set after the last flush, call after a flush."""
+        self._unsaved = {}
+
+
+class SqliteItemsStorage(JsonItemsStorage):
+    """Class to work with items of a project in a SQLite database.
+
+    All projects share one database in WAL mode, items are keyed by project and sku.
+    Every change of an item is appended to the history table with the old
+    and the new value, so there are no deltas files and nothing to compact.
+    It has the same interface as json items storages.
+    Without keep_changes the changes are not collected in memory, read_changes()
+    reads them back from the history.
+    """
+
+    _file_dir: str = "items_list_output"
+    _db_name: str = "items.sqlite3"
+
+    def __init__(self, file_name: str, keep_changes: bool = True):
+        super().__init__(file_name)
+        Path(self._file_dir).mkdir(parents=True, exist_ok=True)
+        self.project = file_name
+        self.keep_changes = keep_changes
+        self._index: Optional[SqliteFingerprintIndex] = None
+        self.connection = sqlite3.connect(
+            Path(self._file_dir) / self._db_name, timeout=30
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        # changes written by this instance have a greater id
+        (self._last_history_id,) = self.connection.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM items_history"
+        ).fetchone()
+
+    def read_json_file(self) -> dict:
+        """Read all items of the project."""
+        rows = self.connection.execute(
+            "SELECT sku, data FROM items WHERE project = ?", (self.project,)
+        )
+        return {sku: json.loads(data) for sku, data in rows}
+
+    def read_fingerprints(self) -> dict[str, str]:
+        """Read fingerprints of all items of the project by sku."""
+        rows = self.connection.execute(
+            "SELECT sku, fingerprint FROM items WHERE project = ?", (self.project,)
+        )
+        return dict(rows)
+
+    def fingerprint_index(self) -> SqliteFingerprintIndex:
+        """Return fingerprints of the project items by sku without loading them."""
+        if self._index is None:
+            self._index = SqliteFingerprintIndex(self.connection, self.project)
+        return self._index
+
+    def read_changes(self) -> dict[str, dict]:
+        """Return changes written by this instance by sku with old and new values."""
+        if self.keep_changes:
+            return super().read_changes()
+        rows = self.connection.execute(
+            "SELECT sku, old_data, new_data FROM items_history"
+            " WHERE project = ? AND id > ? ORDER BY id",
+            (self.project, self._last_history_id),
+        )
+        changes: dict[str, dict] = {}
+        for sku, old_data, new_data in rows:
+            old = changes[sku]["old"] if sku in changes else _loads(old_data)
+            changes[sku] = {"old": old, "new": _loads(new_data)}
+        return changes
+
+    def save_to_json_file(self, data) -> None:
+        """Replace all items of the project with the data."""
+        with self.connection:
+            stored_skus = {
+                sku
+                for (sku,) in self.connection.execute(
+                    "SELECT sku FROM items WHERE project = ?", (self.project,)
+                )
+            }
+            removed = dict.fromkeys(stored_skus - data.keys())
+            self._upsert({**data, **removed})
+
+    def append_to_json_file(self, data) -> None:
+        """Insert or update items of the project in one transaction."""
+        with self.connection:
+            self._upsert(data)
+
+    def flush(self) -> bool:
+        """Write all staged items in one transaction.
+        Return True if there was anything to write.
+        """
+        if not self._pending:
+            return False
+        self.append_to_json_file(self._pending)
+        self._pending = {}
+        if self._index is not None:
+            self._index.clear_unsaved()
+        return True
+
+    def discard(self) -> None:
+        """Drop all staged items and fingerprints set for them."""
+        super().discard()
+        if self._index is not None:
+            self._index.clear_unsaved()
+
+    def compact(self) -> None:
+        """Nothing to compact, items are updated in place."""
+
+    def _read_stored(self, skus) -> dict[str, str]:
+        """Read stored json of the items by sku."""
+        stored = {}
+        skus = list(skus)
+        for i in range(0, len(skus), SQLITE_MAX_VARIABLES):
+            chunk = skus[i : i + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            stored.update(
+                self.connection.execute(
+                    "SELECT sku, data FROM items"
+                    f" WHERE project = ? AND sku IN ({placeholders})",
+                    (self.project, *chunk),
+                )
+            )
+        return stored
+
+    def _upsert(self, data: dict) -> None:
+        """Upsert items, delete items without value and append their changes
+        to the history, call in a transaction.
+        """
+        changed_at = datetime.now().isoformat(timespec="seconds")
+        stored = self._read_stored(data)
+        rows = []
+        for sku, item in data.items():
+            new_data = None if item is None else json.dumps(item, ensure_ascii=False)
+            if stored.get(sku) != new_data:
+                rows.append((sku, stored.get(sku), new_data, item))
+        self.connection.executemany(
+            """
+            INSERT INTO items_history (project, sku, old_data, new_data, changed_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                (self.project, sku, old_data, new_data, changed_at)
+                for sku, old_data, new_data, _ in rows
+            ),
+        )
+        self.connection.executemany(
+            """
+            INSERT INTO items (project, sku, data, fingerprint, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (project, sku) DO UPDATE SET
+                data = excluded.data,
+                fingerprint = excluded.fingerprint,
+                updated_at = excluded.updated_at
+            """,
+            (
+                (self.project, sku, new_data, item_fingerprint(item), changed_at)
+                for sku, _, new_data, item in rows
+                if item is not None
+            ),
+        )
+        self.connection.executemany(
+            "DELETE FROM items WHERE project = ? AND sku = ?",
+            ((self.project, sku) for sku, _, _, item in rows if item is None),
+        )
+        if not self.keep_changes:
+            return
+        for sku, old_data, _, item in rows:
+            old = self.changes.get(sku, {}).get("old", json.loads(old_data or "null"))
+            self.changes[sku] = {"old": old, "new": item}
+
+    def get_history(self, sku: Optional[str] = None) -> list[dict]:
+        """Return changes of the project items from the oldest to the newest."""
+        query = (
+            "SELECT sku, old_data, new_data, changed_at FROM items_history"
+            " WHERE project = ?"
+        )
+        params: tuple = (self.project,)
+        if sku is not None:
+            query += " AND sku = ?"
+            params += (sku,)
+        rows = self.connection.execute(query + " ORDER BY id", params)
+        return [
+            {
+                "sku": sku,
+                "old": json.loads(old_data) if old_data else None,
+                "new": json.loads(new_data) if new_data else None,
+                "changed_at": changed_at,
+            }
+            for sku, old_data, new_data, changed_at in rows
+        ]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.connection.close()
+
+
+def _loads(data: Optional[str]):
+    return json.loads(data) if data else None
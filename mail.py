@@ -1,62 +1,248 @@
 """Email worker."""
 
+import json
 import logging
 import os
 import smtplib
 import ssl
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from email.message import Message
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Callable, Iterator, Optional
 
 from dotenv import load_dotenv
 from icecream import ic
 
+from run_journal import merge_notifications
+
 load_dotenv()
 
 smtp_server = os.getenv("SMTP_SERVER")
-smtp_port = int(os.getenv("SMTP_PORT"))
+smtp_port = int(os.getenv("SMTP_PORT", 465))
 smtp_username = os.getenv("SMTP_USERNAME")
 smtp_password = os.getenv("SMTP_PASSWORD")
+# 0 connects without TLS, like to a local smtp relay
+smtp_ssl = bool(int(os.getenv("SMTP_SSL", 1)))
 
 sender = os.getenv("SENDER")
+# one or more addresses separated by commas
 receiver = os.getenv("RECEIVER")
 
+# send notifications of a run in one digest email, otherwise every notification
+# is sent as a separate email over one smtp session
+EMAIL_DIGEST = bool(int(os.getenv("EMAIL_DIGEST", 1)))
+
+
+def get_receivers() -> list[str]:
+    """Return addresses of all receivers."""
+    return [address.strip() for address in (receiver or "").split(",") if address]
+
 
-def send_email(subject: str, project_name: str = None, json_file_path=None):
-    """Send email."""
+def json_attachment(project_name: Optional[str], json_data) -> MIMEApplication:
+    """Return json_data as an indented json attachment."""
+    attachment = MIMEApplication(
+        json.dumps(json_data, indent=2, ensure_ascii=False).encode("utf-8"),
+        _subtype="json",
+    )
+    attachment.add_header(
+        "Content-Disposition",
+        "attachment",
+        filename=f"{project_name}_{datetime.now()}.json",
+    )
+    return attachment
+
+
+def build_message(
+    subject: str, body: Optional[str] = None, attachments: tuple = ()
+) -> MIMEMultipart:
+    """Build an email to all receivers."""
     m = MIMEMultipart()
     m.add_header("from", sender)
-    m.add_header("to", receiver)
+    m.add_header("to", ", ".join(get_receivers()))
     m.add_header("subject", subject)
+    if body:
+        m.attach(MIMEText(body, "plain", "utf-8"))
+    for attachment in attachments:
+        m.attach(attachment)
+    return m
+
+
+class SmtpSession:
+    """Class to send several emails over one authenticated smtp connection.
+    It connects on the first email and reconnects once if the server closed
+    the connection.
+    """
 
-    # Create email body as an unpacked dicts
-    # letter_lines = []
-    # if changes:
-    #     for item in changes:
-    #         for key, value in item.items():
-    #             letter_lines.append(f"{key}: {value}")
-    #         letter_lines.append("*" * 20)
-    #     email_str = "\n".join(letter_lines)
-    #     m.set_payload(payload=email_str, charset="utf-8")
-
-    if json_file_path:
-        with open(json_file_path, "rb") as file:
-            attachment = MIMEApplication(file.read(), _subtype="json")
-            attachment.add_header(
-                "Content-Disposition",
-                "attachment",
-                filename=f"{project_name}_{datetime.now()}.json",
+    def __init__(self):
+        self._server: Optional[smtplib.SMTP] = None
+
+    def connect(self) -> smtplib.SMTP:
+        if smtp_ssl:
+            server = smtplib.SMTP_SSL(
+                smtp_server, smtp_port, context=ssl.create_default_context(), timeout=20
             )
-            m.attach(attachment)
+        else:
+            server = smtplib.SMTP(smtp_server, smtp_port, timeout=20)
+        if smtp_username:
+            server.login(smtp_username, smtp_password)
+        return server
+
+    def send(self, message: Message) -> None:
+        """Send the email to all receivers."""
+        if self._server is None:
+            self._server = self.connect()
+        try:
+            self._server.sendmail(sender, get_receivers(), message.as_string())
+        except smtplib.SMTPServerDisconnected:
+            self._server = self.connect()
+            self._server.sendmail(sender, get_receivers(), message.as_string())
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except smtplib.SMTPException:
+                pass
+            self._server = None
+
+    def __enter__(self) -> "SmtpSession":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
 
-    context = ssl.create_default_context()
+def send_messages(messages: list[MIMEMultipart]) -> int:
+    """Send emails over one smtp session. Return the number of sent emails."""
+    sent = 0
     try:
-        with smtplib.SMTP_SSL(
-            smtp_server, smtp_port, context=context, timeout=20
-        ) as server:
-            server.login(smtp_username, smtp_password)
-            server.sendmail(sender, receiver, m.as_string())
-        ic("Email sent")
+        with SmtpSession() as session:
+            for message in messages:
+                session.send(message)
+                sent += 1
+                ic("Email sent")
     except Exception as e:
         logging.error(e)
         ic(e)
+    return sent
+
+
+class Notifier:
+    """Class to collect notifications of running projects.
+
+    Every run collects its notifications and sends them when it ends, in one
+    digest email or as separate emails over one smtp session. A run inside
+    another one, like a project run in a batch of projects, adds them to the outer
+    run. Threads take part in a run only if they run in a copy of its contextvars
+    context. A notification outside of a run is sent at once.
+    A notification is merged with a collected one with the same subject.
+    With a journal collected notifications are recorded in it until they are
+    sent, so they survive a restart of the run.
+    """
+
+    def __init__(
+        self,
+        digest: bool = EMAIL_DIGEST,
+        send_messages: Callable[[list], int] = send_messages,
+    ):
+        self.digest = digest
+        self.send_messages = send_messages
+        self._lock = threading.Lock()
+        # notifications of the current run
+        self._run: ContextVar[Optional[list[dict]]] = ContextVar(
+            f"notifications_{id(self)}", default=None
+        )
+        # notifications of an interrupted run, sent with the next one
+        self._notifications: list[dict] = []
+        self.journal = None
+
+    @contextmanager
+    def run(self) -> Iterator[None]:
+        """Collect notifications in the block, send them when it ends."""
+        if self._run.get() is not None:
+            # notifications are sent by the outer run
+            yield
+            return
+        notifications: list[dict] = []
+        token = self._run.set(notifications)
+        try:
+            yield
+        finally:
+            self._run.reset(token)
+            self.send(notifications)
+
+    def notify(
+        self, subject: str, project_name: Optional[str] = None, json_data=None
+    ) -> None:
+        """Add a notification, json_data is attached as indented json."""
+        notification = {
+            "subject": subject,
+            "project_name": project_name,
+            "data": json_data,
+        }
+        if self.journal:
+            self.journal.add_notification(notification)
+        notifications = self._run.get()
+        if notifications is None:
+            self.send([notification])
+            return
+        with self._lock:
+            notifications[:] = merge_notifications(notifications, [notification])
+
+    def extend(self, notifications: list[dict]) -> None:
+        """Add notifications of an interrupted run, they are sent with the next run."""
+        with self._lock:
+            self._notifications = merge_notifications(
+                self._notifications, notifications
+            )
+
+    def send(self, notifications: Optional[list[dict]] = None) -> int:
+        """Send the notifications with the ones of an interrupted run,
+        only the last ones by default. Return the number of sent emails.
+        """
+        with self._lock:
+            notifications = merge_notifications(
+                self._notifications, notifications or []
+            )
+            self._notifications = []
+        if not notifications:
+            return 0
+        if self.digest:
+            messages = [self.build_digest(notifications)]
+        else:
+            messages = [
+                build_message(
+                    notification["subject"],
+                    attachments=self._attachments([notification]),
+                )
+                for notification in notifications
+            ]
+        sent = self.send_messages(messages)
+        if self.journal and sent == len(messages):
+            self.journal.clear_notifications(notifications)
+        return sent
+
+    def build_digest(self, notifications: list[dict]) -> MIMEMultipart:
+        """Build one email with subjects of all notifications and their data."""
+        if len(notifications) == 1:
+            subject = notifications[0]["subject"]
+        else:
+            subject = f"{len(notifications)} notifications from the monitoring"
+        body = "\n".join(notification["subject"] for notification in notifications)
+        return build_message(subject, body, self._attachments(notifications))
+
+    @staticmethod
+    def _attachments(notifications: list[dict]) -> tuple:
+        return tuple(
+            json_attachment(notification["project_name"], notification["data"])
+            for notification in notifications
+            if notification["data"] is not None
+        )
+
+
+notifier = Notifier()
@@ -1,28 +1,112 @@
 """Main file to scrap items."""
 
+import contextvars
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
+import threading
 import time
+from collections import deque
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from contextlib import ExitStack, closing, contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Tuple, Union
+from typing import (
+    TYPE_CHECKING,
+    Iterable,
+    Iterator,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlsplit
 
-import jsonschema
 import requests
-import schedule
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from icecream import ic
+from lxml.html import HtmlElement
 from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+from extraction import ExtractionPlan, TagSelector, stream_element
+from http_cache import ValidatorCache, config_hash
+from json_items_handlers import (
+    JsonHandler,
+    JsonItemsLocalStorage,
+    JsonItemsStorage,
+    item_fingerprint,
+)
+from mail import notifier
+from metrics import (
+    current_labels,
+    hosts_summary,
+    metric_labels,
+    metrics,
+    track_peak_rss,
+    write_run_summary,
+)
+from pipeline import ordered_map
+from rate_limiter import HostRateLimiter
+from removals import ModuleScan, module_key
+from run_journal import JOURNAL_FILE, RunJournal, merge_changes
+from scheduler import CronSchedule, IntervalSchedule, ProjectScheduler, daily_schedule
+from sharding import LocalRecordStore, S3RecordStore, Shard
 
-from json_items_handlers import JsonHandler, JsonItemsLocalStorage, JsonItemsS3Storage
-from mail import send_email
+if TYPE_CHECKING:
+    import jsonschema
 
 load_dotenv()
 
-RUN_AT_START = bool(int(os.getenv("RUN_AT_START")))
+RUN_AT_START = bool(int(os.getenv("RUN_AT_START", 0)))
 SCHEDULE_TIME = os.getenv("SCHEDULE_TIME")
-USE_AWS_S3_STORAGE = bool(int(os.getenv("USE_AWS_S3_STORAGE")))
+# max random delay of scheduled project runs in seconds
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", 60))
+# how often the scheduler checks project configs for changes, in seconds
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", 60))
+# dir for metrics in the Prometheus text format and json run summaries, empty to disable
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+USE_AWS_S3_STORAGE = bool(int(os.getenv("USE_AWS_S3_STORAGE", 0)))
+USE_SQLITE_STORAGE = bool(int(os.getenv("USE_SQLITE_STORAGE", 0)))
+# id of this worker node, projects are split between workers with ids,
+# empty checks all projects
+WORKER_ID = os.getenv("WORKER_ID", "")
+# dir for heartbeats of workers and leases of projects without S3
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+# diff and save items page by page with fingerprints looked up in the SQLite
+# storage, so memory is bounded by the page size and not by the catalogue size
+STREAM_ITEMS = bool(int(os.getenv("STREAM_ITEMS", 0)))
+# skip parsing of pages not modified since the last run
+USE_HTTP_CACHE = bool(int(os.getenv("USE_HTTP_CACHE", 1)))
+# remove items not found on complete scans of their modules
+DETECT_REMOVED_ITEMS = bool(int(os.getenv("DETECT_REMOVED_ITEMS", 1)))
+# fetch engine limits
+MAX_CONCURRENCY_PER_HOST = int(os.getenv("MAX_CONCURRENCY_PER_HOST", 2))
+REQUESTS_PER_SECOND = float(os.getenv("REQUESTS_PER_SECOND", 0))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 8))
+PROJECT_WORKERS = int(os.getenv("PROJECT_WORKERS", 4))
+# processes to parse pages in, 0 parses in the project threads
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", 0))
+# pages of one project waiting for or being parsed at once
+PARSE_QUEUE_SIZE = int(os.getenv("PARSE_QUEUE_SIZE", 4))
+# http session settings, timeouts are in seconds
+CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("READ_TIMEOUT", 30))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
+RETRY_BACKOFF_FACTOR = float(os.getenv("RETRY_BACKOFF_FACTOR", 0.5))
+# "targeted" parses only the items container, "full" builds the whole page tree
+PARSE_MODE = os.getenv("PARSE_MODE", "targeted")
+# upper bound of pages for paginators without paginator_count
+MAX_PAGINATOR_PAGES = int(os.getenv("MAX_PAGINATOR_PAGES", 100))
 
 logging.basicConfig(
     filename="run.log",
@@ -33,36 +117,143 @@ logging.basicConfig(
 
 
 class RequestHandler:
-    """Class to work with requests."""
+    """Class to work with requests.
+    Every host gets its own pooled session with keep-alive connections and retries.
+    Requests to the same host are limited by concurrency and requests per second,
+    so the instance can be shared between threads.
+    """
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_concurrency_per_host: int = 2,
+        requests_per_second: float = 0,
+        timeout: Tuple[float, float] = (CONNECT_TIMEOUT, READ_TIMEOUT),
+        max_retries: int = MAX_RETRIES,
+        backoff_factor: float = RETRY_BACKOFF_FACTOR,
+    ):
         self.__headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
             "Chrome/111.0.0.0 Safari/537.36"
         }
+        self.limiter = HostRateLimiter(
+            max_concurrency=max_concurrency_per_host,
+            requests_per_second=requests_per_second,
+        )
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+        self._sessions: dict[str, requests.Session] = {}
+        self._stats: dict[str, dict] = {}
 
     def set_headers(self, headers: dict) -> None:
         """Set headers."""
         self.__headers = headers
 
-    def read_url(self, url: str, delay: int = 0) -> Response:
-        """Read url and return response. Delay is in seconds."""
-        response = requests.get(url, headers=self.__headers)
-        time.sleep(delay)
+    def get_session(self, host: str) -> requests.Session:
+        """Get or create a session with a connection pool for the host."""
+        with self._lock:
+            if host not in self._sessions:
+                retry = Retry(
+                    total=self.max_retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.limiter.max_concurrency,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+                self._stats[host] = {
+                    "requests": 0,
+                    "connections": 0,
+                    "handshakes_saved": 0,
+                    "bytes": 0,
+                    "retries": 0,
+                    "errors": 0,
+                }
+            return self._sessions[host]
+
+    def read_url(self, url: str, headers: Optional[dict] = None) -> Response:
+        """Read url and return response. Waits for the host limits before sending.
+        Headers are added to the handler headers for this request only.
+        """
+        host = urlsplit(url).netloc
+        session = self.get_session(host)
+        # let a custom headers override the compression negotiation
+        headers = {
+            "Accept-Encoding": ACCEPT_ENCODING,
+            **self.__headers,
+            **(headers or {}),
+        }
+        with self.limiter.limit(host), metrics.timer("fetch") as sample:
+            try:
+                response = session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException:
+                with self._lock:
+                    self._stats[host]["errors"] += 1
+                raise
+            sample["nbytes"] = len(response.content)
+            if not response.ok:
+                sample["errors"] = 1
+        self._update_stats(host, session, url, response)
         return response
 
+    def _update_stats(
+        self, host: str, session: requests.Session, url: str, response: Response
+    ) -> None:
+        """Update host stats with the data of the finished request."""
+        raw = response.raw
+        retries = len(raw.retries.history) if raw.retries else 0
+        # bytes read from the socket, compressed if the server sent it compressed
+        received = raw.tell() or len(response.content)
+        pool = session.get_adapter(url).poolmanager.connection_from_url(url)
+        with self._lock:
+            stats = self._stats[host]
+            stats["requests"] += 1
+            stats["retries"] += retries
+            stats["bytes"] += received
+            stats["connections"] = pool.num_connections
+            stats["handshakes_saved"] = stats["requests"] - stats["connections"]
+
+    def get_stats(self) -> dict[str, dict]:
+        """Return a copy of per-host stats collected since the handler was created."""
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._stats.items()}
+
+    def close(self) -> None:
+        """Close all sessions and their connections."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+class InvalidProjectConfig(ValueError):
+    """Project config does not match the project schema."""
+
 
 class JsonProjectConfig(JsonHandler):
     """Class to work with json files with project config."""
 
     _file_dir: str = "projects_configs"
 
-    def __init__(self, file_name: str):
+    def __init__(self, file_name: str, project_root: Optional[dict] = None):
         super().__init__(file_name)
-        self._project_root = self.get_project_config()
+        if project_root is None:
+            project_root = self.get_project_config()
+        self._project_root = project_root
         self.project_name = self._project_root["project_name"]
         self.home_url = self._project_root["home_url"]
         self.modules = self._project_root["modules"]
+        self.schedule = self._project_root.get("schedule")
+        self._extraction_plans: dict[int, ExtractionPlan] = {}
 
     def get_project_config(self) -> dict:
         """Get project config."""
@@ -71,19 +262,16 @@ class JsonProjectConfig(JsonHandler):
         return self.read_json_file()
 
     def validate_json_project(self):
-        """Read json project file and validate it against schema."""
-        path_to_schema = Path("schema") / "project_schema.json"
-
-        # Load the JSON schema file
-        with open(path_to_schema, "r", encoding="utf-8") as f:
-            schema = json.load(f)
-
-        # Load the JSON data file
-        with open(self.full_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        """Validate the project config against schema."""
+        validate_project_root(self._project_root)
 
-        # Validate the data against the schema
-        jsonschema.validate(instance=data, schema=schema)
+    def get_extraction_plan(self, module_index: int) -> ExtractionPlan:
+        """Get the module config compiled to an extraction plan, it is compiled once."""
+        if module_index not in self._extraction_plans:
+            self._extraction_plans[module_index] = ExtractionPlan(
+                self.modules[module_index]
+            )
+        return self._extraction_plans[module_index]
 
     @staticmethod
     def find_all_project_files(file_dir: str = _file_dir) -> list:
@@ -93,199 +281,909 @@ class JsonProjectConfig(JsonHandler):
         return sorted([f for f in files if f.endswith(".json")])
 
 
-def scrap_single_item(source, project_settings: dict) -> Tuple[str, dict]:
-    """Scrap product data for single product."""
+@lru_cache(maxsize=1)
+def get_schema_validator() -> "jsonschema.protocols.Validator":
+    """Load the project schema and build its validator once.
+    jsonschema is imported only here, it is slow to import.
+    """
+    import jsonschema
+
+    path_to_schema = Path("schema") / "project_schema.json"
+    with open(path_to_schema, "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+def validate_project_root(project_root: dict) -> None:
+    """Validate a project config against the schema, raise InvalidProjectConfig."""
+    import jsonschema
 
-    product_dict_sku, product_dict = {}, {}
-    item_fields = project_settings["item_fields"]
+    errors = get_schema_validator().iter_errors(project_root)
+    error = jsonschema.exceptions.best_match(errors)
+    if error is not None:
+        raise InvalidProjectConfig(error.message)
 
-    # iterate over all fields in item_fields
-    for field in item_fields:
-        # find a container with the fields
-        result = source.find(
-            item_fields[field].get("tag"), class_=item_fields[field].get("class")
+
+class ProjectConfigRegistry:
+    """Class to keep parsed and validated project configs.
+
+    A config is parsed and validated again only if its file changed: the file
+    is read when its mtime or size is different and parsed when its hash is.
+    Configs of a running project are replaced, not changed, so hot reload
+    doesn't affect runs in progress.
+    """
+
+    def __init__(self, file_dir: str = JsonProjectConfig._file_dir):
+        self.file_dir = file_dir
+        self._lock = threading.Lock()
+        # file name -> (mtime and size, content hash, config or validation error)
+        self._entries: dict[str, tuple] = {}
+
+    def get(self, file_name: str) -> JsonProjectConfig:
+        """Get the project config, raise an error if it is not valid."""
+        config = self._load(file_name)[0]
+        if isinstance(config, Exception):
+            raise config
+        return config
+
+    def _load(self, file_name: str) -> Tuple[Union[JsonProjectConfig, Exception], bool]:
+        """Load the config if the file changed, return it and if it was reloaded."""
+        path = Path(self.file_dir) / file_name
+        stat = path.stat()
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry and entry[0] == file_stat:
+                return entry[2], False
+            data = path.read_bytes()
+            content_hash = hashlib.sha256(data).hexdigest()
+            if entry and entry[1] == content_hash:
+                self._entries[file_name] = (file_stat, content_hash, entry[2])
+                return entry[2], False
+            try:
+                project_root = json.loads(data)
+                validate_project_root(project_root)
+                config = JsonProjectConfig(file_name, project_root=project_root)
+            except ValueError as e:
+                config = e
+            self._entries[file_name] = (file_stat, content_hash, config)
+            return config, True
+
+    def refresh(self) -> dict[str, JsonProjectConfig]:
+        """Get all valid project configs by file name, reload changed ones.
+        Errors of invalid configs are logged once after every change of the file.
+        """
+        configs = {}
+        file_names = JsonProjectConfig.find_all_project_files(self.file_dir)
+        for file_name in file_names:
+            try:
+                config, reloaded = self._load(file_name)
+            except OSError as e:
+                ic(file_name, e)
+                continue
+            if not isinstance(config, Exception):
+                configs[file_name] = config
+            elif reloaded:
+                ic(f"Invalid project config {file_name}", config)
+                logging.error(f"Invalid project config {file_name}: {config}")
+        with self._lock:
+            for file_name in set(self._entries) - set(file_names):
+                del self._entries[file_name]
+        return configs
+
+
+project_configs = ProjectConfigRegistry()
+
+
+def scrap_single_item(
+    source: HtmlElement, project_settings: Union[dict, ExtractionPlan]
+) -> Tuple[str, dict]:
+    """Scrap product data for single product.
+    Pass an extraction plan of the module, a module config is compiled on every call.
+    """
+    if isinstance(project_settings, dict):
+        project_settings = ExtractionPlan(project_settings)
+
+    product_dict = project_settings.extract(source)
+    return product_dict["sku"], {product_dict["sku"]: product_dict}
+
+
+@lru_cache(maxsize=64)
+def get_module_plan(module_json: str) -> ExtractionPlan:
+    """Get an extraction plan for the module config dumped to json.
+    Worker processes can't share compiled plans, they cache their own.
+    """
+    return ExtractionPlan(json.loads(module_json))
+
+
+def scrap_page(
+    source, module: dict, encoding: Optional[str] = None
+) -> Tuple[list[Tuple[str, dict]], dict]:
+    """Parse the page and scrap all items on it.
+    Runs in parse worker processes, so it takes and returns only plain data:
+    a list of scrap_single_item results and parse stats.
+    """
+    plan = get_module_plan(json.dumps(module, sort_keys=True))
+    items, parse_stats = plan.parse_items(source, mode=PARSE_MODE, encoding=encoding)
+    start = time.perf_counter()
+    scraped_items = [scrap_single_item(item, plan) for item in items]
+    parse_stats["scrap_seconds"] = time.perf_counter() - start
+    return scraped_items, parse_stats
+
+
+def report_no_items(project_settings: JsonProjectConfig) -> None:
+    """Log and send an alert that there are no items on the page."""
+    logging.error("No items in main content found")
+    ic("No items in main content found")
+    with metrics.timer("email"):
+        notifier.notify(
+            subject=f"No items in {project_settings.project_name} found",
+            project_name=project_settings.project_name,
         )
-        # scrap data from the container
-        try:
-            if item_fields[field].get("text"):
-                result = result.text
-            if item_fields[field].get("strip"):
-                result = result.strip()
-            if item_fields[field].get("attr"):
-                result = result.get(item_fields[field].get("attr"))
-            if item_fields[field].get("prepend"):
-                result = item_fields[field].get("prepend") + result
-        except (KeyError, AttributeError) as e:
-            ic(e)
 
-        if result:
-            product_dict[field] = result
 
-    product_dict_sku[product_dict["sku"]] = product_dict
-    return product_dict["sku"], product_dict_sku
+def record_parse_stats(parse_stats: dict, items_count: int) -> None:
+    """Record parse stats of a page, a page without items is an error."""
+    metrics.record(
+        "parse",
+        seconds=parse_stats["seconds"],
+        nbytes=parse_stats["bytes"],
+        items=items_count,
+        errors=0 if items_count else 1,
+    )
+
+
+def record_storage_io(operation: str, file_name: str, nbytes: int, seconds: float):
+    """Record a read or a write of an items storage file."""
+    metrics.record(f"storage_{operation}", seconds=seconds, nbytes=nbytes)
+
+
+JsonItemsStorage.io_hooks.append(record_storage_io)
+
+
+def get_response_charset(response: Response) -> Optional[str]:
+    """Return charset from the Content-Type header if the server sent it."""
+    if "charset" in response.headers.get("Content-Type", "").lower():
+        return requests.utils.get_encoding_from_headers(response.headers)
+    return None
 
 
 def get_all_items_to_check(
-    source, project_settings: JsonProjectConfig, module_index: int = 0
+    source,
+    project_settings: JsonProjectConfig,
+    module_index: int = 0,
+    encoding: Optional[str] = None,
+    report_empty: bool = True,
 ) -> list:
-    """Load project and get a container with all items to check. Returns a list of items."""
-    soup = BeautifulSoup(source, "lxml")
-
-    items_container = project_settings.modules[module_index].get("items_container")
-    single_item_container = project_settings.modules[module_index].get(
-        "single_item_container"
+    """Load project and get a container with all items to check. Returns a list of items.
+    Source is the page as str or as bytes of the response with its charset.
+    A page without items is reported only with report_empty.
+    """
+    plan = project_settings.get_extraction_plan(module_index)
+    all_items_list, parse_stats = plan.parse_items(
+        source, mode=PARSE_MODE, encoding=encoding
     )
+    ic(project_settings.project_name, module_index, parse_stats)
+    record_parse_stats(parse_stats, len(all_items_list))
 
-    # check if there is a container with all items
-    if items_container:
-        # search for a container by tag and class or by selector
-        if items_container.get("tag"):
-            items_container = soup.find(
-                items_container["tag"], class_=items_container["class"]
-            )
-        else:
-            items_container = soup.select_one(items_container.get("selector"))
+    if not all_items_list and report_empty:
+        report_no_items(project_settings)
 
-        # extract all items from the container to list
-        all_items_list = items_container.findAll(
-            single_item_container["tag"], class_=single_item_container["class"]
-        )
-    else:
-        # search for a single item
-        all_items_list = soup.findAll(
-            single_item_container["tag"], class_=single_item_container["class"], limit=1
+    return all_items_list
+
+
+def is_first_page(module: dict, url: str) -> bool:
+    """Check if the url is the first page of the module.
+    Only an empty first page means there are no items, the paginator
+    without paginator_count ends with an empty page.
+    """
+    return url == next(get_module_urls(module))
+
+
+def scrap_pages_in_pool(
+    pages: Iterable[Tuple[str, Response]],
+    project_settings: JsonProjectConfig,
+    module_index: int,
+    parse_executor: Executor,
+) -> Iterator[Tuple[str, list[Tuple[str, dict]]]]:
+    """Scrap pages in the parse executor and yield urls with scrapped items
+    page by page. At most PARSE_QUEUE_SIZE pages are in the executor at once.
+    """
+    module = project_settings.modules[module_index]
+    urls: deque[str] = deque()
+
+    def scrap_args() -> Iterator[tuple]:
+        for url, response in pages:
+            urls.append(url)
+            yield response.content, module, get_response_charset(response)
+
+    for _, (scraped_items, parse_stats) in ordered_map(
+        parse_executor, scrap_page, scrap_args(), PARSE_QUEUE_SIZE
+    ):
+        url = urls.popleft()
+        ic(project_settings.project_name, module_index, parse_stats)
+        record_parse_stats(parse_stats, len(scraped_items))
+        metrics.record(
+            "scrap", seconds=parse_stats["scrap_seconds"], items=len(scraped_items)
         )
-    if not all_items_list:
-        logging.error("No items in main content found")
-        ic("No items in main content found")
-        send_email(subject=f"No items in {project_settings.project_name} found")
+        if not scraped_items and is_first_page(module, url):
+            report_no_items(project_settings)
+        yield url, scraped_items
 
-    return all_items_list
+
+def apply_changes(
+    scraped_items: Iterable[Tuple[str, dict]],
+    items_list_instance: JsonItemsStorage,
+    fingerprints: MutableMapping[str, str],
+    seen_skus: Optional[list] = None,
+) -> list[dict]:
+    """Compare scrapped items with stored fingerprints and stage new and changed ones.
+    Fingerprints are updated in place, skus of all scrapped items are appended
+    to seen_skus. Return a list with dicts changed or new items.
+    """
+    changed_or_new_items: list[dict] = []
+    # scrapped item is Tuple("val1", {"val1": {"sku": "val1", ...}})
+    for single_result_sku, single_result_dict in scraped_items:
+        if seen_skus is not None:
+            seen_skus.append(single_result_sku)
+        fingerprint = item_fingerprint(single_result_dict[single_result_sku])
+        # check if the item is in the list
+        if single_result_sku in fingerprints:
+            # check if the item has changed
+            if fingerprint == fingerprints[single_result_sku]:
+                continue
+            ic("Changes found")
+        else:
+            ic("New product added")
+        fingerprints[single_result_sku] = fingerprint
+        changed_or_new_items.append(single_result_dict[single_result_sku])
+        items_list_instance.stage_items(data=single_result_dict)
+
+    return changed_or_new_items
 
 
 def check_changes(
     source,
-    items_list_instance: Union[JsonItemsLocalStorage, JsonItemsS3Storage],
+    items_list_instance: JsonItemsStorage,
     project_settings: JsonProjectConfig,
     module_index: int = 0,
+    fingerprints: Optional[MutableMapping[str, str]] = None,
+    encoding: Optional[str] = None,
+    seen_skus: Optional[list] = None,
+    report_empty: bool = True,
 ) -> list[dict]:
     """Check for changes on a website.
+    Changes are only staged in the items storage, call flush() on it to save them.
+    Pass fingerprints loaded from the storage to reuse them between pages of one
+    module, they are updated in place with the found changes.
+    Skus of all items on the page are appended to seen_skus.
     Return a list with dicts changed or new items or empty list if there are no any changes.
     """
-    changed_or_new_items: list[dict] = []
-    # load existing items list from the json file
-    items_list = items_list_instance.read_json_file()
-
-    # iterate over all items in the list
-    for item in get_all_items_to_check(source, project_settings, module_index):
-        # scrap data for a single item return_value=Tuple("val1", {"val1": {"sku": "val1", ...}})
-        single_result_sku, single_result_dict = scrap_single_item(
-            item, project_settings.modules[module_index]
-        )
-
-        # check if the item is in the list
-        if single_result_sku in items_list.keys():
-            # check if the item has changed
-            if single_result_dict[single_result_sku] != items_list[single_result_sku]:
-                ic("Changes found")
-                items_list[single_result_sku] = single_result_dict[single_result_sku]
-                changed_or_new_items.append(single_result_dict[single_result_sku])
-                items_list_instance.append_to_json_file(data=items_list)
-        else:
-            ic("New product added")
-            changed_or_new_items.append(single_result_dict[single_result_sku])
-            items_list_instance.append_to_json_file(data=single_result_dict)
+    # load fingerprints of existing items
+    if fingerprints is None:
+        fingerprints = items_list_instance.read_fingerprints()
 
+    plan = project_settings.get_extraction_plan(module_index)
+    items = get_all_items_to_check(
+        source, project_settings, module_index, encoding, report_empty
+    )
+    # scrap data for every item on the page
+    with metrics.timer("scrap") as sample:
+        scraped_items = [scrap_single_item(item, plan) for item in items]
+        sample["items"] = len(scraped_items)
+    with metrics.timer("diff") as sample:
+        changed_or_new_items = apply_changes(
+            scraped_items, items_list_instance, fingerprints, seen_skus
+        )
+        sample["items"] = len(changed_or_new_items)
     return changed_or_new_items
 
 
-def get_url_response(
-    module: dict, request: RequestHandler, request_delay: int
-) -> Response:
-    """Method to check if there is a paginator or single url and send a request to the url."""
+def get_module_urls(module: dict) -> Iterator[str]:
+    """Yield urls to load for the module, paginator pages or a single url.
+    Without paginator_count pages are yielded up to MAX_PAGINATOR_PAGES,
+    the real end is found by the paginator_next link.
+    """
     paginator_pattern = module.get("paginator_pattern")
 
     # if there is a paginator pattern, iterate over all pages
     if paginator_pattern:
-        # iterate over pagination
-        paginator_count = module.get("paginator_count")
+        paginator_count = module.get("paginator_count") or MAX_PAGINATOR_PAGES
         for page_index in range(1, paginator_count + 1):
-            paginator_url = paginator_pattern.replace("$page", str(page_index))
-            response = request.read_url(url=paginator_url, delay=request_delay)
-            ic(paginator_url, response.status_code)
+            yield paginator_pattern.replace("$page", str(page_index))
+    else:
+        # if there is no paginator, just load the single url
+        yield module.get("single_url")
+
+
+@lru_cache(maxsize=64)
+def get_tag_selector(tag: str, class_name: Optional[str] = None) -> TagSelector:
+    return TagSelector(tag, class_name)
+
+
+def has_next_page(source, module: dict, encoding: Optional[str] = None) -> bool:
+    """Check if the page has a link to the next paginator page.
+    Always True for modules without paginator_next in the config.
+    The page is streamed until the link, no tree of the whole page is built.
+    """
+    paginator_next = module.get("paginator_next")
+    if not paginator_next:
+        return True
+    selector = get_tag_selector(paginator_next["tag"], paginator_next.get("class"))
+    element, _ = stream_element(source, selector, encoding)
+    return element is not None
+
+
+def get_url_responses(
+    module: dict,
+    request: RequestHandler,
+    executor: Optional[Executor] = None,
+    cache: Optional[ValidatorCache] = None,
+    scan: Optional[ModuleScan] = None,
+) -> Iterator[Tuple[str, Response]]:
+    """Send requests to the module pages and yield urls with responses page by page.
+    Stops on the first failed or blank page and after a page without a next link,
+    so pages past the real end of the paginator are not loaded.
+    With a cache pages not modified since the last run with the same module config
+    are not yielded.
+    With an executor the next pages are prefetched while the current one is parsed.
+    Loaded and not modified pages are recorded in the scan, it's finished
+    if the real end of the module pages is reached.
+    """
 
+    # pool threads don't inherit metric labels of the project thread
+    labels = current_labels()
+    # pages parsed with another module config are changed
+    module_hash = config_hash(module)
+
+    def fetch(url: str) -> Response:
+        headers = cache.get_headers(url, module_hash) if cache else None
+        with metric_labels(**labels):
+            return request.read_url(url=url, headers=headers)
+
+    urls = ((url,) for url in get_module_urls(module))
+    if executor:
+        # prefetch the next pages while the current one is parsed
+        window = max(1, request.limiter.max_concurrency)
+        responses = ordered_map(executor, fetch, urls, window)
+    else:
+        responses = ((args, fetch(*args)) for args in urls)
+
+    try:
+        for (url,), response in responses:
+            ic(url, response.status_code)
+            unchanged = cache and cache.is_unchanged(url, response, module_hash)
+            if unchanged and scan and not scan.knows(url):
+                # skus of the page are unknown, parse it if it's loaded
+                if response.status_code == 200:
+                    unchanged = False
+            if unchanged:
+                ic("Page not modified", url)
+                next_page = cache.has_next(url)
+                if scan:
+                    if not scan.knows(url):
+                        # load the page in full next time to get its skus
+                        cache.forget(url)
+                    scan.page_unchanged(url)
+                if not next_page:
+                    if scan:
+                        scan.finish()
+                    break
+                continue
             if response.status_code != 200:
+                logging.error(f"Failed to load {url}: {response.status_code}")
                 break
-    else:
-        # if there is no paginator, just load the single url
-        single_url = module.get("single_url")
-        response = request.read_url(url=single_url, delay=request_delay)
-        ic(single_url, response.status_code)
-    return response
+            if not response.content.strip():
+                ic("Empty page", url)
+                break
+            if scan:
+                scan.page_loaded(url)
+            yield url, response
+            next_page = has_next_page(
+                response.content, module, get_response_charset(response)
+            )
+            if cache:
+                cache.set_has_next(url, next_page)
+            if not next_page:
+                if scan:
+                    scan.finish()
+                break
+        else:
+            # all pages are loaded, unless the paginator is cut by MAX_PAGINATOR_PAGES
+            if scan and (
+                module.get("paginator_count") or not module.get("paginator_pattern")
+            ):
+                scan.finish()
+    finally:
+        responses.close()
 
 
-def main(request_delay: int = 0, headers: dict = None) -> None:
-    """Main function to start the process for every project and send an email if there is any."""
-    request = RequestHandler()
-    # set custom headers if any
-    if headers:
-        request.set_headers(headers=headers)
+def get_file_storage_class() -> type[JsonItemsStorage]:
+    """Return the storage class of json files depend on the hosting.
+    It keeps http validators and pages of projects, which are not items.
+    S3 storage is imported only when it is used.
+    """
+    if USE_AWS_S3_STORAGE:
+        from json_items_handlers.s3_items_storage import JsonItemsS3Storage
 
-    # iterate over all projects
-    for project in JsonProjectConfig.find_all_project_files():
-        changed_or_new_items: list[dict] = []
-        # instantiate project config class
-        json_project_config = JsonProjectConfig(file_name=project)
+        return JsonItemsS3Storage
+    return JsonItemsLocalStorage
 
-        # check if the project is valid against json schema
-        try:
-            json_project_config.validate_json_project()
-
-            # instantiate storage class depend on the hosting
-            if USE_AWS_S3_STORAGE:
-                json_items_list = JsonItemsS3Storage(file_name="output_" + project)
-            else:
-                json_items_list = JsonItemsLocalStorage(file_name="output_" + project)
-
-            # iterate over all modules in the project
-            for index, module in enumerate(json_project_config.modules, start=0):
-                # check if there is a paginator or single url and send a request to the url
-                response = get_url_response(module, request, request_delay)
-
-                # add new items to the dict
-                changed_or_new_items.extend(
-                    check_changes(
-                        source=response.text,
-                        items_list_instance=json_items_list,
-                        project_settings=json_project_config,
-                        module_index=index,
+
+def check_storage_settings() -> None:
+    """Raise ValueError for settings which would lose the stored items."""
+    if STREAM_ITEMS and USE_AWS_S3_STORAGE:
+        raise ValueError(
+            "STREAM_ITEMS keeps items in a local SQLite database,"
+            " it can't be used with USE_AWS_S3_STORAGE"
+        )
+
+
+def get_storage_class() -> type[JsonItemsStorage]:
+    """Return the storage class of project items depend on the hosting.
+    SQLite storage is imported only when it is used.
+    """
+    check_storage_settings()
+    if STREAM_ITEMS or (USE_SQLITE_STORAGE and not USE_AWS_S3_STORAGE):
+        from json_items_handlers.sqlite_items_storage import SqliteItemsStorage
+
+        return SqliteItemsStorage
+    return get_file_storage_class()
+
+
+def check_project(
+    project: str,
+    request: RequestHandler,
+    executor: Optional[Executor] = None,
+    parse_executor: Optional[Executor] = None,
+    journal: Optional[RunJournal] = None,
+) -> None:
+    """Check a single project for changes and send an email if there is any.
+    With a parse executor pages are parsed there and the project thread only
+    applies the changes to the storage, it is the single writer of the storage.
+    With STREAM_ITEMS changes are saved after every page and only the items
+    of the current page are kept in memory.
+    With a journal every checked module is recorded after its changes are stored,
+    modules checked by an interrupted run are not loaded again.
+    """
+    changed_count = 0
+    # changes stored by an interrupted run
+    previous_changes: dict = {}
+    # storages are closed when the project is checked
+    storages = ExitStack()
+    # get the project config, it is parsed and validated against json schema
+    # only when its file changed
+    try:
+        json_project_config = project_configs.get(project)
+
+        # instantiate storage class depend on the hosting
+        storage_class = get_storage_class()
+        if STREAM_ITEMS:
+            # changes are read back from the history to send them
+            json_items_list = storage_class(
+                file_name="output_" + project, keep_changes=False
+            )
+            storages.callback(json_items_list.close)
+            fingerprints = json_items_list.fingerprint_index()
+        else:
+            json_items_list = storage_class(file_name="output_" + project)
+            storages.callback(json_items_list.close)
+            fingerprints = json_items_list.read_fingerprints()
+        # validators and pages are not items, they are kept in json files
+        file_storage_class = get_file_storage_class()
+        cache = None
+        if USE_HTTP_CACHE:
+            cache_storage = file_storage_class(file_name="cache_" + project)
+            storages.callback(cache_storage.close)
+            cache = ValidatorCache(cache_storage)
+
+        # skus found on every page of every module on the last run
+        pages_storage = None
+        module_pages: dict = {}
+        if DETECT_REMOVED_ITEMS:
+            pages_storage = file_storage_class(file_name="pages_" + project)
+            storages.callback(pages_storage.close)
+            module_pages = pages_storage.read_json_file()
+        scanned_modules: dict[str, dict] = {}
+        removed_skus: set[str] = set()
+        seen_skus: set[str] = set()
+        completed_modules = journal.completed_modules(project) if journal else {}
+
+        # iterate over all modules in the project
+        for index, module in enumerate(json_project_config.modules, start=0):
+            completed = completed_modules.get(module_key(module))
+            if completed:
+                removed_skus.update(completed["removed"])
+                seen_skus.update(completed["seen"])
+                if completed["pages"] is not None:
+                    scanned_modules[module_key(module)] = completed["pages"]
+                previous_changes = completed["changes"]
+                continue
+            with metric_labels(module=index):
+                scan = None
+                if DETECT_REMOVED_ITEMS:
+                    scan = ModuleScan(module_pages.get(module_key(module), {}))
+                responses = get_url_responses(module, request, executor, cache, scan)
+                pages = responses
+                if parse_executor:
+                    pages = scrap_pages_in_pool(
+                        responses, json_project_config, index, parse_executor
+                    )
+                # stop loading pages when the module stops on an empty page
+                with closing(responses), closing(pages):
+                    for url, page in pages:
+                        page_skus: list[str] = []
+                        if parse_executor:
+                            with metrics.timer("diff") as sample:
+                                changes = apply_changes(
+                                    page, json_items_list, fingerprints, page_skus
+                                )
+                                sample["items"] = len(changes)
+                        else:
+                            # parse every page of the module as soon as it is loaded
+                            changes = check_changes(
+                                source=page.content,
+                                items_list_instance=json_items_list,
+                                project_settings=json_project_config,
+                                module_index=index,
+                                fingerprints=fingerprints,
+                                encoding=get_response_charset(page),
+                                seen_skus=page_skus,
+                                report_empty=is_first_page(module, url),
+                            )
+                        changed_count += len(changes)
+                        if scan:
+                            scan.page_parsed(page_skus)
+                        if STREAM_ITEMS:
+                            json_items_list.flush()
+                        if not page_skus:
+                            # pages past the end of the paginator have no items,
+                            # the next run stops on this page too
+                            if cache:
+                                cache.set_has_next(url, False)
+                            break
+                if scan:
+                    removed_skus |= scan.removed_skus()
+                    seen_skus |= scan.seen_skus()
+                    scanned_modules[module_key(module)] = scan.pages_to_save()
+                # save all changes of the module with a single write
+                json_items_list.flush()
+                if journal:
+                    journal.module_done(
+                        project,
+                        module_key(module),
+                        {
+                            "removed": sorted(scan.removed_skus()) if scan else [],
+                            "seen": sorted(scan.seen_skus()) if scan else [],
+                            "pages": scan.pages_to_save() if scan else None,
+                            "changes": merge_changes(
+                                previous_changes, json_items_list.read_changes()
+                            ),
+                        },
                     )
+
+        # an item moved to another module is not removed
+        removed_skus = {sku for sku in removed_skus - seen_skus if sku in fingerprints}
+        if removed_skus:
+            ic("Products removed", removed_skus)
+            json_items_list.stage_removed(removed_skus)
+            json_items_list.flush()
+        # validators and pages are saved only after all changes are stored,
+        # so pages of a failed run are parsed again next time
+        if cache:
+            cache.save()
+        if pages_storage:
+            pages_storage.save_to_json_file(scanned_modules)
+
+        # notify about the changes, only changed items are attached
+        if changed_count or removed_skus or previous_changes:
+            with metrics.timer("email") as sample:
+                changes = merge_changes(
+                    previous_changes, json_items_list.read_changes()
                 )
-        except jsonschema.exceptions.ValidationError as e:
-            ic(f"Invalid project config for {json_project_config.project_name}", e)
-            logging.error(
-                f"Invalid project config for {json_project_config.project_name}"
+                sample["items"] = len(changes)
+                notifier.notify(
+                    subject=f"Changes detected in {json_project_config.project_name}",
+                    project_name=json_project_config.project_name,
+                    json_data=changes,
+                )
+    except InvalidProjectConfig as e:
+        ic(f"Invalid project config for {project}", e)
+        logging.error(f"Invalid project config for {project}")
+    finally:
+        storages.close()
+
+
+def process_project(
+    project: str,
+    request: RequestHandler,
+    executor: Optional[Executor] = None,
+    parse_executor: Optional[Executor] = None,
+    journal: Optional[RunJournal] = None,
+) -> None:
+    """Check a single project and record metrics of the run.
+    With a journal the project is recorded as started and then as checked.
+    With METRICS_DIR metrics of all runs are written in the Prometheus text format
+    and a json summary of the run with its peak memory and requests by host
+    is written for the project.
+    Notifications are sent when the project ends, or with the ones of the other
+    projects when it runs in a batch or in main().
+    """
+    started_at = time.time()
+    before = metrics.snapshot(project)
+    hosts_before = request.get_stats()
+    memory = {"peak_rss_kb": None}
+    if journal:
+        journal.project_started(project)
+    try:
+        with (
+            notifier.run(),
+            track_peak_rss() as memory,
+            metric_labels(project=project),
+        ):
+            check_project(project, request, executor, parse_executor, journal)
+        if journal:
+            journal.project_done(project)
+    finally:
+        if METRICS_DIR:
+            stages = metrics.summary(before, metrics.snapshot(project))
+            hosts = hosts_summary(hosts_before, request.get_stats())
+            ic(project, memory["peak_rss_kb"], stages, hosts)
+            write_run_summary(
+                Path(METRICS_DIR) / f"summary_{project}",
+                project,
+                started_at,
+                stages,
+                peak_rss_kb=memory["peak_rss_kb"],
+                hosts=hosts,
             )
-            continue
-
-        # send email if there are any changes
-        if changed_or_new_items:
-            send_email(
-                subject=f"Changes detected in {json_project_config.project_name}",
-                project_name=json_project_config.project_name,
-                json_file_path=json_items_list.full_path,
+            metrics.write_prometheus(Path(METRICS_DIR) / "metrics.prom")
+
+
+@contextmanager
+def create_workers(
+    request_delay: int = 0, headers: dict = None
+) -> Iterator[Tuple[RequestHandler, Executor, Optional[Executor]]]:
+    """Create the request handler and pools to load and parse pages shared by projects.
+    request_delay is the minimal interval in seconds between requests to the same
+    host if REQUESTS_PER_SECOND is not set.
+    """
+    requests_per_second = REQUESTS_PER_SECOND
+    if not requests_per_second and request_delay:
+        requests_per_second = 1 / request_delay
+    request = RequestHandler(
+        max_concurrency_per_host=MAX_CONCURRENCY_PER_HOST,
+        requests_per_second=requests_per_second,
+    )
+    # set custom headers if any
+    if headers:
+        request.set_headers(headers=headers)
+
+    # pages and projects use separate pools, so projects waiting for pages never
+    # take all workers away from the page requests
+    with ExitStack() as stack:
+        fetch_executor = stack.enter_context(
+            ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+        )
+        parse_executor = None
+        if PARSE_WORKERS:
+            # spawn instead of fork, the process already runs threads
+            parse_executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers=PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
             )
+        try:
+            yield request, fetch_executor, parse_executor
+        finally:
+            ic(request.get_stats())
+            request.close()
+
+
+@contextmanager
+def start_notification_worker() -> Iterator[None]:
+    """Queue notifications in the persistent queue and send them in a background
+    thread, so a slow smtp server doesn't block the projects.
+    Emails left from the previous runs are sent first. Without
+    NOTIFICATION_QUEUE_FILE they are sent at once.
+    """
+    import notification_queue
+
+    if not notification_queue.NOTIFICATION_QUEUE_FILE:
+        yield
+        return
+    queue = notification_queue.NotificationQueue()
+    worker = notification_queue.NotificationWorker(queue)
+    send_messages = notifier.send_messages
+    notifier.send_messages = worker.enqueue
+    worker.start()
+    try:
+        yield
+    finally:
+        notifier.send_messages = send_messages
+        if worker.stop():
+            ic(queue.counts())
+            queue.close()
+
+
+@contextmanager
+def join_shard() -> Iterator[Optional[Shard]]:
+    """Join the workers sharing the S3 bucket or SHARD_DIR if WORKER_ID is set."""
+    if not WORKER_ID:
+        yield None
+        return
+    if USE_AWS_S3_STORAGE:
+        store = S3RecordStore("shards")
+    else:
+        store = LocalRecordStore(SHARD_DIR)
+    shard = Shard(WORKER_ID, store)
+    shard.join()
+    try:
+        yield shard
+    finally:
+        shard.leave()
+
+
+@contextmanager
+def resume_run() -> Iterator[Optional[RunJournal]]:
+    """Journal the run in JOURNAL_FILE, so a run interrupted by the death
+    of the process is resumed by the next one.
+    Notifications of the interrupted run are sent with the ones of this run.
+    The journal is removed only when the block finishes without an error,
+    the scheduler keeps it until the process is stopped.
+    """
+    if not JOURNAL_FILE:
+        yield None
+        return
+    journal = RunJournal(JOURNAL_FILE)
+    if journal.start():
+        notifier.extend(journal.notifications())
+    notifier.journal = journal
+    try:
+        yield journal
+    finally:
+        notifier.journal = None
+    journal.finish()
+
+
+def main(request_delay: int = 0, headers: dict = None) -> None:
+    """Main function to start the process for every project and send an email if there is any.
+    Projects are checked concurrently, request_delay is the minimal interval in seconds
+    between requests to the same host if REQUESTS_PER_SECOND is not set.
+    Notifications of all projects are sent in one digest at the end.
+    With WORKER_ID only projects claimed by this worker are checked.
+    Projects checked by an interrupted run are skipped.
+    """
+    check_storage_settings()
+    with (
+        join_shard() as shard,
+        start_notification_worker(),
+        resume_run() as journal,
+        notifier.run(),
+        create_workers(request_delay, headers) as (
+            request,
+            fetch_executor,
+            parse_executor,
+        ),
+        ThreadPoolExecutor(max_workers=PROJECT_WORKERS) as project_executor,
+    ):
+        projects = JsonProjectConfig.find_all_project_files()
+        if shard:
+            projects = shard.claim(projects)
+            ic(WORKER_ID, projects)
+        if journal:
+            projects = [
+                project for project in projects if not journal.is_project_done(project)
+            ]
+        futures = {
+            # projects add their notifications to the digest of the run
+            project_executor.submit(
+                contextvars.copy_context().run,
+                process_project,
+                project,
+                request,
+                fetch_executor,
+                parse_executor,
+                journal,
+            ): project
+            for project in projects
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                ic(futures[future], e)
+                logging.error(f"Failed to check project {futures[future]}: {e}")
+
+
+def get_project_schedule(
+    schedule_config: Optional[dict], schedule_time: str
+) -> Union[CronSchedule, IntervalSchedule]:
+    """Get a schedule from the project config, daily at schedule_time by default."""
+    if schedule_config and schedule_config.get("cron"):
+        return CronSchedule(schedule_config["cron"])
+    if schedule_config and schedule_config.get("interval_minutes"):
+        return IntervalSchedule(schedule_config["interval_minutes"] * 60)
+    return daily_schedule(schedule_time)
+
+
+def get_all_schedules(schedule_time: str) -> dict:
+    """Get schedules of all projects, projects with a broken config are skipped.
+    Only project configs changed since the last call are parsed again.
+    """
+    schedules = {}
+    for project, config in project_configs.refresh().items():
+        try:
+            schedules[project] = get_project_schedule(config.schedule, schedule_time)
+        except ValueError as e:
+            ic(project, e)
+            logging.error(f"Failed to schedule project {project}: {e}")
+    return schedules
 
 
 def schedule_task(schedule_time: str, request_delay: int = 0, headers: dict = None):
-    # Run the task once immediately
-    if RUN_AT_START:
-        main(request_delay=request_delay, headers=headers)
-    # Schedule the task to run at a specific time
-    schedule.every().day.at(schedule_time).do(main)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    """Run every project on its own schedule until the process is stopped.
+    Projects without a schedule in the config run daily at schedule_time.
+    Project configs are checked for new projects and changed schedules
+    every CONFIG_RELOAD_INTERVAL seconds, changed configs are used by the next runs.
+    With WORKER_ID every worker keeps all schedules, but a due project is run
+    only by the worker which claims it.
+    Notifications of projects due at the same time are sent together when
+    the last of them finishes.
+    Projects which were due or running when the last process died are run
+    at once, their checked modules are skipped.
+    """
+    check_storage_settings()
+    with (
+        join_shard() as shard,
+        start_notification_worker(),
+        resume_run() as journal,
+        create_workers(request_delay, headers) as (
+            request,
+            fetch_executor,
+            parse_executor,
+        ),
+    ):
+
+        def run_project(project: str) -> None:
+            if shard and not shard.claim([project]):
+                ic(f"{project} is checked by another worker")
+                return
+            try:
+                process_project(
+                    project, request, fetch_executor, parse_executor, journal
+                )
+            finally:
+                if shard:
+                    shard.done(project)
+
+        scheduler = ProjectScheduler(
+            run_project=run_project,
+            max_workers=PROJECT_WORKERS,
+            jitter=SCHEDULE_JITTER,
+            batch_context=notifier.run,
+            on_due=journal.project_started if journal else None,
+        )
+        scheduler.set_schedules(get_all_schedules(schedule_time))
+        # Run all projects once immediately
+        if RUN_AT_START:
+            scheduler.run_all_now()
+        elif journal and journal.unfinished_projects():
+            ic("Resume unfinished projects", journal.unfinished_projects())
+            scheduler.run_all_now(journal.unfinished_projects())
+        else:
+            # notifications left by the interrupted run
+            notifier.send()
+        try:
+            scheduler.run_forever(
+                refresh=lambda: get_all_schedules(schedule_time),
+                refresh_interval=CONFIG_RELOAD_INTERVAL,
+            )
+        finally:
+            scheduler.stop()
 
 
 if __name__ == "__main__":
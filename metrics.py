@@ -0,0 +1,217 @@
+"""Timing and counters of the monitoring stages by project and module."""
+
+import json
+import resource
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator, Optional
+
+from atomic_file import write_atomic
+
+FIELDS = ("calls", "errors", "seconds", "bytes", "items")
+LABELS = ("stage", "project", "module")
+
+_labels: ContextVar[dict] = ContextVar("metrics_labels", default={})
+
+
+@contextmanager
+def metric_labels(**values) -> Iterator[None]:
+    """Set labels of all metrics recorded in the block, like project and module."""
+    token = _labels.set({**_labels.get(), **values})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels() -> dict:
+    """Return labels set for the current thread.
+    Pass them to metric_labels() in the pool workers, they don't inherit them.
+    """
+    return dict(_labels.get())
+
+
+class Metrics:
+    """Class to accumulate calls, errors, durations, bytes and items by stage.
+
+    Values are totals since the process start, a run summary is the difference
+    of two snapshots.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: dict[tuple, dict[str, float]] = defaultdict(
+            lambda: dict.fromkeys(FIELDS, 0)
+        )
+
+    def record(
+        self,
+        stage: str,
+        seconds: float = 0.0,
+        nbytes: int = 0,
+        items: int = 0,
+        errors: int = 0,
+    ) -> None:
+        """Record a call of the stage with the current labels."""
+        current = _labels.get()
+        key = (stage, current.get("project", ""), str(current.get("module", "")))
+        with self._lock:
+            values = self._values[key]
+            values["calls"] += 1
+            values["errors"] += errors
+            values["seconds"] += seconds
+            values["bytes"] += nbytes
+            values["items"] += items
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[dict]:
+        """Record duration of the block, set bytes and items in the yielded dict.
+        An exception in the block is counted as an error.
+        """
+        sample = {"nbytes": 0, "items": 0, "errors": 0}
+        start = time.perf_counter()
+        try:
+            yield sample
+        except Exception:
+            sample["errors"] += 1
+            raise
+        finally:
+            self.record(stage, seconds=time.perf_counter() - start, **sample)
+
+    def snapshot(self, project: Optional[str] = None) -> dict[tuple, dict]:
+        """Return a copy of the values by labels, of one project if it is set."""
+        with self._lock:
+            return {
+                key: dict(values)
+                for key, values in self._values.items()
+                if project is None or key[1] == project
+            }
+
+    @staticmethod
+    def summary(before: dict[tuple, dict], after: dict[tuple, dict]) -> list[dict]:
+        """Return values recorded between two snapshots as a list of dicts."""
+        summary = []
+        for key, values in sorted(after.items()):
+            previous = before.get(key, {})
+            changes = {
+                field: values[field] - previous.get(field, 0) for field in FIELDS
+            }
+            if changes["calls"]:
+                summary.append({**dict(zip(LABELS, key)), **changes})
+        return summary
+
+    def to_prometheus(self) -> str:
+        """Return all values in the Prometheus text format."""
+        lines = []
+        snapshot = self.snapshot()
+        for field in FIELDS:
+            name = f"monitor_stage_{field}_total"
+            lines.append(f"# TYPE {name} counter")
+            for key, values in sorted(snapshot.items()):
+                label_values = ",".join(
+                    f'{label}="{_escape(value)}"' for label, value in zip(LABELS, key)
+                )
+                lines.append(f"{name}{{{label_values}}} {values[field]}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path) -> None:
+        """Write all values to a file for the node exporter textfile collector."""
+        write_atomic(path, self.to_prometheus(), fsync=False)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def read_peak_rss_kb() -> int:
+    """Return the peak resident memory of the process in KB."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # never reset, it is the peak since the process start
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident memory of the process to the current one.
+    Return False if it is not supported, only linux can do it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+_active_runs = 0
+_active_runs_lock = threading.Lock()
+
+
+@contextmanager
+def track_peak_rss() -> Iterator[dict]:
+    """Yield a dict, its "peak_rss_kb" is set to the peak resident memory
+    of the process during the block at its end.
+    The peak is reset only when no other block is running, so for concurrent
+    runs it is the peak of the process while they run.
+    """
+    global _active_runs
+    with _active_runs_lock:
+        if not _active_runs:
+            reset_peak_rss()
+        _active_runs += 1
+    memory = {"peak_rss_kb": 0}
+    try:
+        yield memory
+    finally:
+        memory["peak_rss_kb"] = read_peak_rss_kb()
+        with _active_runs_lock:
+            _active_runs -= 1
+
+
+def hosts_summary(before: dict[str, dict], after: dict[str, dict]) -> dict[str, dict]:
+    """Return per-host request stats recorded between two snapshots.
+    All stats are counters, hosts without requests in between are skipped.
+    Projects running at the same time share the hosts, their requests to a common
+    host are counted in both summaries.
+    """
+    summary = {}
+    for host, stats in sorted(after.items()):
+        previous = before.get(host, {})
+        changes = {
+            field: value - previous.get(field, 0) for field, value in stats.items()
+        }
+        if any(changes.values()):
+            summary[host] = changes
+    return summary
+
+
+def write_run_summary(
+    path: Path,
+    project: str,
+    started_at: float,
+    stages: list,
+    peak_rss_kb: Optional[int] = None,
+    hosts: Optional[dict] = None,
+) -> None:
+    """Write a json summary of a project run with per-host request stats."""
+    summary = {
+        "project": project,
+        "started_at": started_at,
+        "seconds": time.time() - started_at,
+        "peak_rss_kb": peak_rss_kb,
+        "stages": stages,
+        "hosts": hosts or {},
+    }
+    write_atomic(path, json.dumps(summary, indent=2, ensure_ascii=False), fsync=False)
+
+
+metrics = Metrics()
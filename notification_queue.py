@@ -0,0 +1,210 @@
+"""Persistent queue of emails sent by a background worker with retries."""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from email import message_from_string
+from email.message import Message
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+from icecream import ic
+
+from mail import SmtpSession
+
+load_dotenv()
+
+# sqlite database of the queue, empty sends emails at once without the queue
+NOTIFICATION_QUEUE_FILE = os.getenv("NOTIFICATION_QUEUE_FILE", "notifications.sqlite3")
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", 10))
+# delay before the first retry in seconds, it doubles with every attempt
+NOTIFICATION_BACKOFF = float(os.getenv("NOTIFICATION_BACKOFF", 30))
+NOTIFICATION_MAX_BACKOFF = float(os.getenv("NOTIFICATION_MAX_BACKOFF", 3600))
+# how long the worker tries to send queued emails when it stops, in seconds
+NOTIFICATION_DRAIN_TIMEOUT = float(os.getenv("NOTIFICATION_DRAIN_TIMEOUT", 30))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS notifications_due
+    ON notifications (status, next_attempt_at);
+"""
+
+
+class NotificationQueue:
+    """Class to keep emails to send in a SQLite database.
+
+    An email is deleted only when it was sent, so unsent emails survive
+    a restart of the process. Emails which failed max attempts are kept
+    with the failed status.
+    """
+
+    def __init__(self, path: str = NOTIFICATION_QUEUE_FILE):
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def put(self, messages: list[Message]) -> int:
+        """Add emails to the queue, they are due at once. Return their number."""
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO notifications (message, next_attempt_at, created_at)"
+                " VALUES (?, ?, ?)",
+                ((message.as_string(), now, now) for message in messages),
+            )
+        return len(messages)
+
+    def due(self, now: Optional[float] = None) -> list[tuple[int, Message, int]]:
+        """Return id, email and attempts of all pending emails due by now."""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, message, attempts FROM notifications"
+                " WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id",
+                (time.time() if now is None else now,),
+            ).fetchall()
+        return [
+            (id_, message_from_string(data), attempts) for id_, data, attempts in rows
+        ]
+
+    def next_attempt_at(self) -> Optional[float]:
+        """Return when the next pending email is due, None if there is none."""
+        with self._lock:
+            return self.connection.execute(
+                "SELECT MIN(next_attempt_at) FROM notifications WHERE status = 'pending'"
+            ).fetchone()[0]
+
+    def sent(self, id_: int) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM notifications WHERE id = ?", (id_,))
+
+    def retry(
+        self, id_: int, attempts: int, next_attempt_at: float, error: str
+    ) -> None:
+        """Schedule the next attempt of an email, fail it after max attempts."""
+        status = "failed" if attempts >= NOTIFICATION_MAX_ATTEMPTS else "pending"
+        with self._lock, self.connection:
+            self.connection.execute(
+                "UPDATE notifications SET status = ?, attempts = ?,"
+                " next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (status, attempts, next_attempt_at, error, id_),
+            )
+        if status == "failed":
+            logging.error(f"Notification {id_} failed {attempts} times: {error}")
+
+    def counts(self) -> dict[str, int]:
+        """Return the number of emails by status."""
+        with self._lock:
+            return dict(
+                self.connection.execute(
+                    "SELECT status, COUNT(*) FROM notifications GROUP BY status"
+                )
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Return the delay before the next attempt after the number of attempts."""
+    return min(NOTIFICATION_BACKOFF * 2 ** (attempts - 1), NOTIFICATION_MAX_BACKOFF)
+
+
+class NotificationWorker:
+    """Class to send queued emails in a background thread.
+
+    Due emails are sent over one smtp session. If an email fails, it and the
+    rest of the due emails are retried later with exponential backoff, so an
+    unreachable server never blocks the projects.
+    """
+
+    def __init__(
+        self,
+        queue: NotificationQueue,
+        session_factory: Callable[[], SmtpSession] = SmtpSession,
+        poll_interval: float = 60,
+    ):
+        self.queue = queue
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="notification-worker", daemon=True
+        )
+
+    def enqueue(self, messages: list[Message]) -> int:
+        """Add emails to the queue and wake the worker. Return their number."""
+        count = self.queue.put(messages)
+        self._wake.set()
+        return count
+
+    def send_due(self) -> int:
+        """Send all due emails. Return the number of sent emails."""
+        due = self.queue.due()
+        if not due:
+            return 0
+        sent = 0
+        with self.session_factory() as session:
+            for index, (id_, message, attempts) in enumerate(due):
+                try:
+                    session.send(message)
+                except Exception as e:
+                    ic(e)
+                    # the server is likely unavailable, retry the rest later
+                    for retry_id, _, retry_attempts in due[index:]:
+                        self.queue.retry(
+                            retry_id,
+                            retry_attempts + 1,
+                            time.time() + backoff_seconds(retry_attempts + 1),
+                            repr(e),
+                        )
+                    break
+                self.queue.sent(id_)
+                sent += 1
+        ic("Notifications sent", sent)
+        return sent
+
+    def _wait_seconds(self) -> float:
+        next_attempt_at = self.queue.next_attempt_at()
+        if next_attempt_at is None:
+            return self.poll_interval
+        return min(max(next_attempt_at - time.time(), 0), self.poll_interval)
+
+    def _try_send_due(self) -> None:
+        try:
+            self.send_due()
+        except Exception as e:
+            ic(e)
+            logging.error(f"Failed to send notifications: {e}")
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._try_send_due()
+            self._wake.wait(self._wait_seconds())
+            self._wake.clear()
+        # emails queued until the stop
+        self._try_send_due()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, timeout: float = NOTIFICATION_DRAIN_TIMEOUT) -> bool:
+        """Stop the worker after one more attempt to send due emails.
+        Emails which are not sent in timeout are left in the queue.
+        Return False if the worker is still sending.
+        """
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -0,0 +1,32 @@
+"""Helpers to connect pipeline stages running in executors."""
+
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+
+def ordered_map(
+    executor: Executor, fn: Callable, args_iterable: Iterable[tuple], window: int
+) -> Iterator[Tuple[tuple, Any]]:
+    """Call fn(*args) in the executor for every args tuple.
+    Up to window calls are in flight at once, it is the bounded queue between
+    the stages, so a fast stage can't pile up results of a slow one in memory.
+    Args with results are yielded in the input order, not started calls are
+    cancelled when the consumer stops iteration.
+    """
+    args_iterator = iter(args_iterable)
+    pending: deque = deque()
+    try:
+        while True:
+            while len(pending) < window:
+                args = next(args_iterator, None)
+                if args is None:
+                    break
+                pending.append((args, executor.submit(fn, *args)))
+            if not pending:
+                return
+            args, future = pending.popleft()
+            yield args, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
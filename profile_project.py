@@ -0,0 +1,240 @@
+"""Run one project once with profilers to find out why it is slow.
+
+Usage: python profile_project.py navin.json --cprofile navin.pstats
+       --flamegraph navin.folded --tracemalloc 20
+
+The project is checked by the same process_project path as scheduled runs,
+so stored items, the http cache and the metrics are updated and emails are sent
+as usual. With --dry-run the run works on a scratch copy of the stored files
+of the project and sends no emails, so nothing it finds is lost for the next run.
+Pages are loaded and parsed in the profiled thread unless --threads is set,
+cProfile sees only the thread it runs in.
+"""
+
+import argparse
+import cProfile
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import ExitStack, closing, contextmanager
+from pathlib import Path
+from typing import Iterator
+from unittest.mock import patch
+
+from icecream import ic
+
+import main
+from metrics import metrics
+
+
+class StackSampler:
+    """Class to sample stacks of all threads for a flamegraph.
+
+    Stacks are written in the collapsed format, one "frame;frame;frame count" line
+    per stack, which flamegraph.pl, speedscope and inferno read.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stopped.wait(self.interval):
+            names.update(
+                {thread.ident: thread.name for thread in threading.enumerate()}
+            )
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def write_collapsed(self, path: Path) -> None:
+        """Write sampled stacks in the collapsed format."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def run_profilers(args) -> Iterator[dict]:
+    """Run the profilers chosen in the args around the block, save their results."""
+    report = {}
+    with ExitStack() as stack:
+        if args.tracemalloc:
+            tracemalloc.start(args.tracemalloc_frames)
+            stack.callback(tracemalloc.stop)
+            before = tracemalloc.take_snapshot()
+        sampler = None
+        if args.flamegraph:
+            sampler = StackSampler(args.interval)
+            sampler.start()
+        profiler = None
+        if args.cprofile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            yield report
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.cprofile)
+                stats = pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE)
+                stats.print_stats(args.top)
+            if sampler:
+                sampler.stop()
+                sampler.write_collapsed(args.flamegraph)
+                report["flamegraph_samples"] = sum(sampler.samples.values())
+            if args.tracemalloc:
+                after = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                report["memory"] = {
+                    "current_kb": current // 1024,
+                    "peak_kb": peak // 1024,
+                }
+                report["allocations"] = [
+                    str(diff)
+                    for diff in after.compare_to(before, "lineno")[: args.tracemalloc]
+                ]
+
+
+def copy_stored_files(storage_class: type, project: str, target: Path) -> None:
+    """Copy files of the project kept by the storage class to the target dir.
+    The SQLite database is copied with the SQLite backup, it may be in use.
+    """
+    storage_dir = Path(storage_class._file_dir)
+    db_name = getattr(storage_class, "_db_name", None)
+    if db_name:
+        if (storage_dir / db_name).exists():
+            import sqlite3
+
+            source = sqlite3.connect(storage_dir / db_name)
+            with closing(source), closing(sqlite3.connect(target / db_name)) as copy:
+                source.backup(copy)
+        return
+    for prefix in ("output_", "cache_", "pages_"):
+        for path in storage_dir.glob(prefix + Path(project).stem + ".*"):
+            shutil.copy2(path, target)
+
+
+@contextmanager
+def scratch_storage(project: str) -> Iterator[Path]:
+    """Keep storages and metrics of the block in a temporary dir with a copy
+    of the stored files of the project, emails are not sent.
+    """
+    if main.USE_AWS_S3_STORAGE:
+        raise ValueError("A dry run copies the local storage, S3 is not supported")
+    storage_classes = {main.get_storage_class(), main.get_file_storage_class()}
+    with (
+        tempfile.TemporaryDirectory(prefix="profile_") as scratch,
+        ExitStack() as stack,
+    ):
+        for storage_class in storage_classes:
+            copy_stored_files(storage_class, project, Path(scratch))
+            stack.enter_context(patch.object(storage_class, "_file_dir", scratch))
+        stack.enter_context(
+            patch.object(main, "METRICS_DIR", str(Path(scratch) / "metrics"))
+        )
+        stack.enter_context(patch.object(main.notifier, "send_messages", len))
+        yield Path(scratch)
+
+
+def profile_project(project: str, args: argparse.Namespace) -> dict:
+    """Check the project once with profilers and return a wall-clock breakdown by stage."""
+    before = metrics.snapshot(project)
+    with ExitStack() as stack:
+        if args.dry_run:
+            stack.enter_context(scratch_storage(project))
+        request, fetch_executor, _ = stack.enter_context(
+            main.create_workers(args.request_delay)
+        )
+        with run_profilers(args) as report:
+            started = time.perf_counter()
+            # parse in this process, so profilers see it
+            main.process_project(
+                project, request, fetch_executor if args.threads else None, None
+            )
+            report["seconds"] = time.perf_counter() - started
+    report["stages"] = metrics.summary(before, metrics.snapshot(project))
+    return report
+
+
+def print_report(report: dict) -> None:
+    """Print the wall-clock breakdown and allocations."""
+    print(f"Total: {report['seconds']:.3f}s")
+    print(f"{'stage':<16}{'module':>8}{'calls':>8}{'seconds':>10}{'share':>8}")
+    for stage in report["stages"]:
+        share = stage["seconds"] / report["seconds"] if report["seconds"] else 0
+        print(
+            f"{stage['stage']:<16}{stage['module']:>8}{stage['calls']:>8}"
+            f"{stage['seconds']:>10.3f}{share:>8.1%}"
+        )
+    if "memory" in report:
+        print(f"Traced memory: {report['memory']}")
+        for line in report["allocations"]:
+            print(line)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("project", help="project config file name, like navin.json")
+    parser.add_argument("--cprofile", help="pstats file for cProfile results")
+    parser.add_argument("--top", type=int, default=30, help="cProfile lines to print")
+    parser.add_argument("--flamegraph", help="collapsed stacks file for a flamegraph")
+    parser.add_argument(
+        "--interval", type=float, default=0.005, help="stack sampling interval"
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        type=int,
+        default=0,
+        help="trace allocations and print this many biggest differences",
+    )
+    parser.add_argument("--tracemalloc-frames", type=int, default=1)
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="load pages in the fetch pool like scheduled runs",
+    )
+    parser.add_argument(
+        "--request-delay",
+        type=float,
+        default=3,
+        help="seconds between requests to a host, like scheduled runs",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="work on a scratch copy of the stored files and send no emails",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = profile_project(arguments.project, arguments)
+    ic(result.get("flamegraph_samples"))
+    print_report(result)
@@ -0,0 +1,42 @@
+"""Per-host concurrency and request rate limits."""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class HostRateLimiter:
+    """Class to limit concurrent requests and requests per second for every host."""
+
+    def __init__(self, max_concurrency: int = 2, requests_per_second: float = 0):
+        self.max_concurrency = max_concurrency
+        self.min_interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self._lock = threading.Lock()
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self._next_slot: dict[str, float] = {}
+
+    def _get_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        """Get or create a semaphore for the host."""
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(
+                    self.max_concurrency
+                )
+            return self._semaphores[host]
+
+    def _wait_for_slot(self, host: str) -> None:
+        """Reserve the next free time slot for the host and sleep until it comes."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    @contextmanager
+    def limit(self, host: str) -> Iterator[None]:
+        """Block until a request to the host is allowed by both limits."""
+        with self._get_semaphore(host):
+            self._wait_for_slot(host)
+            yield
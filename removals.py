@@ -0,0 +1,80 @@
+"""Detection of items removed from the site since the last run."""
+
+from collections import deque
+from typing import Iterable
+
+
+def module_key(module: dict) -> str:
+    """Return a key of the module which doesn't change when modules are reordered."""
+    return module.get("paginator_pattern") or module.get("single_url")
+
+
+class ModuleScan:
+    """Pages of a module loaded in the current run with skus found on them.
+
+    Removed skus are reported only for a complete scan: every page up to the real
+    end of the paginator was parsed with items or was not modified since the last
+    run with known skus. A failed or empty page makes the scan incomplete,
+    so a broken fetch can't cause mass false removals.
+    Pages must be parsed in the order they were loaded.
+    """
+
+    def __init__(self, previous_pages: dict[str, list[str]]):
+        # skus by page url found on the last run
+        self.previous_pages = previous_pages
+        self.pages: dict[str, list[str]] = {}
+        self.finished = False
+        self.failed = False
+        self._loaded: deque[str] = deque()
+
+    def knows(self, url: str) -> bool:
+        """Check if skus of the page are known from the last run."""
+        return url in self.previous_pages
+
+    def page_unchanged(self, url: str) -> None:
+        """Take skus of the page not modified since the last run."""
+        if url not in self.previous_pages:
+            self.failed = True
+        self.pages[url] = list(self.previous_pages.get(url, []))
+
+    def page_loaded(self, url: str) -> None:
+        """Remember the page waiting to be parsed."""
+        self._loaded.append(url)
+
+    def page_parsed(self, skus: Iterable[str]) -> None:
+        """Set skus found on the oldest loaded page."""
+        url = self._loaded.popleft()
+        self.pages[url] = list(skus)
+        if not self.pages[url]:
+            self.failed = True
+
+    def finish(self) -> None:
+        """Mark all pages of the module as loaded."""
+        self.finished = True
+
+    @property
+    def complete(self) -> bool:
+        """True if skus of all pages of the module are known."""
+        return self.finished and not self.failed and not self._loaded
+
+    def seen_skus(self) -> set[str]:
+        """Return skus found on all pages in this run."""
+        return {sku for skus in self.pages.values() for sku in skus}
+
+    def removed_skus(self) -> set[str]:
+        """Return skus of the last run not found in this run, empty if incomplete."""
+        if not self.complete:
+            return set()
+        stored = {sku for skus in self.previous_pages.values() for sku in skus}
+        return stored - self.seen_skus()
+
+    def pages_to_save(self) -> dict[str, list[str]]:
+        """Return skus by page to compare with on the next run.
+        Pages not reached or empty in an incomplete scan keep skus of the last run.
+        """
+        if self.complete:
+            return dict(self.pages)
+        return {
+            **self.previous_pages,
+            **{url: skus for url, skus in self.pages.items() if skus},
+        }
@@ -0,0 +1,170 @@
+"""Journal of a run to resume it after the process died."""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from icecream import ic
+
+from atomic_file import write_atomic
+
+load_dotenv()
+
+# file of the journal, empty disables resuming of runs
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "run_journal.json")
+# an unfinished run not updated for this long is started over, in seconds
+JOURNAL_MAX_AGE = float(os.getenv("JOURNAL_MAX_AGE", 12 * 3600))
+
+
+class RunJournal:
+    """Class to record the progress of a run in a json file.
+
+    It keeps started and checked projects, checked modules of the running
+    projects with their scan results and changes, and notifications which are
+    not sent yet. Every record is written at once, so a restarted run skips
+    checked projects and modules, runs unfinished projects again and sends
+    the notifications of the interrupted run.
+    The file is removed when the run finishes.
+    """
+
+    def __init__(self, path: str = JOURNAL_FILE, max_age: float = JOURNAL_MAX_AGE):
+        self.path = Path(path)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._data: dict = {}
+
+    def start(self) -> bool:
+        """Resume the unfinished run or start a new one. Return True if resumed."""
+        try:
+            data = json.loads(self.path.read_bytes())
+        except (FileNotFoundError, ValueError):
+            data = None
+        resumed = bool(data) and time.time() - data["updated_at"] < self.max_age
+        if resumed:
+            self._data = data
+            ic("Resume the run", len(data["projects"]), len(data["notifications"]))
+        else:
+            self._data = {"projects": {}, "notifications": []}
+        with self._lock:
+            self._save()
+        return resumed
+
+    def _save(self) -> None:
+        """Write the journal, call with the lock."""
+        self._data["updated_at"] = time.time()
+        write_atomic(self.path, json.dumps(self._data, ensure_ascii=False))
+
+    def _project(self, project: str) -> dict:
+        return self._data["projects"].setdefault(
+            project, {"done": False, "modules": {}}
+        )
+
+    def project_started(self, project: str) -> None:
+        """Record that the project is due or running.
+        Checked modules of its unfinished run are kept.
+        """
+        with self._lock:
+            record = self._data["projects"].get(project)
+            if record is None or record["done"]:
+                self._data["projects"][project] = {"done": False, "modules": {}}
+                self._save()
+
+    def unfinished_projects(self) -> list[str]:
+        """Return projects which were started but are not checked."""
+        with self._lock:
+            return [
+                project
+                for project, record in self._data["projects"].items()
+                if not record["done"]
+            ]
+
+    def is_project_done(self, project: str) -> bool:
+        with self._lock:
+            return self._data["projects"].get(project, {}).get("done", False)
+
+    def project_done(self, project: str) -> None:
+        """Record that the project is checked, its modules are not needed anymore."""
+        with self._lock:
+            self._data["projects"][project] = {"done": True, "modules": {}}
+            self._save()
+
+    def completed_modules(self, project: str) -> dict[str, dict]:
+        """Return results of the checked modules of the project by module key."""
+        with self._lock:
+            return dict(self._data["projects"].get(project, {}).get("modules", {}))
+
+    def module_done(self, project: str, key: str, result: dict) -> None:
+        """Record that the module is checked and its changes are stored.
+        result keeps what the rest of the project needs: removed and seen skus,
+        scanned pages and all changes of the project so far.
+        """
+        with self._lock:
+            self._project(project)["modules"][key] = result
+            self._save()
+
+    def notifications(self) -> list[dict]:
+        with self._lock:
+            return list(self._data["notifications"])
+
+    def add_notification(self, notification: dict) -> None:
+        """Record a notification, it's merged with one with the same subject."""
+        with self._lock:
+            self._data["notifications"] = merge_notifications(
+                self._data["notifications"], [notification]
+            )
+            self._save()
+
+    def clear_notifications(self, notifications: list[dict]) -> None:
+        """Forget sent notifications."""
+        with self._lock:
+            self._data["notifications"] = [
+                pending
+                for pending in self._data["notifications"]
+                if pending not in notifications
+            ]
+            self._save()
+
+    def finish(self) -> None:
+        """Remove the journal, the next run starts from the beginning."""
+        with self._lock:
+            self._data = {}
+            self.path.unlink(missing_ok=True)
+
+
+def merge_changes(previous: dict[str, dict], changes: dict[str, dict]) -> dict:
+    """Merge changes by sku, the old value is taken from the previous changes."""
+    merged = dict(previous)
+    for sku, change in changes.items():
+        old = previous[sku]["old"] if sku in previous else change["old"]
+        merged[sku] = {"old": old, "new": change["new"]}
+    return merged
+
+
+def merge_notifications(notifications: list[dict], new: list[dict]) -> list[dict]:
+    """Return notifications with the new ones added to the end.
+    A new notification replaces one with the same subject, changes attached
+    to both are merged, so the changes of an earlier run are not lost.
+    """
+    merged = list(notifications)
+    for notification in new:
+        previous = next(
+            (
+                pending
+                for pending in merged
+                if pending["subject"] == notification["subject"]
+            ),
+            None,
+        )
+        if previous is not None:
+            merged.remove(previous)
+            data = notification["data"]
+            if isinstance(previous["data"], dict) and isinstance(data, dict):
+                data = merge_changes(previous["data"], data)
+            elif data is None:
+                data = previous["data"]
+            notification = dict(notification, data=data)
+        merged.append(notification)
+    return merged
@@ -0,0 +1,319 @@
+"""Scheduler to run projects on their own intervals or cron expressions."""
+
+import contextvars
+import heapq
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, ContextManager, Iterable, Optional
+
+from icecream import ic
+
+# name, min and max value of the cron fields
+CRON_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    # 0 and 7 are both sunday
+    ("weekday", 0, 7),
+)
+
+
+def parse_cron_field(field: str, low: int, high: int) -> set[int]:
+    """Parse a cron field with lists, ranges and steps to a set of values."""
+    values = set()
+    for part in field.split(","):
+        value_range, _, step = part.partition("/")
+        if value_range == "*":
+            start, end = low, high
+        elif "-" in value_range:
+            start, end = (int(value) for value in value_range.split("-"))
+        else:
+            start = int(value_range)
+            end = high if step else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Cron field {field} is out of {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+class IntervalSchedule:
+    """Run every interval seconds."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.key = f"interval:{seconds}"
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Return the next run time after the moment."""
+        return moment + timedelta(seconds=self.seconds)
+
+
+class CronSchedule:
+    """Run on times matching a five fields cron expression, in the local time."""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"Cron expression {expression} must have 5 fields")
+        self.key = f"cron:{expression}"
+        parsed = [
+            parse_cron_field(field, low, high)
+            for field, (_, low, high) in zip(fields, CRON_FIELDS)
+        ]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        # cron matches day or weekday when both of them are restricted
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        # cron weekdays start from sunday
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Return the next matching minute after the moment.
+        Not matching months, days and hours are skipped at once.
+        """
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # any expression matches at least once in 4 years (29th of february)
+        limit = moment + timedelta(days=366 * 4)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression {self.key} never matches")
+
+
+def daily_schedule(schedule_time: str) -> CronSchedule:
+    """Return a schedule to run every day at HH:MM, seconds are ignored."""
+    hour, minute = schedule_time.split(":")[:2]
+    return CronSchedule(f"{int(minute)} {int(hour)} * * *")
+
+
+class ProjectScheduler:
+    """Class to run projects when they are due.
+
+    Due projects run concurrently in a pool of max_workers threads. A project
+    is not started again while its previous run is still going, the overlapping
+    run is skipped. Every run is delayed by a random jitter up to jitter seconds,
+    so projects due at the same time don't hit the hosts at once.
+    Between runs the scheduler sleeps until the next due time.
+    Projects due at the same time, before the jitter, are a batch. With
+    batch_context, like notifier.run, a context is entered when the first run
+    of a batch starts and exited when all runs of the batch are finished.
+    Runs of a batch see context variables set by its context, they run in copies
+    of the contextvars context it is entered in.
+    on_due is called with every project before its run is submitted.
+    """
+
+    def __init__(
+        self,
+        run_project: Callable[[str], None],
+        max_workers: int = 4,
+        jitter: float = 0,
+        batch_context: Optional[Callable[[], ContextManager]] = None,
+        on_due: Optional[Callable[[str], None]] = None,
+    ):
+        self.run_project = run_project
+        self.jitter = jitter
+        self.batch_context = batch_context
+        self.on_due = on_due
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._schedules: dict = {}
+        self._next_run: dict[str, float] = {}
+        # (due time with jitter, project, due time of the batch)
+        self._queue: list[tuple[float, str, float]] = []
+        # due time of the batch -> queued and running runs, entered context
+        # and the contextvars context it is entered in
+        self._batches: dict[float, dict] = {}
+        self._running: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+    def _push(self, project: str, batch: float) -> None:
+        """Set the next run time of the project to the batch time with a jitter,
+        call with the lock.
+        """
+        due = batch + random.uniform(0, self.jitter)
+        self._next_run[project] = due
+        heapq.heappush(self._queue, (due, project, batch))
+        self._batches.setdefault(
+            batch, {"runs": 0, "context": None, "variables": contextvars.Context()}
+        )["runs"] += 1
+        self._wakeup.set()
+
+    def _schedule_next(self, project: str, now: float) -> None:
+        """Schedule the next run of the project after now, call with the lock."""
+        next_run = self._schedules[project].next_after(datetime.fromtimestamp(now))
+        self._push(project, next_run.timestamp())
+
+    def _enter_batch(self, batch: float) -> None:
+        """Enter the context of the batch on its first run, call with the lock."""
+        state = self._batches[batch]
+        if self.batch_context and state["context"] is None:
+            state["context"] = self.batch_context()
+            state["variables"].run(state["context"].__enter__)
+
+    def _release(self, batch: float) -> Optional[dict]:
+        """Count a run of the batch as finished or dropped, call with the lock.
+        Return the batch to exit if it was its last run.
+        """
+        state = self._batches.get(batch)
+        if state is None:
+            return None
+        state["runs"] -= 1
+        if state["runs"]:
+            return None
+        del self._batches[batch]
+        return state
+
+    @staticmethod
+    def _exit_batches(batches: list[Optional[dict]]) -> None:
+        """Exit contexts of finished batches, call without the lock."""
+        for state in batches:
+            if state is None or state["context"] is None:
+                continue
+            try:
+                state["variables"].run(state["context"].__exit__, None, None, None)
+            except Exception as e:
+                ic(e)
+                logging.error(f"Failed to finish a batch of projects: {e}")
+
+    def set_schedules(self, schedules: dict) -> None:
+        """Set schedules by project.
+        New projects and projects with a changed schedule are due on their next
+        time, projects missing in the schedules are not run anymore.
+        """
+        now = time.time()
+        with self._lock:
+            for project in set(self._schedules) - set(schedules):
+                del self._schedules[project]
+                self._next_run.pop(project, None)
+            for project, schedule in schedules.items():
+                current = self._schedules.get(project)
+                self._schedules[project] = schedule
+                if current is None or current.key != schedule.key:
+                    self._schedule_next(project, now)
+
+    def run_all_now(self, projects: Optional[Iterable[str]] = None) -> None:
+        """Make the projects due now, with the jitter, all projects by default.
+        Projects without a schedule are skipped.
+        """
+        now = time.time()
+        with self._lock:
+            for project in self._schedules if projects is None else projects:
+                if project in self._schedules:
+                    self._push(project, now)
+
+    def next_due(self) -> Optional[float]:
+        """Return the time the earliest project is due."""
+        finished = []
+        with self._lock:
+            # drop entries replaced by a later rescheduling
+            while self._queue and (
+                self._next_run.get(self._queue[0][1]) != self._queue[0][0]
+            ):
+                _, _, batch = heapq.heappop(self._queue)
+                finished.append(self._release(batch))
+            due = self._queue[0][0] if self._queue else None
+        self._exit_batches(finished)
+        return due
+
+    def run_due(self) -> list[str]:
+        """Start all due projects and schedule their next runs.
+        Return started projects.
+        """
+        now = time.time()
+        started = []
+        finished = []
+        with self._lock:
+            while self._queue and self._queue[0][0] <= now:
+                due, project, batch = heapq.heappop(self._queue)
+                if self._next_run.get(project) != due:
+                    finished.append(self._release(batch))
+                    continue
+                del self._next_run[project]
+                running = self._running.get(project)
+                if running and not running.done():
+                    ic("Previous run is not finished, skipped", project)
+                    logging.error(f"Run of {project} skipped, previous one is running")
+                    finished.append(self._release(batch))
+                else:
+                    if self.on_due:
+                        self.on_due(project)
+                    self._enter_batch(batch)
+                    self._running[project] = self._executor.submit(
+                        self._batches[batch]["variables"].copy().run,
+                        self._run,
+                        project,
+                        batch,
+                    )
+                    started.append(project)
+                self._schedule_next(project, now)
+        self._exit_batches(finished)
+        return started
+
+    def _run(self, project: str, batch: float) -> None:
+        try:
+            self.run_project(project)
+        except Exception as e:
+            ic(project, e)
+            logging.error(f"Failed to check project {project}: {e}")
+        finally:
+            with self._lock:
+                state = self._release(batch)
+            self._exit_batches([state])
+
+    def run_forever(
+        self,
+        refresh: Optional[Callable[[], dict]] = None,
+        refresh_interval: Optional[float] = None,
+    ) -> None:
+        """Run due projects until stop() is called.
+        refresh returns schedules by project, it's called on every wake up,
+        with refresh_interval the scheduler wakes up at least that often.
+        """
+        while not self._stopped:
+            if refresh:
+                self.set_schedules(refresh())
+            self.run_due()
+            self._wakeup.clear()
+            due = self.next_due()
+            timeout = None if due is None else max(0.0, due - time.time())
+            if refresh and refresh_interval:
+                timeout = (
+                    refresh_interval if due is None else min(timeout, refresh_interval)
+                )
+            self._wakeup.wait(timeout)
+
+    def stop(self, wait: bool = True) -> None:
+        """Stop the scheduler, wait for running projects.
+        Contexts of batches with runs left in the queue are exited.
+        """
+        self._stopped = True
+        self._wakeup.set()
+        self._executor.shutdown(wait=wait)
+        with self._lock:
+            batches = list(self._batches.values())
+            self._batches = {}
+        self._exit_batches(batches)
@@ -0,0 +1,248 @@
+"""Split projects between worker nodes sharing a storage."""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional
+
+from icecream import ic
+
+from atomic_file import write_atomic
+
+# heartbeats of workers and leases of projects expire after this, in seconds
+SHARD_TTL = float(os.getenv("SHARD_TTL", 300))
+# delay between writing a lease and reading it back to check nobody overwrote it
+SHARD_SETTLE_SECONDS = float(os.getenv("SHARD_SETTLE_SECONDS", 1))
+# delay after the first heartbeat, so workers started together see each other
+SHARD_JOIN_DELAY = float(os.getenv("SHARD_JOIN_DELAY", 5))
+
+
+def rendezvous_owner(key: str, workers: Iterable[str]) -> Optional[str]:
+    """Return the worker with the highest hash of the key and the worker id.
+    Adding or removing a worker moves only the keys it gets or had.
+    """
+    return max(
+        workers,
+        key=lambda worker: hashlib.blake2b(
+            f"{worker}\0{key}".encode(), digest_size=8
+        ).digest(),
+        default=None,
+    )
+
+
+class LocalRecordStore:
+    """Class to keep small json records as files in a directory.
+    It stands in for the S3 bucket on a single host or a shared volume.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def read(self, name: str) -> Optional[dict]:
+        try:
+            return json.loads((self.directory / name).read_bytes())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write(self, name: str, record: dict) -> None:
+        """Replace the record atomically, records are rewritten while they live,
+        so they are not synced to the disk.
+        """
+        write_atomic(self.directory / name, json.dumps(record), fsync=False)
+
+    def delete(self, name: str) -> None:
+        (self.directory / name).unlink(missing_ok=True)
+
+    def list(self, prefix: str) -> list[str]:
+        """Return names of all records in the prefix dir."""
+        directory = self.directory / prefix
+        if not directory.is_dir():
+            return []
+        return [
+            f"{prefix}/{path.name}"
+            for path in directory.iterdir()
+            if path.suffix == ".json"
+        ]
+
+
+class S3RecordStore:
+    """Class to keep small json records as objects on the S3 bucket."""
+
+    def __init__(self, prefix: str):
+        from json_items_handlers.s3_items_storage import AWS_STORAGE_BUCKET_NAME
+
+        self.prefix = prefix
+        self.bucket_name = AWS_STORAGE_BUCKET_NAME
+
+    @staticmethod
+    def client():
+        from json_items_handlers.s3_items_storage import get_s3_client
+
+        return get_s3_client()
+
+    def read(self, name: str) -> Optional[dict]:
+        try:
+            response = self.client().get_object(
+                Bucket=self.bucket_name, Key=f"{self.prefix}/{name}"
+            )
+            return json.loads(response["Body"].read())
+        except Exception as e:
+            status = getattr(e, "response", {}).get("ResponseMetadata", {})
+            if status.get("HTTPStatusCode") != 404:
+                ic("read record", name, e)
+            return None
+
+    def write(self, name: str, record: dict) -> None:
+        self.client().put_object(
+            Bucket=self.bucket_name,
+            Key=f"{self.prefix}/{name}",
+            Body=json.dumps(record).encode(),
+        )
+
+    def delete(self, name: str) -> None:
+        self.client().delete_object(
+            Bucket=self.bucket_name, Key=f"{self.prefix}/{name}"
+        )
+
+    def list(self, prefix: str) -> list[str]:
+        names = []
+        paginator = self.client().get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self.bucket_name, Prefix=f"{self.prefix}/{prefix}/"
+        )
+        for page in pages:
+            for item in page.get("Contents", []):
+                names.append(item["Key"][len(self.prefix) + 1 :])
+        return names
+
+
+class Shard:
+    """Class to claim the projects of this worker among all live workers.
+
+    Every worker writes a heartbeat to the shared store. A project belongs to
+    the live worker chosen by rendezvous hashing, so adding a worker takes
+    an equal part of projects from the others and projects of a crashed worker
+    move to the others when its heartbeat expires.
+    Before a run the worker takes a lease of the project, workers which don't
+    agree on the live workers yet never run a project twice. A lease is written
+    and read back after a settle delay, the last writer wins, as the store has
+    no conditional writes. Leases of running projects are renewed, leases of
+    finished ones expire, so a run is not repeated by another worker in the ttl.
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        store,
+        ttl: float = SHARD_TTL,
+        settle_seconds: float = SHARD_SETTLE_SECONDS,
+    ):
+        self.worker_id = worker_id
+        self.store = store
+        self.ttl = ttl
+        self.settle_seconds = settle_seconds
+        self._lock = threading.Lock()
+        # project -> lease record of the running projects
+        self._leases: dict[str, dict] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _heartbeat(self) -> None:
+        self.store.write(
+            f"workers/{self.worker_id}.json",
+            {"worker_id": self.worker_id, "expires_at": time.time() + self.ttl},
+        )
+
+    def _renew(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self._heartbeat()
+                with self._lock:
+                    leases = list(self._leases.items())
+                for project, lease in leases:
+                    lease["expires_at"] = time.time() + self.ttl
+                    self.store.write(f"leases/{project}.json", lease)
+            except Exception as e:
+                ic(e)
+                logging.error(f"Failed to renew the shard of {self.worker_id}: {e}")
+
+    def join(self, delay: float = SHARD_JOIN_DELAY) -> None:
+        """Announce the worker and keep its heartbeat and leases alive."""
+        self._heartbeat()
+        self._thread = threading.Thread(
+            target=self._renew, name="shard-heartbeat", daemon=True
+        )
+        self._thread.start()
+        time.sleep(delay)
+
+    def leave(self) -> None:
+        """Remove the heartbeat, its projects move to the other workers at once.
+        Leases are left to expire.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.store.delete(f"workers/{self.worker_id}.json")
+
+    def live_workers(self) -> list[str]:
+        """Return ids of workers with not expired heartbeats."""
+        now = time.time()
+        workers = {self.worker_id}
+        for name in self.store.list("workers"):
+            record = self.store.read(name)
+            if record and record["expires_at"] > now:
+                workers.add(record["worker_id"])
+        return sorted(workers)
+
+    def owned(self, projects: Iterable[str]) -> list[str]:
+        """Return projects which belong to this worker."""
+        workers = self.live_workers()
+        return [
+            project
+            for project in projects
+            if rendezvous_owner(project, workers) == self.worker_id
+        ]
+
+    def _can_take(self, lease: Optional[dict]) -> bool:
+        return (
+            lease is None
+            or lease["owner"] == self.worker_id
+            or lease["expires_at"] <= time.time()
+        )
+
+    def claim(self, projects: Iterable[str]) -> list[str]:
+        """Take leases of the projects which belong to this worker and are not
+        leased by another one. Return the claimed projects.
+        """
+        written = {}
+        for project in self.owned(projects):
+            if not self._can_take(self.store.read(f"leases/{project}.json")):
+                ic(f"{project} is leased by another worker")
+                continue
+            lease = {
+                "owner": self.worker_id,
+                "token": uuid.uuid4().hex,
+                "expires_at": time.time() + self.ttl,
+            }
+            self.store.write(f"leases/{project}.json", lease)
+            written[project] = lease
+        if written and self.settle_seconds:
+            time.sleep(self.settle_seconds)
+        claimed = []
+        for project, lease in written.items():
+            current = self.store.read(f"leases/{project}.json")
+            if current and current["token"] == lease["token"]:
+                claimed.append(project)
+                with self._lock:
+                    self._leases[project] = lease
+        return claimed
+
+    def done(self, project: str) -> None:
+        """Stop renewing the lease of a finished project, it expires in the ttl."""
+        with self._lock:
+            self._leases.pop(project, None)
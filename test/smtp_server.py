@@ -0,0 +1,76 @@
+"""Local smtp server to test sending of emails without a real one."""
+
+import socketserver
+import threading
+from email import message_from_bytes
+from email.message import Message
+
+
+class LocalSmtpServer:
+    """Plain smtp server on localhost which keeps received emails.
+    It accepts any login and counts connections and logins, so tests can check
+    that emails are sent over one session.
+    """
+
+    def __init__(self):
+        self.messages: list[dict] = []
+        self.connections = 0
+        self.logins = 0
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str) -> None:
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self) -> None:
+                server.connections += 1
+                self.reply("220 localhost ready")
+                mail_from, rcpt_to = None, []
+                while line := self.rfile.readline():
+                    command = line.decode().strip()
+                    verb = command.split(" ", 1)[0].upper()
+                    if verb == "EHLO":
+                        self.reply("250-localhost")
+                        self.reply("250 AUTH PLAIN")
+                    elif verb == "HELO":
+                        self.reply("250 localhost")
+                    elif verb == "AUTH":
+                        server.logins += 1
+                        self.reply("235 authenticated")
+                    elif verb == "MAIL":
+                        mail_from, rcpt_to = command.split(":", 1)[1].strip("<> "), []
+                        self.reply("250 ok")
+                    elif verb == "RCPT":
+                        rcpt_to.append(command.split(":", 1)[1].strip("<> "))
+                        self.reply("250 ok")
+                    elif verb == "DATA":
+                        self.reply("354 end data with <CR><LF>.<CR><LF>")
+                        data = b""
+                        while (data_line := self.rfile.readline()) != b".\r\n":
+                            data += data_line
+                        server.messages.append(
+                            {"from": mail_from, "to": rcpt_to, "data": data}
+                        )
+                        self.reply("250 ok")
+                    elif verb == "QUIT":
+                        self.reply("221 bye")
+                        return
+                    else:
+                        self.reply("250 ok")
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def parsed(self, index: int = -1) -> Message:
+        """Return a received email as a message."""
+        return message_from_bytes(self.messages[index]["data"])
+
+    def __enter__(self) -> "LocalSmtpServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,39 @@
+"""Test atomic replacement of files."""
+
+import os
+import stat
+from unittest.mock import patch
+
+import pytest
+
+from atomic_file import write_atomic
+
+
+def test_write_atomic(tmp_path):
+    path = tmp_path / "dir" / "file.json"
+    write_atomic(path, "Ціна")
+    assert path.read_text(encoding="utf-8") == "Ціна"
+    write_atomic(path, b"{}")
+    assert path.read_bytes() == b"{}"
+    assert [p.name for p in path.parent.iterdir()] == ["file.json"]
+
+
+def test_write_atomic_mode(tmp_path):
+    path = tmp_path / "file.json"
+    write_atomic(path, b"{}")
+    # the same mode as of a file created by open()
+    with open(tmp_path / "plain.json", "wb"):
+        pass
+    assert stat.S_IMODE(os.stat(path).st_mode) == stat.S_IMODE(
+        os.stat(tmp_path / "plain.json").st_mode
+    )
+
+
+def test_failed_write_keeps_the_file(tmp_path):
+    path = tmp_path / "file.json"
+    write_atomic(path, b"old")
+    with patch("atomic_file.os.replace", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            write_atomic(path, b"new")
+    assert path.read_bytes() == b"old"
+    assert [p.name for p in tmp_path.iterdir()] == ["file.json"]
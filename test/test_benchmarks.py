@@ -0,0 +1,71 @@
+"""Test synthetic catalogue of the benchmarks."""
+
+import requests
+
+from benchmarks.server import CatalogueServer
+from benchmarks.startup import (
+    bench_startup,
+    check_regression,
+    direct_imports,
+    parse_importtime,
+)
+from benchmarks.synthetic import make_listing_page, make_module_config
+from extraction import ExtractionPlan
+
+
+def test_synthetic_page_matches_module_config():
+    module = make_module_config("https://example.com", 0, pages=2, fields=5)
+    plan = ExtractionPlan(module)
+    page = make_listing_page(0, 1, pages=2, items=10, fields=5)
+    items, _ = plan.parse_items(page)
+    assert len(items) == 10
+    item = plan.extract(items[0])
+    assert item["sku"] == "M0-P1-0000"
+    assert item["link"] == "https://example.com/p/M0-P1-0000.html"
+    assert set(item) == {"sku", "price", "link", "field_0", "field_1"}
+
+
+def test_catalogue_server():
+    with CatalogueServer(pages=2, items=10) as server:
+        first = requests.get(server.base_url + "/m0/page_1").content
+        assert requests.get(server.base_url + "/m0/page_3").status_code == 404
+        assert server.change_prices(0.5) == 10
+        assert requests.get(server.base_url + "/m0/page_1").content != first
+        assert server.requests == 3
+
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   _io
+import time:       200 |        300 | site
+import time:        50 |         50 |     json.decoder
+import time:       150 |        200 |   json
+import time:       400 |        400 |   requests
+import time:        10 |        610 | main
+"""
+
+
+def test_parse_importtime():
+    entries = parse_importtime(IMPORTTIME_OUTPUT)
+    assert entries[0] == ("_io", 1, 100, 100)
+    assert entries[2] == ("json.decoder", 2, 50, 50)
+    assert entries[-1] == ("main", 0, 10, 610)
+    assert direct_imports(entries, "main") == {"json": 200, "requests": 400}
+
+
+def test_check_regression():
+    baseline = {"startup": {"import_us": 1000, "lazy_modules_loaded": []}}
+    results = {
+        "params": {"module": "main"},
+        "startup": {"import_us": 1100, "lazy_modules_loaded": []},
+    }
+    assert check_regression(results, baseline, 0.2) is None
+    assert "more than 1050 us" in check_regression(results, baseline, 0.05)
+    results["startup"]["lazy_modules_loaded"] = ["boto3"]
+    assert "boto3" in check_regression(results, baseline, 0.2)
+
+
+def test_main_does_not_import_lazy_modules():
+    startup = bench_startup("main", repeat=1, top=3)
+    assert startup["import_us"] > 0
+    assert len(startup["imports"]) == 3
+    assert startup["lazy_modules_loaded"] == []
@@ -0,0 +1,164 @@
+"""Test extraction plans."""
+
+import unittest
+
+from lxml.html import document_fromstring
+
+from extraction import ExtractionPlan, TagSelector, parse_html, stream_element
+
+HTML_SOURCE = """
+<div class="catalog">
+  <div class="item card">
+    <span class="sku"> A-1 </span>
+    <span class="price value current">100</span>
+    <a class="title" href="/a-1">A</a>
+  </div>
+  <div class="item">
+    <span class="sku">B-2</span>
+    <span class="price value">200</span>
+    <a href="/b-2">B</a>
+  </div>
+</div>
+<div class="item"><span class="sku">outside</span></div>
+<footer><p>footer</p></footer>
+"""
+
+
+class TestTagSelector(unittest.TestCase):
+    """Test TagSelector class."""
+
+    def setUp(self):
+        """Set up test."""
+        self.tree = document_fromstring(HTML_SOURCE)
+
+    def test_single_class_matches_any_class_token(self):
+        """Test a single class matches elements with several classes."""
+        self.assertEqual(len(TagSelector("div", "item").find_all(self.tree)), 3)
+        self.assertEqual(len(TagSelector("div", "card").find_all(self.tree)), 1)
+
+    def test_several_classes_match_whole_attribute(self):
+        """Test several classes match only the same class attribute."""
+        selector = TagSelector("span", "price value current")
+        self.assertEqual(selector.find(self.tree).text, "100")
+        self.assertIsNone(TagSelector("span", "value price").find(self.tree))
+
+    def test_matches(self):
+        """Test the element itself is matched."""
+        element = TagSelector("div", "card").find(self.tree)
+        self.assertTrue(TagSelector("div", "item").matches(element))
+        self.assertFalse(TagSelector("span", "item").matches(element))
+
+    def test_tag_without_class(self):
+        """Test selector without class and limit."""
+        self.assertEqual(len(TagSelector("a").find_all(self.tree, limit=1)), 1)
+        self.assertIsNone(TagSelector("table").find(self.tree))
+
+
+class TestExtractionPlan(unittest.TestCase):
+    """Test ExtractionPlan class."""
+
+    def setUp(self):
+        """Set up test."""
+        self.tree = document_fromstring(HTML_SOURCE)
+        self.module = {
+            "items_container": {"tag": "div", "class": "catalog"},
+            "single_item_container": {"tag": "div", "class": "item"},
+            "item_fields": {
+                "sku": {"tag": "span", "class": "sku", "text": True, "strip": True},
+                "price": {"tag": "span", "class": "price value", "text": True},
+                "link": {
+                    "tag": "a",
+                    "attr": "href",
+                    "prepend": "https://example.com",
+                },
+            },
+        }
+
+    def test_find_items(self):
+        """Test items are searched in the container only."""
+        plan = ExtractionPlan(self.module)
+        self.assertEqual(len(plan.find_items(self.tree)), 2)
+
+        plan = ExtractionPlan(
+            {**self.module, "items_container": {"selector": ".catalog"}}
+        )
+        self.assertEqual(len(plan.find_items(self.tree)), 2)
+
+        plan = ExtractionPlan({**self.module, "items_container": None})
+        self.assertEqual(len(plan.find_items(self.tree)), 1)
+
+        plan = ExtractionPlan({**self.module, "items_container": {"tag": "ul"}})
+        self.assertEqual(plan.find_items(self.tree), [])
+
+    def test_extract(self):
+        """Test fields are extracted and empty fields are skipped."""
+        plan = ExtractionPlan(self.module)
+        first, second = plan.find_items(self.tree)
+
+        self.assertEqual(
+            plan.extract(first),
+            {"sku": "A-1", "link": "https://example.com/a-1"},
+        )
+        self.assertEqual(
+            plan.extract(second),
+            {"sku": "B-2", "price": "200", "link": "https://example.com/b-2"},
+        )
+
+
+class TestParsing(unittest.TestCase):
+    """Test full and targeted parsing of a page."""
+
+    def setUp(self):
+        """Set up test."""
+        self.module = {
+            "items_container": {"tag": "div", "class": "catalog"},
+            "single_item_container": {"tag": "div", "class": "item"},
+            "item_fields": {"sku": {"tag": "span", "class": "sku", "text": True}},
+        }
+
+    def test_parse_html_bytes_with_encoding(self):
+        """Test bytes are decoded with the charset from the response headers."""
+        source = "<p>Ціна</p>".encode("cp1251")
+        self.assertEqual(parse_html(source, "cp1251").findtext(".//p"), "Ціна")
+        self.assertIsNone(parse_html(b""))
+
+    def test_stream_element(self):
+        """Test parsing stops after the container is closed."""
+        source = HTML_SOURCE.replace("<footer>", "<p>padding</p>" * 5000 + "<footer>")
+        element, parsed = stream_element(source, TagSelector("div", "catalog"))
+        self.assertEqual(element.get("class"), "catalog")
+        self.assertEqual(len(TagSelector("div", "item").find_all(element)), 2)
+        # the end of the page is not parsed
+        self.assertIsNone(element.getroottree().find(".//footer"))
+        self.assertEqual(parsed, 11)
+
+        element, _ = stream_element(HTML_SOURCE, TagSelector("table"))
+        self.assertIsNone(element)
+
+    def test_parse_modes_find_same_items(self):
+        """Test targeted and full modes return the same items."""
+        plan = ExtractionPlan(self.module)
+        targeted, targeted_stats = plan.parse_items(HTML_SOURCE.encode(), "targeted")
+        full, full_stats = plan.parse_items(HTML_SOURCE.encode(), "full")
+
+        self.assertEqual(
+            [plan.extract(item) for item in targeted],
+            [plan.extract(item) for item in full],
+        )
+        self.assertEqual(targeted_stats["mode"], "targeted")
+        self.assertEqual(full_stats["mode"], "full")
+        self.assertLess(targeted_stats["elements"], full_stats["elements"])
+
+    def test_parse_items_selector_falls_back_to_full(self):
+        """Test a container by css selector can't be streamed."""
+        plan = ExtractionPlan({**self.module, "items_container": {"selector": "div"}})
+        items, stats = plan.parse_items(HTML_SOURCE, "targeted")
+        self.assertEqual(stats["mode"], "full")
+        self.assertEqual(len(items), 2)
+
+    def test_parse_items_single_item(self):
+        """Test only the first item is parsed without a container."""
+        plan = ExtractionPlan({**self.module, "items_container": None})
+        items, _ = plan.parse_items(HTML_SOURCE, "targeted")
+        self.assertEqual(len(items), 1)
+        self.assertEqual(plan.extract(items[0]), {"sku": " A-1 "})
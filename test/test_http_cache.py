@@ -0,0 +1,97 @@
+"""Test ValidatorCache class."""
+
+import unittest
+from unittest.mock import MagicMock
+
+from http_cache import ValidatorCache, config_hash
+
+
+class TestValidatorCache(unittest.TestCase):
+    """Test ValidatorCache class."""
+
+    def setUp(self):
+        """Set up test."""
+        self.url = "https://example.com?page=1"
+        self.storage = MagicMock()
+        self.storage.read_json_file.return_value = {}
+        self.cache = ValidatorCache(self.storage)
+
+    @staticmethod
+    def make_response(status_code=200, content=b"<html></html>", headers=None):
+        """Make a response mock."""
+        return MagicMock(
+            status_code=status_code, content=content, headers=headers or {}
+        )
+
+    def test_get_headers(self):
+        """Test conditional headers are built from stored validators."""
+        self.assertEqual(self.cache.get_headers(self.url), {})
+        response = self.make_response(
+            headers={"ETag": '"abc"', "Last-Modified": "Wed, 21 Oct 2026 07:28:00 GMT"}
+        )
+        self.cache.is_unchanged(self.url, response)
+        self.assertEqual(
+            self.cache.get_headers(self.url),
+            {
+                "If-None-Match": '"abc"',
+                "If-Modified-Since": "Wed, 21 Oct 2026 07:28:00 GMT",
+            },
+        )
+
+    def test_is_unchanged_not_modified(self):
+        """Test 304 response is unchanged only for known urls."""
+        response = self.make_response(status_code=304, content=b"")
+        self.assertFalse(self.cache.is_unchanged(self.url, response))
+        self.cache.is_unchanged(self.url, self.make_response(headers={"ETag": "x"}))
+        self.assertTrue(self.cache.is_unchanged(self.url, response))
+
+    def test_is_unchanged_by_hash(self):
+        """Test page with the same body is unchanged without validators."""
+        self.assertFalse(self.cache.is_unchanged(self.url, self.make_response()))
+        self.assertTrue(self.cache.is_unchanged(self.url, self.make_response()))
+        self.assertFalse(
+            self.cache.is_unchanged(self.url, self.make_response(content=b"<p></p>"))
+        )
+        self.assertFalse(
+            self.cache.is_unchanged(self.url, self.make_response(status_code=500))
+        )
+
+    def test_is_unchanged_with_another_config(self):
+        """Test page parsed with another module config is changed."""
+        old_config = config_hash({"item_fields": {"price": {"tag": "span"}}})
+        new_config = config_hash({"item_fields": {"price": {"tag": "b"}}})
+        response = self.make_response(headers={"ETag": "x"})
+        self.cache.is_unchanged(self.url, response, old_config)
+        self.assertTrue(self.cache.is_unchanged(self.url, response, old_config))
+        self.assertEqual(
+            self.cache.get_headers(self.url, old_config), {"If-None-Match": "x"}
+        )
+        # validators are not sent, so the page is loaded in full
+        self.assertEqual(self.cache.get_headers(self.url, new_config), {})
+        not_modified = self.make_response(status_code=304, content=b"")
+        self.assertFalse(self.cache.is_unchanged(self.url, not_modified, new_config))
+        self.assertFalse(self.cache.is_unchanged(self.url, response, new_config))
+        self.assertTrue(self.cache.is_unchanged(self.url, response, new_config))
+
+    def test_has_next(self):
+        """Test has_next flag is kept after the page is checked again."""
+        self.assertTrue(self.cache.has_next(self.url))
+        self.cache.set_has_next(self.url, False)
+        self.cache.is_unchanged(self.url, self.make_response())
+        self.assertFalse(self.cache.has_next(self.url))
+
+    def test_save(self):
+        """Test the cache is written only when it changed."""
+        self.cache.save()
+        self.storage.save_to_json_file.assert_not_called()
+        self.cache.is_unchanged(self.url, self.make_response())
+        self.cache.save()
+        self.cache.save()
+        self.storage.save_to_json_file.assert_called_once()
+
+    def test_forget(self):
+        """Test a forgotten url is loaded without validators."""
+        self.cache.is_unchanged(self.url, self.make_response(headers={"ETag": '"abc"'}))
+        self.assertTrue(self.cache.get_headers(self.url))
+        self.cache.forget(self.url)
+        self.assertEqual(self.cache.get_headers(self.url), {})
@@ -1,9 +1,10 @@
 """Test JsonItemsLocalStorage class."""
 
+import importlib.util
 import unittest
 from pathlib import Path
 
-from json_items_handlers import JsonItemsLocalStorage
+from json_items_handlers import JsonItemsLocalStorage, item_fingerprint
 
 
 class TestJsonItemsLocalStorage(unittest.TestCase):
@@ -25,7 +26,14 @@ class TestJsonItemsLocalStorage(unittest.TestCase):
 
     def tearDown(self):
         """Tear down test."""
-        pass
+        # remove fingerprints index and deltas written by flush
+        for file_name in (
+            self.json_handler.index_file_name,
+            self.json_handler.deltas_file_name,
+        ):
+            Path.unlink(
+                self.json_handler.full_path.with_name(file_name), missing_ok=True
+            )
 
     def test_read_json_file(self):
         """Test read_json_file method."""
@@ -51,6 +59,168 @@ class TestJsonItemsLocalStorage(unittest.TestCase):
         self.json_handler.save_to_json_file(data)
         data = {"test2": "test2"}
         self.json_handler.append_to_json_file(data)
-        self.assertEqual(self.json_handler.read_json_file(), {"test": "test", "test2": "test2"})
+        self.assertEqual(
+            self.json_handler.read_json_file(), {"test": "test", "test2": "test2"}
+        )
+        # remove temporary file
+        Path.unlink(self.json_handler.full_path)
+
+    def test_stage_items_and_flush(self):
+        """Test staged items are written only on flush."""
+        self.json_handler.save_to_json_file({"test": "test"})
+        self.json_handler.stage_items({"test2": "test2"})
+        self.json_handler.stage_items({"test3": "test3"})
+        self.assertEqual(self.json_handler.pending_count, 2)
+        self.assertEqual(self.json_handler.read_json_file(), {"test": "test"})
+
+        self.assertTrue(self.json_handler.flush())
+        self.assertEqual(
+            self.json_handler.read_json_file(),
+            {"test": "test", "test2": "test2", "test3": "test3"},
+        )
+        self.assertEqual(self.json_handler.pending_count, 0)
+        # nothing to write on the second flush
+        self.assertFalse(self.json_handler.flush())
+        self.assertFalse(
+            self.json_handler.full_path.with_name(
+                self.json_handler.full_path.name + ".tmp"
+            ).exists()
+        )
+        # remove temporary file
+        Path.unlink(self.json_handler.full_path)
+
+    def test_read_fingerprints_migrates_existing_file(self):
+        """Test fingerprints index is built for an items file without one."""
+        data = {"sku1": {"sku": "sku1", "price": "1"}}
+        self.json_handler.save_to_json_file(data)
+        index_path = self.json_handler.full_path.with_name(
+            self.json_handler.index_file_name
+        )
+        self.assertFalse(index_path.exists())
+
+        fingerprints = self.json_handler.read_fingerprints()
+        self.assertEqual(fingerprints, {"sku1": item_fingerprint(data["sku1"])})
+        self.assertTrue(index_path.exists())
+        # remove temporary file
+        Path.unlink(self.json_handler.full_path)
+
+    def test_save_to_json_file_rewrites_index(self):
+        """Test a new snapshot replaces the fingerprints of the old one."""
+        self.json_handler.stage_items({"sku1": {"sku": "sku1"}})
+        self.json_handler.flush()
+        self.json_handler.read_fingerprints()
+
+        data = {"sku2": {"sku": "sku2"}}
+        self.json_handler.save_to_json_file(data)
+        expected = {"sku2": item_fingerprint(data["sku2"])}
+        self.assertEqual(self.json_handler.read_fingerprints(), expected)
+        reloaded = JsonItemsLocalStorage(self.file_name)
+        self.assertEqual(reloaded.read_fingerprints(), expected)
+        # the index on disk is rewritten by an instance which didn't read it
+        JsonItemsLocalStorage(self.file_name).save_to_json_file({})
+        self.assertEqual(JsonItemsLocalStorage(self.file_name).read_fingerprints(), {})
+        # remove temporary file
+        Path.unlink(self.json_handler.full_path)
+
+    def test_flush_updates_fingerprints(self):
+        """Test flush writes fingerprints of the staged items to the index."""
+        self.json_handler.stage_items({"sku1": {"sku": "sku1"}})
+        self.json_handler.flush()
+
+        reloaded = JsonItemsLocalStorage(self.file_name)
+        self.assertEqual(
+            reloaded.read_fingerprints(),
+            {"sku1": item_fingerprint({"sku": "sku1"})},
+        )
         # remove temporary file
         Path.unlink(self.json_handler.full_path)
+
+    def test_flush_appends_delta(self):
+        """Test flush writes changes to the deltas instead of the snapshot."""
+        data = {f"sku{i}": {"price": str(i)} for i in range(10)}
+        self.json_handler.save_to_json_file(data)
+        snapshot = self.json_handler.full_path.read_bytes()
+
+        self.json_handler.stage_items(
+            {"sku1": {"price": "100"}, "sku2": {"price": "2"}}
+        )
+        self.json_handler.flush()
+        self.assertEqual(self.json_handler.full_path.read_bytes(), snapshot)
+        self.assertEqual(
+            self.json_handler.changes,
+            {"sku1": {"old": {"price": "1"}, "new": {"price": "100"}}},
+        )
+
+        reloaded = JsonItemsLocalStorage(self.file_name)
+        self.assertEqual(reloaded.read_json_file(), {**data, "sku1": {"price": "100"}})
+        self.assertEqual(
+            reloaded.read_fingerprints()["sku1"], item_fingerprint({"price": "100"})
+        )
+        # remove temporary file
+        Path.unlink(self.json_handler.full_path)
+
+    @unittest.skipIf(
+        importlib.util.find_spec("msgpack") is None, "msgpack is not installed"
+    )
+    def test_flush_twice_in_msgpack(self):
+        """Test msgpack deltas written by one flush are read by the next one."""
+        self.json_handler._file_format = "msgpack"
+        data = {f"sku{i}": {"price": str(i)} for i in range(10)}
+        self.json_handler.save_to_json_file(data)
+        self.json_handler.stage_items({"sku1": {"price": "100"}})
+        self.json_handler.flush()
+        reloaded = JsonItemsLocalStorage(self.file_name)
+        reloaded._file_format = "msgpack"
+        reloaded.stage_items({"sku2": {"price": "200"}})
+        reloaded.flush()
+
+        self.assertEqual(len(JsonItemsLocalStorage(self.file_name)._read_deltas()), 2)
+        self.assertEqual(
+            JsonItemsLocalStorage(self.file_name).read_json_file(),
+            {**data, "sku1": {"price": "100"}, "sku2": {"price": "200"}},
+        )
+        # remove temporary file
+        Path.unlink(self.json_handler.full_path)
+
+    def test_deltas_are_compacted(self):
+        """Test deltas are merged into a new snapshot."""
+        data = {f"sku{i}": {"price": str(i)} for i in range(10)}
+        self.json_handler.save_to_json_file(data)
+        self.json_handler._snapshot_max_deltas = 2
+        self.json_handler.stage_items({"sku1": {"price": "100"}})
+        self.json_handler.flush()
+        self.json_handler.stage_items({"sku2": {"price": "200"}})
+        self.json_handler.flush()
+
+        reloaded = JsonItemsLocalStorage(self.file_name)
+        self.assertEqual(reloaded._read_deltas(), [])
+        self.assertEqual(
+            reloaded.read_json_file(),
+            {**data, "sku1": {"price": "100"}, "sku2": {"price": "200"}},
+        )
+        # remove temporary file
+        Path.unlink(self.json_handler.full_path)
+
+    def test_stage_removed_with_tombstones(self):
+        """Test removed items are dropped and kept as tombstones on compaction."""
+        self.json_handler.save_to_json_file(
+            {"sku1": {"price": "1"}, "sku2": {"price": "2"}}
+        )
+        self.json_handler._tombstone_retention_days = 30
+        self.json_handler.stage_removed(["sku1", "sku3"])
+        self.json_handler.flush()
+        self.json_handler.compact()
+
+        self.assertEqual(
+            self.json_handler.changes, {"sku1": {"old": {"price": "1"}, "new": None}}
+        )
+        self.assertEqual(self.json_handler.read_json_file(), {"sku2": {"price": "2"}})
+        tombstones = self.json_handler.read_tombstones()
+        self.assertEqual(tombstones["sku1"]["item"], {"price": "1"})
+        # remove temporary files
+        Path.unlink(self.json_handler.full_path)
+        Path.unlink(
+            self.json_handler.full_path.with_name(
+                self.json_handler.tombstones_file_name
+            )
+        )
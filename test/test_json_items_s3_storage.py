@@ -0,0 +1,142 @@
+"""Test JsonItemsS3Storage class against a stub S3 client."""
+
+import io
+import unittest
+from unittest.mock import patch
+
+from json_items_handlers import JsonItemsS3Storage
+from json_items_handlers.s3_items_storage import content_etag
+
+
+class StubClientError(Exception):
+    """Error shaped like botocore ClientError."""
+
+    def __init__(self, code: str, status: int):
+        super().__init__(code)
+        self.response = {
+            "Error": {"Code": code},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        }
+
+
+class StubS3Client:
+    """In-memory S3 client with get_object and put_object calls."""
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+        self.error = None
+        self.put_errors = {}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.calls.append(("get", Key))
+        if self.error:
+            raise self.error
+        if Key not in self.objects:
+            raise StubClientError("NoSuchKey", 404)
+        etag = content_etag(self.objects[Key])
+        if IfNoneMatch == etag:
+            raise StubClientError("304", 304)
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": etag}
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append(("put", Key))
+        if Key in self.put_errors:
+            raise self.put_errors[Key]
+        self.objects[Key] = Body
+        return {"ETag": content_etag(Body)}
+
+
+class TestJsonItemsS3Storage(unittest.TestCase):
+    """Test JsonItemsS3Storage class."""
+
+    def setUp(self):
+        """Set up test."""
+        self.client = StubS3Client()
+        patcher = patch(
+            "json_items_handlers.s3_items_storage.get_s3_client",
+            return_value=self.client,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        JsonItemsS3Storage.clear_objects_cache()
+        self.storage = JsonItemsS3Storage("output_project.json")
+        self.key = "items_list_output/output_project.json"
+
+    def calls_of(self, key: str) -> list[str]:
+        """Return names of the calls to the object."""
+        return [name for name, call_key in self.client.calls if call_key == key]
+
+    def test_read_missing_file(self):
+        """Test reading a missing file creates an empty one."""
+        self.assertEqual(self.storage.read_json_file(), {})
+        self.assertIn("items_list_output/output_project.json", self.client.objects)
+
+    def test_unchanged_write_is_skipped(self):
+        """Test writing the same content twice makes one PUT."""
+        self.storage.save_to_json_file({"1": {"name": "a"}})
+        self.storage.save_to_json_file({"1": {"name": "a"}})
+        self.assertEqual(self.calls_of(self.key), ["put"])
+        self.storage.save_to_json_file({"1": {"name": "b"}})
+        self.assertEqual(self.calls_of(self.key), ["put", "put"])
+
+    def test_conditional_read(self):
+        """Test a not modified object is served from the local cache."""
+        key = self.key
+        self.client.objects[key] = b'{"1": {"name": "a"}}'
+        self.assertEqual(self.storage.read_json_file(), {"1": {"name": "a"}})
+        other = JsonItemsS3Storage("output_project.json")
+        self.assertEqual(other.read_json_file(), {"1": {"name": "a"}})
+        # changed by another writer
+        self.client.objects[key] = b'{"1": {"name": "b"}}'
+        self.assertEqual(other.read_json_file(), {"1": {"name": "b"}})
+        self.assertEqual(self.calls_of(key), ["get"] * 3)
+
+    def test_read_error_is_raised(self):
+        """Test a failed read doesn't overwrite the file with an empty one."""
+        self.client.objects[self.key] = b'{"1": {"name": "a"}}'
+        self.client.error = StubClientError("SlowDown", 503)
+        with self.assertRaises(StubClientError):
+            self.storage.read_json_file()
+        self.assertEqual(self.client.objects[self.key], b'{"1": {"name": "a"}}')
+        self.assertNotIn("put", self.calls_of(self.key))
+
+    def test_failed_snapshot_write_keeps_deltas(self):
+        """Test compaction stops when the snapshot PUT fails partway."""
+        self.storage.save_to_json_file({"1": {"name": "a"}, "2": {"name": "b"}})
+        self.storage.read_fingerprints()
+        self.storage.append_to_json_file({"1": {"name": "c"}})
+        deltas_key = "items_list_output/" + self.storage.deltas_file_name
+        index_key = "items_list_output/" + self.storage.index_file_name
+        deltas = self.client.objects[deltas_key]
+        index = self.client.objects[index_key]
+
+        self.client.put_errors[self.key] = StubClientError("InternalError", 500)
+        with self.assertRaises(StubClientError):
+            self.storage.compact()
+        # the index and the deltas are not written over the old snapshot
+        self.assertEqual(self.client.objects[deltas_key], deltas)
+        self.assertEqual(self.client.objects[index_key], index)
+        expected = {"1": {"name": "c"}, "2": {"name": "b"}}
+        reloaded = JsonItemsS3Storage("output_project.json")
+        self.assertEqual(reloaded.read_json_file(), expected)
+
+        del self.client.put_errors[self.key]
+        self.storage.compact()
+        self.assertEqual(
+            JsonItemsS3Storage("output_project.json").read_json_file(), expected
+        )
+
+    def test_objects_cache_is_bounded(self):
+        """Test the least recently used objects are dropped from the cache."""
+        with patch.object(JsonItemsS3Storage, "_objects_cache_bytes", 60):
+            for name in ("a", "b", "c"):
+                JsonItemsS3Storage(f"output_{name}.json").save_to_json_file(
+                    {"1": {"name": name * 5}}
+                )
+            cached = list(JsonItemsS3Storage._objects_cache)
+            self.assertEqual(
+                cached,
+                ["items_list_output/output_b.json", "items_list_output/output_c.json"],
+            )
+            self.assertLessEqual(JsonItemsS3Storage._objects_cache_size, 60)
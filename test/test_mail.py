@@ -0,0 +1,129 @@
+"""Test sending of emails and notifications against a local smtp server."""
+
+import contextvars
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+import mail
+from mail import Notifier, build_message, send_messages
+
+
+def attachments(message) -> list[dict]:
+    return [
+        json.loads(part.get_payload(decode=True))
+        for part in message.walk()
+        if part.get_content_type() == "application/json"
+    ]
+
+
+def test_notification_email(smtp_server):
+    Notifier().notify("Changes", "project", json_data={"1": {"old": None, "new": {}}})
+    assert smtp_server.messages[0]["to"] == ["first@example.com", "second@example.com"]
+    message = smtp_server.parsed()
+    assert message["subject"] == "Changes"
+    assert attachments(message) == [{"1": {"old": None, "new": {}}}]
+
+
+def test_send_messages_over_one_session(smtp_server):
+    assert send_messages([build_message(f"Email {i}") for i in range(3)]) == 3
+    assert len(smtp_server.messages) == 3
+    assert smtp_server.connections == 1
+    assert smtp_server.logins == 1
+
+
+def test_send_messages_error():
+    with patch.multiple(mail, smtp_server="127.0.0.1", smtp_port=1, smtp_ssl=False):
+        assert send_messages([build_message("Email")]) == 0
+
+
+def test_notifier_digest(smtp_server):
+    notifier = Notifier(digest=True)
+    with notifier.run():
+        with notifier.run():
+            notifier.notify("No items in a found", "a")
+        notifier.notify("Changes detected in b", "b", json_data={"1": {"new": 1}})
+        assert smtp_server.messages == []
+    assert len(smtp_server.messages) == 1
+    message = smtp_server.parsed()
+    assert message["subject"] == "2 notifications from the monitoring"
+    body = next(
+        part.get_payload(decode=True).decode()
+        for part in message.walk()
+        if part.get_content_type() == "text/plain"
+    )
+    assert body.splitlines() == ["No items in a found", "Changes detected in b"]
+    assert attachments(message) == [{"1": {"new": 1}}]
+
+
+def test_notifier_without_digest(smtp_server):
+    notifier = Notifier(digest=False)
+    with notifier.run():
+        notifier.notify("First")
+        notifier.notify("Second")
+    assert [smtp_server.parsed(i)["subject"] for i in range(2)] == ["First", "Second"]
+    assert smtp_server.connections == 1
+
+
+def test_notifier_merges_changes_of_one_subject():
+    send_messages_mock = MagicMock(return_value=1)
+    notifier = Notifier(send_messages=send_messages_mock)
+    notifier.extend(
+        [
+            {
+                "subject": "Changes detected in a",
+                "project_name": "a",
+                "data": {"1": {"old": None, "new": {"price": 1}}},
+            }
+        ]
+    )
+    with notifier.run():
+        notifier.notify(
+            "Changes detected in a", "a", json_data={"2": {"old": None, "new": {}}}
+        )
+    (message,) = send_messages_mock.call_args.args[0]
+    assert attachments(message) == [
+        {"1": {"old": None, "new": {"price": 1}}, "2": {"old": None, "new": {}}}
+    ]
+
+
+def test_notifier_outside_of_run():
+    send_messages_mock = MagicMock(return_value=1)
+    notifier = Notifier(send_messages=send_messages_mock)
+    notifier.notify("Alert")
+    send_messages_mock.assert_called_once()
+    assert notifier.send() == 0
+
+
+def test_notifier_runs_are_sent_separately():
+    send_messages_mock = MagicMock(return_value=1)
+    notifier = Notifier(send_messages=send_messages_mock)
+    other_run_started = threading.Event()
+    other_run_can_end = threading.Event()
+
+    def other_run():
+        with notifier.run():
+            notifier.notify("Changes detected in b")
+            other_run_started.set()
+            other_run_can_end.wait(5)
+
+    thread = threading.Thread(target=other_run)
+    thread.start()
+    other_run_started.wait(5)
+    with notifier.run():
+        # a thread started in a copy of the run context takes part in the run
+        worker = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(notifier.notify, "Changes detected in a"),
+        )
+        worker.start()
+        worker.join()
+    # the run is sent while the other one is still going
+    send_messages_mock.assert_called_once()
+    (message,) = send_messages_mock.call_args.args[0]
+    assert message["subject"] == "Changes detected in a"
+    other_run_can_end.set()
+    thread.join()
+    assert send_messages_mock.call_count == 2
+    (message,) = send_messages_mock.call_args.args[0]
+    assert message["subject"] == "Changes detected in b"
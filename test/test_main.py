@@ -1,28 +1,93 @@
 """Test cases for main.py."""
 
+import multiprocessing
 import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from unittest.mock import MagicMock, patch
 
-from bs4 import BeautifulSoup
+import pytest
+from lxml.html import document_fromstring
 
+from extraction import ExtractionPlan
+from json_items_handlers import JsonItemsLocalStorage, item_fingerprint
 from main import (
+    apply_changes,
     check_changes,
+    check_project,
+    check_storage_settings,
     get_all_items_to_check,
-    get_url_response,
+    get_file_storage_class,
+    get_module_urls,
+    get_project_schedule,
+    get_storage_class,
+    get_url_responses,
+    has_next_page,
+    schedule_task,
+    scrap_page,
+    scrap_pages_in_pool,
     scrap_single_item,
 )
+from removals import ModuleScan
+from run_journal import RunJournal
 
 
 def test_scrap_single_item(single_item_html_source, json_project_settings):
     """Test scrap_single_item function."""
-    soup = BeautifulSoup(single_item_html_source, "lxml")
-    sku, product_dict = scrap_single_item(soup, json_project_settings["modules"][0])
+    tree = document_fromstring(single_item_html_source)
+    sku, product_dict = scrap_single_item(tree, json_project_settings["modules"][0])
 
     assert sku == "LV II.7.180.47.5.B"
     assert product_dict[sku]["price"] == "14 990 грн"
     assert product_dict[sku]["stock"] == "В наявності"
 
 
+def test_scrap_page(items_container_html_source, json_project_settings):
+    """Test scrap_page function returns plain scrapped items."""
+    scraped_items, parse_stats = scrap_page(
+        items_container_html_source.encode(),
+        json_project_settings["modules"][0],
+        "utf-8",
+    )
+    assert len(scraped_items) == 24
+    sku, product_dict = scraped_items[0]
+    assert product_dict[sku]["sku"] == sku
+    assert parse_stats["bytes"] > 0
+
+
+def test_scrap_pages_in_pool(
+    items_container_html_source, single_page_html_source, mock_project_object
+):
+    """Test scrap_pages_in_pool function parses pages in worker processes."""
+    urls = list(get_module_urls(mock_project_object.modules[0]))
+    empty_page = MagicMock(content=b"<html><body></body></html>", headers={})
+    responses = [
+        (urls[0], MagicMock(content=items_container_html_source.encode(), headers={})),
+        (urls[1], empty_page),
+    ]
+    with (
+        ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor,
+        patch("main.notifier") as notifier_mock,
+    ):
+        pages = list(scrap_pages_in_pool(responses, mock_project_object, 0, executor))
+        assert [(url, len(page)) for url, page in pages] == [
+            (urls[0], 24),
+            (urls[1], 0),
+        ]
+        # the page past the end of the paginator is not reported
+        notifier_mock.notify.assert_not_called()
+
+        pages = list(
+            scrap_pages_in_pool(
+                [(urls[0], empty_page)], mock_project_object, 0, executor
+            )
+        )
+    assert [len(page) for _, page in pages] == [0]
+    notifier_mock.notify.assert_called_once()
+
+
 class TestGetAllItemsToCheck:
     """Test cases for get_all_items_to_check function."""
 
@@ -40,13 +105,14 @@ class TestGetAllItemsToCheck:
             items_container_html_source, mock_project_object, 0
         )
         assert len(all_items) == 24
-        # Test case 4: Return empty list when no items are found in the container and mock send_email
-        with patch("main.send_email") as send_email_mock:
+        # Test case 4: Return empty list when no items are found in the container,
+        # the notifier is mocked
+        with patch("main.notifier") as notifier_mock:
             all_items = get_all_items_to_check(
                 items_container_html_source, mock_project_object, 0
             )
         assert len(all_items) == 0
-        assert send_email_mock.called
+        assert notifier_mock.notify.called
 
     def test_get_all_items_to_check_single_page(
         self, single_page_html_source, mock_project_object_single_page
@@ -58,13 +124,12 @@ class TestGetAllItemsToCheck:
         assert len(all_items) == 1
 
 
-class TestGetUrlResponse(unittest.TestCase):
-    """Test cases for get_url_response function."""
+class TestGetUrlResponses(unittest.TestCase):
+    """Test cases for get_url_responses function."""
 
     def setUp(self):
         """Set up test case."""
         self.request_mock = MagicMock()
-        self.request_delay = 1
         self.module_with_paginator = {
             "paginator_pattern": "https://example.com?page=$page",
             "paginator_count": 3,
@@ -76,31 +141,214 @@ class TestGetUrlResponse(unittest.TestCase):
             "single_url": "https://example.com",
         }
 
-    def test_get_url_response_with_paginator(self):
-        """Test get_url_response function with paginator."""
+    def test_get_module_urls(self):
+        """Test get_module_urls function."""
+        self.assertEqual(
+            list(get_module_urls(self.module_with_paginator)),
+            [
+                "https://example.com?page=1",
+                "https://example.com?page=2",
+                "https://example.com?page=3",
+            ],
+        )
+        self.assertEqual(
+            list(get_module_urls(self.module_without_paginator)),
+            ["https://example.com"],
+        )
+
+    def test_get_url_responses_with_paginator(self):
+        """Test get_url_responses function stops on the first failed page."""
         self.request_mock.read_url.side_effect = [
             MagicMock(status_code=200),
             MagicMock(status_code=404),
             MagicMock(status_code=200),
         ]
-        expected_response = MagicMock(status_code=404)
-        actual_response = get_url_response(
-            module=self.module_with_paginator,
-            request=self.request_mock,
-            request_delay=self.request_delay,
+        responses = list(
+            get_url_responses(
+                module=self.module_with_paginator, request=self.request_mock
+            )
+        )
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(self.request_mock.read_url.call_count, 2)
+
+    def test_get_url_responses_empty_page(self):
+        """Test get_url_responses function stops on an empty page."""
+        self.request_mock.read_url.side_effect = [
+            MagicMock(status_code=200),
+            MagicMock(status_code=200, content=b"  "),
+            MagicMock(status_code=200),
+        ]
+        responses = list(
+            get_url_responses(
+                module=self.module_with_paginator, request=self.request_mock
+            )
+        )
+        self.assertEqual(len(responses), 1)
+
+    def test_get_url_responses_next_link(self):
+        """Test get_url_responses function stops after a page without next link."""
+        module = {
+            "paginator_pattern": "https://example.com?page=$page",
+            "paginator_next": {"tag": "a", "class": "next"},
+        }
+        self.request_mock.read_url.side_effect = [
+            MagicMock(status_code=200, content=b'<a class="next" href="?page=2">'),
+            MagicMock(status_code=200, content=b"<div>last page</div>"),
+            MagicMock(status_code=200, content=b"<div>not a page</div>"),
+        ]
+        responses = list(get_url_responses(module=module, request=self.request_mock))
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(self.request_mock.read_url.call_count, 2)
+
+    def test_get_url_responses_with_cache(self):
+        """Test get_url_responses function skips pages not modified since last run."""
+        cache = MagicMock()
+        cache.get_headers.return_value = {"If-None-Match": '"abc"'}
+        cache.is_unchanged.side_effect = [True, False, False]
+        cache.has_next.return_value = True
+        self.request_mock.read_url.side_effect = [
+            MagicMock(status_code=304),
+            MagicMock(status_code=200),
+            MagicMock(status_code=200),
+        ]
+        responses = list(
+            get_url_responses(
+                module=self.module_with_paginator,
+                request=self.request_mock,
+                cache=cache,
+            )
+        )
+        self.assertEqual(len(responses), 2)
+        self.request_mock.read_url.assert_any_call(
+            url="https://example.com?page=1", headers={"If-None-Match": '"abc"'}
+        )
+        self.assertEqual(cache.set_has_next.call_count, 2)
+
+    def test_get_url_responses_scan(self):
+        """Test get_url_responses function finishes the scan only on the real end."""
+        self.request_mock.read_url.return_value = MagicMock(status_code=200)
+        scan = ModuleScan({})
+        responses = list(
+            get_url_responses(
+                module=self.module_with_paginator,
+                request=self.request_mock,
+                scan=scan,
+            )
+        )
+        for _ in responses:
+            scan.page_parsed(["sku"])
+        self.assertTrue(scan.complete)
+        self.assertEqual(len(scan.pages), 3)
+
+        self.request_mock.read_url.side_effect = [
+            MagicMock(status_code=200),
+            MagicMock(status_code=500),
+        ]
+        scan = ModuleScan({})
+        for _ in get_url_responses(
+            module=self.module_with_paginator, request=self.request_mock, scan=scan
+        ):
+            scan.page_parsed(["sku"])
+        self.assertFalse(scan.complete)
+
+    def test_get_url_responses_scan_unknown_page(self):
+        """Test a not modified page with unknown skus is parsed anyway."""
+        cache = MagicMock()
+        cache.is_unchanged.return_value = True
+        self.request_mock.read_url.return_value = MagicMock(status_code=200)
+        scan = ModuleScan({"https://example.com": ["sku"]})
+        responses = list(
+            get_url_responses(
+                module=self.module_without_paginator,
+                request=self.request_mock,
+                cache=cache,
+                scan=scan,
+            )
+        )
+        self.assertEqual(responses, [])
+        self.assertTrue(scan.complete)
+
+        scan = ModuleScan({})
+        responses = list(
+            get_url_responses(
+                module=self.module_without_paginator,
+                request=self.request_mock,
+                cache=cache,
+                scan=scan,
+            )
+        )
+        self.assertEqual(len(responses), 1)
+
+    def test_get_url_responses_scan_unknown_not_modified_page(self):
+        """Test a not modified page with unknown skus ends the module as before."""
+        cache = MagicMock()
+        cache.is_unchanged.return_value = True
+        cache.has_next.return_value = False
+        self.request_mock.read_url.return_value = MagicMock(status_code=304)
+        scan = ModuleScan({})
+        responses = list(
+            get_url_responses(
+                module=self.module_with_paginator,
+                request=self.request_mock,
+                cache=cache,
+                scan=scan,
+            )
         )
-        self.assertEqual(actual_response.status_code, expected_response.status_code)
+        self.assertEqual(responses, [])
+        self.assertEqual(self.request_mock.read_url.call_count, 1)
+        # the page is loaded in full next time
+        cache.forget.assert_called_once_with("https://example.com?page=1")
+        self.assertFalse(scan.complete)
+
+    def test_has_next_page(self):
+        """Test has_next_page function."""
+        module = {"paginator_next": {"tag": "a", "class": "next"}}
+        self.assertTrue(has_next_page('<a class="next" href="/p2">2</a>', module))
+        self.assertFalse(has_next_page('<a class="prev" href="/p1">1</a>', module))
+        self.assertTrue(has_next_page("", self.module_with_paginator))
+        # the page is streamed, the tree of the whole page is not built
+        source = b"<div>" + b"<p>item</p>" * 5000 + b'</div><a class="next">2</a>'
+        with patch("extraction.document_fromstring") as document_fromstring_mock:
+            self.assertTrue(has_next_page(source, module, "utf-8"))
+            self.assertFalse(has_next_page(b"", module))
+        document_fromstring_mock.assert_not_called()
 
-    def test_get_url_response_without_paginator(self):
-        """Test get_url_response function without paginator."""
+    def test_get_url_responses_without_paginator(self):
+        """Test get_url_responses function without paginator."""
         self.request_mock.read_url.return_value = MagicMock(status_code=200)
-        expected_response = MagicMock(status_code=200)
-        actual_response = get_url_response(
-            module=self.module_without_paginator,
-            request=self.request_mock,
-            request_delay=self.request_delay,
+        responses = list(
+            get_url_responses(
+                module=self.module_without_paginator, request=self.request_mock
+            )
+        )
+        self.assertEqual(len(responses), 1)
+        self.request_mock.read_url.assert_called_once_with(
+            url="https://example.com", headers=None
+        )
+
+    def test_get_url_responses_with_executor(self):
+        """Test get_url_responses function loads pages in a thread pool."""
+        self.request_mock.limiter.max_concurrency = 2
+        self.request_mock.read_url.side_effect = lambda url, headers: MagicMock(
+            status_code=200, url=url
+        )
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            responses = list(
+                get_url_responses(
+                    module=self.module_with_paginator,
+                    request=self.request_mock,
+                    executor=executor,
+                )
+            )
+        # responses are yielded in page order
+        self.assertEqual(
+            [response.url for _, response in responses],
+            list(get_module_urls(self.module_with_paginator)),
+        )
+        self.assertEqual(
+            [url for url, _ in responses],
+            list(get_module_urls(self.module_with_paginator)),
         )
-        self.assertEqual(actual_response.status_code, expected_response.status_code)
 
 
 class TestCheckChanges(unittest.TestCase):
@@ -109,9 +357,9 @@ class TestCheckChanges(unittest.TestCase):
         self.project_settings = MagicMock()
         self.module_index = 0
         self.items_list_instance = MagicMock()
-        self.items_list_instance.read_json_file.return_value = {
-            "val1": {"sku": "val1"},
-            "val2": {"sku": "val2"},
+        self.items_list_instance.read_fingerprints.return_value = {
+            "val1": item_fingerprint({"sku": "val1"}),
+            "val2": item_fingerprint({"sku": "val2"}),
         }
 
     def test_check_changes_no_changes(self):
@@ -122,8 +370,9 @@ class TestCheckChanges(unittest.TestCase):
             return_value=("val1", {"val1": {"sku": "val1"}})
         )
 
-        with patch("main.get_all_items_to_check", get_all_items_to_check_mock), patch(
-            "main.scrap_single_item", scrap_single_item_mock
+        with (
+            patch("main.get_all_items_to_check", get_all_items_to_check_mock),
+            patch("main.scrap_single_item", scrap_single_item_mock),
         ):
             result = check_changes(
                 self.source,
@@ -133,22 +382,19 @@ class TestCheckChanges(unittest.TestCase):
             )
 
         self.assertEqual(len(result), 0)
-        self.items_list_instance.read_json_file.assert_called_once()
+        self.items_list_instance.read_fingerprints.assert_called_once()
 
     def test_check_changes_with_changes(self):
         """Test check_changes function with changes."""
-        self.items_list_instance.read_json_file.return_value = {
-            "val1": {"sku": "val1"},
-            "val2": {"sku": "val2"},
-        }
         items_to_check = ["item1", "item2"]
         get_all_items_to_check_mock = MagicMock(return_value=items_to_check)
         scrap_single_item_mock = MagicMock(
             return_value=("val1", {"val1": {"sku": "new_value"}})
         )
 
-        with patch("main.get_all_items_to_check", get_all_items_to_check_mock), patch(
-            "main.scrap_single_item", scrap_single_item_mock
+        with (
+            patch("main.get_all_items_to_check", get_all_items_to_check_mock),
+            patch("main.scrap_single_item", scrap_single_item_mock),
         ):
             result = check_changes(
                 self.source,
@@ -158,7 +404,7 @@ class TestCheckChanges(unittest.TestCase):
             )
         self.assertEqual(len(result), 1)
         self.assertDictEqual(result[0], {"sku": "new_value"})
-        self.items_list_instance.read_json_file.assert_called_once()
+        self.items_list_instance.read_fingerprints.assert_called_once()
 
     def test_check_changes_new_product(self):
         """Test check_changes function with new product."""
@@ -168,8 +414,9 @@ class TestCheckChanges(unittest.TestCase):
             return_value=("sku3", {"sku3": {"sku": "sku3"}})
         )
 
-        with patch("main.get_all_items_to_check", get_all_items_to_check_mock), patch(
-            "main.scrap_single_item", scrap_single_item_mock
+        with (
+            patch("main.get_all_items_to_check", get_all_items_to_check_mock),
+            patch("main.scrap_single_item", scrap_single_item_mock),
         ):
             result = check_changes(
                 self.source,
@@ -179,7 +426,181 @@ class TestCheckChanges(unittest.TestCase):
             )
         self.assertEqual(len(result), 1)
         self.assertDictEqual(result[0], {"sku": "sku3"})
-        self.items_list_instance.read_json_file.assert_called_once()
-        self.items_list_instance.append_to_json_file.assert_called_once_with(
+        self.items_list_instance.read_fingerprints.assert_called_once()
+        self.items_list_instance.stage_items.assert_called_once_with(
             data={"sku3": {"sku": "sku3"}}
         )
+        self.items_list_instance.append_to_json_file.assert_not_called()
+
+    def test_check_changes_with_fingerprints(self):
+        """Test check_changes function reuses passed fingerprints."""
+        fingerprints = {"val1": item_fingerprint({"sku": "val1"})}
+        get_all_items_to_check_mock = MagicMock(return_value=["item1"])
+        scrap_single_item_mock = MagicMock(
+            return_value=("sku3", {"sku3": {"sku": "sku3"}})
+        )
+
+        with (
+            patch("main.get_all_items_to_check", get_all_items_to_check_mock),
+            patch("main.scrap_single_item", scrap_single_item_mock),
+        ):
+            result = check_changes(
+                self.source,
+                self.items_list_instance,
+                self.project_settings,
+                self.module_index,
+                fingerprints=fingerprints,
+            )
+        self.assertEqual(len(result), 1)
+        self.assertEqual(fingerprints["sku3"], item_fingerprint({"sku": "sku3"}))
+        self.items_list_instance.read_fingerprints.assert_not_called()
+
+
+class TestApplyChanges(unittest.TestCase):
+    """Test cases for apply_changes function."""
+
+    def test_apply_changes(self):
+        """Test new and changed items are staged and fingerprints are updated."""
+        storage = MagicMock()
+        fingerprints = {
+            "val1": item_fingerprint({"sku": "val1", "price": "1"}),
+            "val2": item_fingerprint({"sku": "val2"}),
+        }
+        scraped_items = [
+            ("val1", {"val1": {"sku": "val1", "price": "2"}}),
+            ("val2", {"val2": {"sku": "val2"}}),
+            ("val3", {"val3": {"sku": "val3"}}),
+        ]
+        result = apply_changes(scraped_items, storage, fingerprints)
+
+        self.assertEqual(result, [{"sku": "val1", "price": "2"}, {"sku": "val3"}])
+        self.assertEqual(storage.stage_items.call_count, 2)
+        self.assertEqual(
+            fingerprints["val1"], item_fingerprint({"price": "2", "sku": "val1"})
+        )
+        self.assertIn("val3", fingerprints)
+
+
+def test_get_project_schedule():
+    assert (
+        get_project_schedule({"cron": "0 */6 * * *"}, "10:00").key == "cron:0 */6 * * *"
+    )
+    assert (
+        get_project_schedule({"interval_minutes": 30}, "10:00").key == "interval:1800"
+    )
+    assert get_project_schedule(None, "10:00").key == "cron:0 10 * * *"
+
+
+def test_get_storage_class():
+    with patch.multiple(
+        "main", USE_SQLITE_STORAGE=True, USE_AWS_S3_STORAGE=False, STREAM_ITEMS=False
+    ):
+        assert get_storage_class().__name__ == "SqliteItemsStorage"
+        # validators and pages are not stored as items
+        assert get_file_storage_class() is JsonItemsLocalStorage
+    with patch.multiple(
+        "main", USE_SQLITE_STORAGE=False, USE_AWS_S3_STORAGE=False, STREAM_ITEMS=False
+    ):
+        assert get_storage_class() is JsonItemsLocalStorage
+
+
+def test_stream_items_with_s3_is_refused():
+    with patch.multiple("main", STREAM_ITEMS=True, USE_AWS_S3_STORAGE=True):
+        with pytest.raises(ValueError):
+            check_storage_settings()
+        with pytest.raises(ValueError):
+            get_storage_class()
+
+
+@pytest.mark.parametrize("unfinished", [True, False])
+def test_schedule_task_resumes_unfinished_projects(tmp_path, unfinished):
+    path = str(tmp_path / "run_journal.json")
+    journal = RunJournal(path)
+    journal.start()
+    journal.project_started("b.json")
+    journal.project_done("b.json")
+    if unfinished:
+        # the process died while the project was running
+        journal.project_started("a.json")
+    scheduler_mock = MagicMock()
+    notifier_mock = MagicMock()
+
+    @contextmanager
+    def create_workers_mock(*args):
+        yield MagicMock(), None, None
+
+    with (
+        patch.multiple(
+            "main",
+            JOURNAL_FILE=path,
+            RUN_AT_START=False,
+            ProjectScheduler=MagicMock(return_value=scheduler_mock),
+            create_workers=create_workers_mock,
+            get_all_schedules=MagicMock(return_value={}),
+            notifier=notifier_mock,
+        ),
+        patch("notification_queue.NOTIFICATION_QUEUE_FILE", ""),
+    ):
+        schedule_task("10:00")
+    if unfinished:
+        scheduler_mock.run_all_now.assert_called_once_with(["a.json"])
+        notifier_mock.send.assert_not_called()
+    else:
+        # notifications of the interrupted run are sent at once
+        scheduler_mock.run_all_now.assert_not_called()
+        notifier_mock.send.assert_called_once()
+
+
+@pytest.mark.parametrize("parse_workers", [0, 1])
+def test_check_project_stops_on_page_without_items(
+    items_container_html_source, json_project_settings, parse_workers
+):
+    module = {
+        **json_project_settings["modules"][0],
+        "paginator_pattern": "https://example.com?page=$page",
+        "paginator_count": None,
+    }
+    project = MagicMock(project_name="test", modules=[module])
+    project.get_extraction_plan.return_value = ExtractionPlan(module)
+    pages = {
+        "https://example.com?page=1": items_container_html_source.encode(),
+        "https://example.com?page=2": b"<html><body>Nothing found</body></html>",
+    }
+
+    def read_url(url, headers):
+        content = pages.get(url, items_container_html_source.encode())
+        return MagicMock(status_code=200, content=content, headers={})
+
+    request = MagicMock(read_url=MagicMock(side_effect=read_url))
+    storage = MagicMock()
+    storage.read_fingerprints.return_value = {}
+    storage.read_changes.return_value = {}
+    storage_class = MagicMock(return_value=storage)
+    with ExitStack() as stack:
+        parse_executor = None
+        if parse_workers:
+            parse_executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers=parse_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            )
+        notifier_mock = stack.enter_context(patch("main.notifier"))
+        stack.enter_context(
+            patch.multiple(
+                "main",
+                USE_HTTP_CACHE=False,
+                DETECT_REMOVED_ITEMS=False,
+                STREAM_ITEMS=False,
+                get_storage_class=MagicMock(return_value=storage_class),
+                get_file_storage_class=MagicMock(),
+            )
+        )
+        stack.enter_context(patch("main.project_configs.get", return_value=project))
+        check_project("test.json", request, parse_executor=parse_executor)
+
+    subjects = [call.kwargs["subject"] for call in notifier_mock.notify.call_args_list]
+    # the empty page past the end is not reported, items of the first page are
+    assert subjects == ["Changes detected in test"]
+    if not parse_workers:
+        assert request.read_url.call_count == 2
@@ -0,0 +1,125 @@
+"""Test metrics module."""
+
+import json
+import threading
+
+import pytest
+
+from metrics import (
+    Metrics,
+    current_labels,
+    hosts_summary,
+    metric_labels,
+    read_peak_rss_kb,
+    track_peak_rss,
+    write_run_summary,
+)
+
+
+def test_timer_records_labels_and_errors():
+    metrics = Metrics()
+    with metric_labels(project="project.json"):
+        with metric_labels(module=0):
+            assert current_labels() == {"project": "project.json", "module": 0}
+            with metrics.timer("fetch") as sample:
+                sample["nbytes"] = 100
+            with pytest.raises(ValueError):
+                with metrics.timer("fetch"):
+                    raise ValueError
+    values = metrics.snapshot("project.json")[("fetch", "project.json", "0")]
+    assert values["calls"] == 2
+    assert values["errors"] == 1
+    assert values["bytes"] == 100
+    assert values["seconds"] > 0
+    assert current_labels() == {}
+
+
+def test_labels_are_passed_to_threads():
+    metrics = Metrics()
+    with metric_labels(project="project.json"):
+        labels = current_labels()
+
+    def worker():
+        with metric_labels(**labels):
+            metrics.record("fetch")
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert list(metrics.snapshot()) == [("fetch", "project.json", "")]
+
+
+def test_summary_and_prometheus(tmp_path):
+    metrics = Metrics()
+    with metric_labels(project="project.json"):
+        metrics.record("parse", seconds=0.5, items=10)
+        before = metrics.snapshot("project.json")
+        metrics.record("parse", seconds=0.25, items=5)
+        metrics.record("email")
+    stages = metrics.summary(before, metrics.snapshot("project.json"))
+    assert [(stage["stage"], stage["items"]) for stage in stages] == [
+        ("email", 0),
+        ("parse", 5),
+    ]
+
+    text = metrics.to_prometheus()
+    assert "# TYPE monitor_stage_seconds_total counter" in text
+    assert (
+        'monitor_stage_items_total{stage="parse",project="project.json",module=""} 15'
+        in text
+    )
+
+    path = tmp_path / "summary_project.json"
+    hosts = {"example.com": {"requests": 2, "bytes": 10}}
+    write_run_summary(path, "project.json", 0, stages, peak_rss_kb=1024, hosts=hosts)
+    summary = json.loads(path.read_text(encoding="utf-8"))
+    assert summary["stages"] == stages
+    assert summary["peak_rss_kb"] == 1024
+    assert summary["hosts"] == hosts
+
+
+def test_hosts_summary():
+    before = {"a.com": {"requests": 3, "bytes": 30, "errors": 0}}
+    after = {
+        "a.com": {"requests": 5, "bytes": 70, "errors": 1},
+        "b.com": {"requests": 1, "bytes": 5, "errors": 0},
+        "c.com": {"requests": 0, "bytes": 0, "errors": 0},
+    }
+    assert hosts_summary(before, after) == {
+        "a.com": {"requests": 2, "bytes": 40, "errors": 1},
+        "b.com": {"requests": 1, "bytes": 5, "errors": 0},
+    }
+    # a host without requests in the run is skipped
+    assert hosts_summary(after, after) == {}
+
+
+def test_concurrent_prometheus_writes(tmp_path):
+    metrics = Metrics()
+    metrics.record("parse", seconds=0.5, items=10)
+    path = tmp_path / "metrics.prom"
+    errors = []
+
+    def write():
+        try:
+            for _ in range(50):
+                metrics.write_prometheus(path)
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert path.read_text(encoding="utf-8") == metrics.to_prometheus()
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.prom"]
+
+
+def test_track_peak_rss():
+    with track_peak_rss() as memory:
+        data = bytearray(32 * 1024 * 1024)
+        data[-1] = 1
+        del data
+    assert memory["peak_rss_kb"] >= 32 * 1024
+    assert read_peak_rss_kb() > 0
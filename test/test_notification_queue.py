@@ -0,0 +1,96 @@
+"""Test the persistent notification queue and its worker."""
+
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import notification_queue
+from mail import build_message
+from notification_queue import NotificationQueue, NotificationWorker, backoff_seconds
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = NotificationQueue(str(tmp_path / "notifications.sqlite3"))
+    yield queue
+    queue.close()
+
+
+class FailingSession:
+    """Smtp session which fails to send every email."""
+
+    def __init__(self):
+        self.send = MagicMock(side_effect=OSError("connection refused"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def test_queue_survives_restart(tmp_path):
+    path = str(tmp_path / "notifications.sqlite3")
+    queue = NotificationQueue(path)
+    assert queue.put([build_message("First"), build_message("Second")]) == 2
+    queue.close()
+    queue = NotificationQueue(path)
+    due = queue.due()
+    assert [message["subject"] for _, message, _ in due] == ["First", "Second"]
+    queue.sent(due[0][0])
+    assert queue.counts() == {"pending": 1}
+    queue.close()
+
+
+def test_backoff_seconds():
+    with (
+        patch.object(notification_queue, "NOTIFICATION_BACKOFF", 30),
+        patch.object(notification_queue, "NOTIFICATION_MAX_BACKOFF", 100),
+    ):
+        assert [backoff_seconds(attempts) for attempts in (1, 2, 3, 4)] == [
+            30,
+            60,
+            100,
+            100,
+        ]
+
+
+def test_worker_retries_with_backoff(queue):
+    queue.put([build_message("First"), build_message("Second")])
+    session = FailingSession()
+    worker = NotificationWorker(queue, session_factory=lambda: session)
+    assert worker.send_due() == 0
+    # the server is unavailable, the second email is not tried
+    assert session.send.call_count == 1
+    assert queue.due() == []
+    assert queue.next_attempt_at() > time.time()
+    assert [attempts for _, _, attempts in queue.due(time.time() + 3600)] == [1, 1]
+
+
+def test_worker_fails_after_max_attempts(queue):
+    queue.put([build_message("First")])
+    worker = NotificationWorker(queue, session_factory=FailingSession)
+    with (
+        patch.object(notification_queue, "NOTIFICATION_MAX_ATTEMPTS", 2),
+        patch.object(notification_queue, "NOTIFICATION_BACKOFF", 0),
+        patch("notification_queue.logging") as logging_mock,
+    ):
+        worker.send_due()
+        worker.send_due()
+        assert worker.send_due() == 0
+    assert queue.counts() == {"failed": 1}
+    logging_mock.error.assert_called_once()
+
+
+def test_worker_sends_queued_emails(queue, smtp_server):
+    queue.put([build_message("Left from the last run")])
+    worker = NotificationWorker(queue)
+    worker.start()
+    worker.enqueue([build_message("First"), build_message("Second")])
+    assert worker.stop(timeout=10)
+    subjects = [
+        smtp_server.parsed(i)["subject"] for i in range(len(smtp_server.messages))
+    ]
+    assert subjects == ["Left from the last run", "First", "Second"]
+    assert queue.counts() == {}
@@ -0,0 +1,64 @@
+"""Test pipeline helpers."""
+
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import ordered_map
+
+
+class TestOrderedMap(unittest.TestCase):
+    """Test ordered_map function."""
+
+    def setUp(self):
+        """Set up test."""
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        """Tear down test."""
+        self.executor.shutdown()
+
+    def test_results_in_input_order(self):
+        """Test results are yielded in the input order, not in completion order."""
+
+        def slow_for_small(value):
+            time.sleep(0.01 * (3 - value))
+            return value * 10
+
+        result = list(
+            ordered_map(self.executor, slow_for_small, ((i,) for i in range(3)), 3)
+        )
+        self.assertEqual(result, [((0,), 0), ((1,), 10), ((2,), 20)])
+
+    def test_window_bounds_calls_in_flight(self):
+        """Test no more than window calls are submitted ahead of the consumer."""
+        submitted = []
+        lock = threading.Lock()
+
+        def record(value):
+            with lock:
+                submitted.append(value)
+            return value
+
+        results = ordered_map(self.executor, record, ((i,) for i in range(10)), 2)
+        next(results)
+        time.sleep(0.02)
+        self.assertLessEqual(len(submitted), 3)
+        results.close()
+
+    def test_close_cancels_pending_calls(self):
+        """Test calls that are not started are cancelled when iteration stops."""
+        started = []
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        def slow(value):
+            started.append(value)
+            time.sleep(0.02)
+            return value
+
+        results = ordered_map(executor, slow, ((i,) for i in range(10)), 4)
+        self.assertEqual(next(results), ((0,), 0))
+        results.close()
+        executor.shutdown()
+        self.assertLess(len(started), 4)
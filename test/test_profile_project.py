@@ -0,0 +1,85 @@
+"""Test profiling tools of a single project run."""
+
+import pstats
+import time
+from unittest.mock import patch
+
+import main
+from json_items_handlers import JsonItemsLocalStorage, SqliteItemsStorage
+from profile_project import StackSampler, parse_args, run_profilers, scratch_storage
+
+
+def busy_wait(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(100))
+
+
+def test_stack_sampler(tmp_path):
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    busy_wait(0.05)
+    sampler.stop()
+    path = tmp_path / "stacks.folded"
+    sampler.write_collapsed(path)
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert any("busy_wait" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert stack.startswith("MainThread;")
+
+
+def test_run_profilers(tmp_path):
+    args = parse_args(
+        [
+            "project.json",
+            "--cprofile",
+            str(tmp_path / "run.pstats"),
+            "--flamegraph",
+            str(tmp_path / "run.folded"),
+            "--tracemalloc",
+            "5",
+            "--top",
+            "1",
+        ]
+    )
+    with run_profilers(args) as report:
+        busy_wait(0.02)
+        data = [bytes(1000) for _ in range(100)]
+    assert data
+    stats = pstats.Stats(str(tmp_path / "run.pstats"))
+    assert any(func[2] == "busy_wait" for func in stats.stats)
+    assert (tmp_path / "run.folded").exists()
+    assert report["memory"]["peak_kb"] > 0
+    assert len(report["allocations"]) == 5
+
+
+def test_scratch_storage(tmp_path):
+    store_dir = tmp_path / "store"
+    with (
+        patch.object(JsonItemsLocalStorage, "_file_dir", str(store_dir)),
+        patch.object(SqliteItemsStorage, "_file_dir", str(store_dir)),
+        patch.multiple(main, USE_AWS_S3_STORAGE=False, STREAM_ITEMS=False),
+    ):
+        for use_sqlite in (False, True):
+            with patch.object(main, "USE_SQLITE_STORAGE", use_sqlite):
+                storage = main.get_storage_class()("output_p.json")
+                storage.save_to_json_file({"1": {"price": "1"}})
+                storage.close()
+                JsonItemsLocalStorage("cache_p.json").save_to_json_file({"url": {}})
+
+                with scratch_storage("p.json") as scratch:
+                    assert main.METRICS_DIR.startswith(str(scratch))
+                    assert main.notifier.send_messages([1]) == 1
+                    storage = main.get_storage_class()("output_p.json")
+                    assert storage.read_json_file() == {"1": {"price": "1"}}
+                    storage.save_to_json_file({"1": {"price": "2"}})
+                    storage.close()
+                    cache = JsonItemsLocalStorage("cache_p.json")
+                    assert cache.read_json_file() == {"url": {}}
+
+                # the stored files are not changed by the dry run
+                storage = main.get_storage_class()("output_p.json")
+                assert storage.read_json_file() == {"1": {"price": "1"}}
+                storage.close()
+                assert JsonItemsLocalStorage._file_dir == str(store_dir)
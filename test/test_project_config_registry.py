@@ -0,0 +1,56 @@
+"""Test ProjectConfigRegistry class."""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from main import ProjectConfigRegistry
+
+FIXTURE = Path(__file__).parent / "fixtures" / "project_settings.json"
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    # the schema is loaded relative to the project root
+    monkeypatch.chdir(Path(__file__).parent.parent)
+    shutil.copy(FIXTURE, tmp_path / "project.json")
+    return ProjectConfigRegistry(file_dir=str(tmp_path))
+
+
+def test_config_is_cached(registry):
+    config = registry.get("project.json")
+    assert config.project_name == "arttidesign"
+    with patch("main.get_schema_validator") as validator_mock:
+        assert registry.get("project.json") is config
+        assert registry.refresh() == {"project.json": config}
+    validator_mock.assert_not_called()
+
+
+def test_touched_file_with_same_content_is_not_parsed(registry, tmp_path):
+    config = registry.get("project.json")
+    os.utime(tmp_path / "project.json", ns=(0, 0))
+    assert registry.get("project.json") is config
+
+
+def test_changed_config_is_reloaded(registry, tmp_path):
+    config = registry.get("project.json")
+    data = json.loads(FIXTURE.read_text(encoding="utf-8"))
+    data["project_name"] = "renamed"
+    (tmp_path / "project.json").write_text(json.dumps(data), encoding="utf-8")
+    assert registry.get("project.json").project_name == "renamed"
+    assert registry.get("project.json") is not config
+
+
+def test_invalid_config(registry, tmp_path):
+    (tmp_path / "invalid.json").write_text('{"project_name": "x"}', encoding="utf-8")
+    with patch("main.logging") as logging_mock:
+        assert list(registry.refresh()) == ["project.json"]
+        registry.refresh()
+    # logged once until the file changes
+    assert logging_mock.error.call_count == 1
+    with pytest.raises(Exception):
+        registry.get("invalid.json")
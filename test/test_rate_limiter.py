@@ -0,0 +1,56 @@
+"""Test HostRateLimiter class."""
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from rate_limiter import HostRateLimiter
+
+
+class TestHostRateLimiter(unittest.TestCase):
+    """Test HostRateLimiter class."""
+
+    def test_min_interval(self):
+        """Test requests per second are converted to a minimal interval."""
+        self.assertEqual(HostRateLimiter(requests_per_second=4).min_interval, 0.25)
+        self.assertEqual(HostRateLimiter(requests_per_second=0).min_interval, 0)
+
+    @patch("rate_limiter.time.sleep")
+    def test_limit_spaces_requests_to_same_host(self, mock_sleep):
+        """Test the second request to the same host waits for its slot."""
+        limiter = HostRateLimiter(max_concurrency=2, requests_per_second=1)
+        with limiter.limit("example.com"):
+            pass
+        mock_sleep.assert_not_called()
+        with limiter.limit("example.com"):
+            pass
+        mock_sleep.assert_called_once()
+        self.assertAlmostEqual(mock_sleep.call_args[0][0], 1, places=1)
+        # other hosts are not affected
+        with limiter.limit("example.org"):
+            pass
+        mock_sleep.assert_called_once()
+
+    def test_limit_concurrency(self):
+        """Test no more than max_concurrency requests run at once for a host."""
+        limiter = HostRateLimiter(max_concurrency=2)
+        active, max_active = 0, 0
+        lock = threading.Lock()
+
+        def worker():
+            nonlocal active, max_active
+            with limiter.limit("example.com"):
+                with lock:
+                    active += 1
+                    max_active = max(max_active, active)
+                time.sleep(0.02)
+                with lock:
+                    active -= 1
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max_active, 2)
@@ -0,0 +1,58 @@
+"""Test ModuleScan class."""
+
+import unittest
+
+from removals import ModuleScan, module_key
+
+
+class TestModuleScan(unittest.TestCase):
+    """Test ModuleScan class."""
+
+    def setUp(self):
+        """Set up test."""
+        self.previous_pages = {"page1": ["sku1", "sku2"], "page2": ["sku3"]}
+        self.scan = ModuleScan(self.previous_pages)
+
+    def test_module_key(self):
+        """Test module_key function."""
+        self.assertEqual(module_key({"paginator_pattern": "p$page"}), "p$page")
+        self.assertEqual(module_key({"single_url": "url"}), "url")
+
+    def test_removed_skus(self):
+        """Test skus not found on a complete scan are removed."""
+        self.scan.page_loaded("page1")
+        self.scan.page_unchanged("page2")
+        self.scan.page_parsed(["sku1"])
+        self.scan.finish()
+        self.assertTrue(self.scan.complete)
+        self.assertEqual(self.scan.removed_skus(), {"sku2"})
+        self.assertEqual(
+            self.scan.pages_to_save(), {"page1": ["sku1"], "page2": ["sku3"]}
+        )
+
+    def test_unfinished_scan(self):
+        """Test nothing is removed if the end of pages is not reached."""
+        self.scan.page_loaded("page1")
+        self.scan.page_parsed(["sku1"])
+        self.assertFalse(self.scan.complete)
+        self.assertEqual(self.scan.removed_skus(), set())
+        self.assertEqual(
+            self.scan.pages_to_save(), {"page1": ["sku1"], "page2": ["sku3"]}
+        )
+
+    def test_empty_page(self):
+        """Test a page without items makes the scan incomplete."""
+        self.scan.page_loaded("page1")
+        self.scan.page_loaded("page2")
+        self.scan.page_parsed(["sku1", "sku2"])
+        self.scan.page_parsed([])
+        self.scan.finish()
+        self.assertFalse(self.scan.complete)
+        self.assertEqual(self.scan.removed_skus(), set())
+        self.assertEqual(self.scan.pages_to_save(), self.previous_pages)
+
+    def test_unchanged_page_without_skus(self):
+        """Test a not modified page unknown on the last run makes the scan incomplete."""
+        self.scan.page_unchanged("page3")
+        self.scan.finish()
+        self.assertFalse(self.scan.complete)
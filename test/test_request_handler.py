@@ -1,38 +1,101 @@
 """Test cases for RequestHandler class and methods."""
 
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch
 
 from main import RequestHandler
 
 
+class StubHandler(BaseHTTPRequestHandler):
+    """Local http server handler, fails the first request to /flaky with 503."""
+
+    protocol_version = "HTTP/1.1"
+    flaky_calls = 0
+
+    def do_GET(self):
+        if self.path == "/flaky" and StubHandler.flaky_calls == 0:
+            StubHandler.flaky_calls += 1
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = b"<html><body>Hello World!</body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
 class TestRequestHandler(unittest.TestCase):
     """Test cases for RequestHandler class."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Start local http server."""
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop local http server."""
+        cls.server.shutdown()
+        cls.server.server_close()
+
     def setUp(self):
         """Setup method."""
-        self.handler = RequestHandler()
+        self.handler = RequestHandler(backoff_factor=0)
         self.mock_response = MagicMock()
 
     def tearDown(self):
         """Tear down method."""
-        pass
+        self.handler.close()
 
-    @patch("main.requests.get")
-    @patch("main.time.sleep")
-    def test_read_url(self, mock_sleep, mock_requests_get):
+    @patch("main.requests.Session.get")
+    def test_read_url(self, mock_session_get):
         """Test read_url method."""
         url = "https://example.com"
-        delay = 1
         response_text = "<html><body>Hello World!</body></html>"
 
         self.mock_response.text = response_text
-        mock_requests_get.return_value = self.mock_response
+        self.mock_response.raw.retries = None
+        self.mock_response.raw.tell.return_value = 10
+        mock_session_get.return_value = self.mock_response
+
+        response = self.handler.read_url(url)
+
+        mock_session_get.assert_called_once()
+        self.assertEqual(mock_session_get.call_args.kwargs["timeout"], (5, 30))
+        self.assertEqual(response.text, response_text)
+        self.assertEqual(self.handler.get_stats()["example.com"]["bytes"], 10)
+
+    def test_read_url_reuses_connection(self):
+        """Test requests to the same host share one keep-alive connection."""
+        for _ in range(3):
+            response = self.handler.read_url(self.base_url + "/")
+            self.assertEqual(response.status_code, 200)
+
+        stats = self.handler.get_stats()[self.base_url.split("//")[1]]
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["handshakes_saved"], 2)
+        self.assertGreater(stats["bytes"], 0)
 
-        response = self.handler.read_url(url, delay)
+    def test_read_url_retries(self):
+        """Test 503 response is retried and counted in stats."""
+        StubHandler.flaky_calls = 0
+        response = self.handler.read_url(self.base_url + "/flaky")
 
-        mock_sleep.assert_called_once_with(delay)
-        self.assertEquals(response.text, response_text)
+        self.assertEqual(response.status_code, 200)
+        stats = self.handler.get_stats()[self.base_url.split("//")[1]]
+        self.assertEqual(stats["retries"], 1)
 
     def test_set_headers(self):
         """Test set_headers method."""
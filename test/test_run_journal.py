@@ -0,0 +1,148 @@
+"""Test resuming of a run from its journal."""
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from mail import Notifier
+from run_journal import RunJournal, merge_changes, merge_notifications
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "run_journal.json")
+
+
+def test_resume_interrupted_run(journal_path):
+    journal = RunJournal(journal_path)
+    assert not journal.start()
+    journal.module_done("a.json", "module", {"removed": [], "seen": ["1"], "pages": 2})
+    journal.project_done("b.json")
+    # the process dies here, the next run resumes
+    journal = RunJournal(journal_path)
+    assert journal.start()
+    assert journal.is_project_done("b.json")
+    assert not journal.is_project_done("a.json")
+    assert journal.completed_modules("a.json") == {
+        "module": {"removed": [], "seen": ["1"], "pages": 2}
+    }
+    journal.finish()
+    assert not RunJournal(journal_path).start()
+
+
+def test_unfinished_projects(journal_path):
+    journal = RunJournal(journal_path)
+    journal.start()
+    journal.project_started("a.json")
+    journal.module_done("a.json", "module", {"removed": [], "seen": [], "pages": None})
+    journal.project_started("b.json")
+    journal.project_done("b.json")
+    journal = RunJournal(journal_path)
+    assert journal.start()
+    assert journal.unfinished_projects() == ["a.json"]
+    # the next run of an unfinished project skips its checked modules
+    journal.project_started("a.json")
+    assert list(journal.completed_modules("a.json")) == ["module"]
+    # the next run of a checked project starts from the beginning
+    journal.project_started("b.json")
+    assert journal.unfinished_projects() == ["a.json", "b.json"]
+
+
+def test_expired_run_starts_over(journal_path):
+    journal = RunJournal(journal_path)
+    journal.start()
+    journal.project_done("a.json")
+    journal = RunJournal(journal_path, max_age=0)
+    assert not journal.start()
+    assert not journal.is_project_done("a.json")
+
+
+def test_notifications(journal_path):
+    journal = RunJournal(journal_path)
+    journal.start()
+    first = {"subject": "Changes detected in a", "project_name": "a", "data": {}}
+    second = {"subject": "No items in b found", "project_name": "b", "data": None}
+    journal.add_notification(first)
+    journal.add_notification(second)
+    updated = dict(first, data={"1": {"old": None, "new": {}}})
+    journal.add_notification(updated)
+    assert journal.notifications() == [second, updated]
+    journal.clear_notifications([second])
+    assert journal.notifications() == [updated]
+
+
+def test_notifications_of_two_runs_are_merged(journal_path):
+    journal = RunJournal(journal_path)
+    journal.start()
+    subject = "Changes detected in a"
+    journal.add_notification(
+        {
+            "subject": subject,
+            "project_name": "a",
+            "data": {"1": {"old": None, "new": 1}},
+        }
+    )
+    journal.add_notification(
+        {"subject": subject, "project_name": "a", "data": {"2": {"old": 2, "new": 3}}}
+    )
+    (notification,) = journal.notifications()
+    assert notification["data"] == {
+        "1": {"old": None, "new": 1},
+        "2": {"old": 2, "new": 3},
+    }
+
+
+def test_merge_notifications():
+    first = {"subject": "Changes detected in a", "project_name": "a", "data": None}
+    second = {"subject": "No items in b found", "project_name": "b", "data": None}
+    changes = {"1": {"old": None, "new": {"price": 1}}}
+    with_changes = dict(first, data=changes)
+    more_changes = dict(first, data={"1": {"old": {"price": 1}, "new": {"price": 2}}})
+    assert merge_notifications([first, second], [with_changes]) == [
+        second,
+        with_changes,
+    ]
+    assert merge_notifications([with_changes], [more_changes]) == [
+        dict(first, data={"1": {"old": None, "new": {"price": 2}}})
+    ]
+    # a notification without data keeps the collected changes
+    assert merge_notifications([with_changes], [first]) == [with_changes]
+
+
+def test_merge_changes():
+    previous = {"1": {"old": None, "new": {"price": 1}}, "2": {"old": {}, "new": None}}
+    changes = {
+        "1": {"old": {"price": 1}, "new": {"price": 2}},
+        "3": {"old": None, "new": {}},
+    }
+    assert merge_changes(previous, changes) == {
+        "1": {"old": None, "new": {"price": 2}},
+        "2": {"old": {}, "new": None},
+        "3": {"old": None, "new": {}},
+    }
+
+
+def test_notifier_restores_notifications(journal_path):
+    journal = RunJournal(journal_path)
+    journal.start()
+    send_messages_mock = MagicMock(return_value=0)
+    notifier = Notifier(digest=False, send_messages=send_messages_mock)
+    notifier.journal = journal
+    with notifier.run():
+        notifier.notify("Changes detected in a", "a")
+    # sending failed, the notification is left in the journal
+    assert [n["subject"] for n in journal.notifications()] == ["Changes detected in a"]
+    journal = RunJournal(journal_path)
+    assert journal.start()
+    notifier = Notifier(digest=False, send_messages=MagicMock(return_value=2))
+    notifier.journal = journal
+    notifier.extend(journal.notifications())
+    with notifier.run():
+        notifier.notify("Changes detected in a", "a", json_data={"1": {}})
+        notifier.notify("Changes detected in b", "b")
+    messages = notifier.send_messages.call_args.args[0]
+    assert [message["subject"] for message in messages] == [
+        "Changes detected in a",
+        "Changes detected in b",
+    ]
+    assert journal.notifications() == []
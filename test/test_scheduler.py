@@ -0,0 +1,152 @@
+"""Test scheduler module."""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+
+from scheduler import (
+    CronSchedule,
+    IntervalSchedule,
+    ProjectScheduler,
+    daily_schedule,
+    parse_cron_field,
+)
+
+
+def test_parse_cron_field():
+    assert parse_cron_field("*/15", 0, 59) == {0, 15, 30, 45}
+    assert parse_cron_field("1-3,5", 0, 6) == {1, 2, 3, 5}
+    assert parse_cron_field("10/20", 0, 59) == {10, 30, 50}
+    with pytest.raises(ValueError):
+        parse_cron_field("60", 0, 59)
+
+
+def test_cron_schedule():
+    moment = datetime(2026, 10, 18, 12, 30, 15)
+    assert CronSchedule("*/15 * * * *").next_after(moment) == datetime(
+        2026, 10, 18, 12, 45
+    )
+    assert CronSchedule("0 6 * * *").next_after(moment) == datetime(2026, 10, 19, 6, 0)
+    # 2026-10-18 is a sunday, the next monday is the 19th
+    assert CronSchedule("0 0 * * 1").next_after(moment) == datetime(2026, 10, 19)
+    assert CronSchedule("0 0 1 1 *").next_after(moment) == datetime(2027, 1, 1)
+    assert daily_schedule("10:05").next_after(moment) == datetime(2026, 10, 19, 10, 5)
+
+
+def test_interval_schedule():
+    moment = datetime(2026, 10, 18, 12, 30)
+    assert IntervalSchedule(90).next_after(moment) == datetime(2026, 10, 18, 12, 31, 30)
+
+
+def test_scheduler_skips_overlapping_runs():
+    release = threading.Event()
+    runs = []
+
+    def run_project(project):
+        runs.append(project)
+        release.wait(5)
+
+    scheduler = ProjectScheduler(run_project, max_workers=2)
+    scheduler.set_schedules(
+        {"slow.json": IntervalSchedule(3600), "fast.json": IntervalSchedule(3600)}
+    )
+    assert scheduler.run_due() == []
+    scheduler.run_all_now()
+    assert sorted(scheduler.run_due()) == ["fast.json", "slow.json"]
+    # due again while the first runs are still going
+    scheduler.run_all_now()
+    assert scheduler.run_due() == []
+    release.set()
+    scheduler.stop()
+    assert sorted(runs) == ["fast.json", "slow.json"]
+
+
+def test_scheduler_batches_projects_due_together():
+    events = []
+
+    @contextmanager
+    def batch_context():
+        events.append("enter")
+        yield
+        events.append("exit")
+
+    scheduler = ProjectScheduler(
+        events.append, max_workers=1, jitter=0.2, batch_context=batch_context
+    )
+    scheduler.set_schedules(
+        {f"project_{i}.json": IntervalSchedule(3600) for i in range(3)}
+    )
+    scheduler.run_all_now()
+    # projects are started at different times because of the jitter
+    deadline = time.time() + 2
+    while len(events) < 5 and time.time() < deadline:
+        scheduler.run_due()
+        time.sleep(0.01)
+    scheduler.stop()
+    assert events[0] == "enter"
+    assert events[-1] == "exit"
+    assert sorted(events[1:-1]) == [f"project_{i}.json" for i in range(3)]
+
+
+def test_scheduler_runs_see_variables_of_their_batch():
+    batch_name = contextvars.ContextVar("batch_name", default=None)
+    seen = {}
+    batches = iter(["first", "second"])
+
+    @contextmanager
+    def batch_context():
+        token = batch_name.set(next(batches))
+        yield
+        batch_name.reset(token)
+
+    def run_project(project):
+        seen[project] = batch_name.get()
+
+    scheduler = ProjectScheduler(run_project, batch_context=batch_context)
+    scheduler.set_schedules(
+        {"a.json": IntervalSchedule(3600), "b.json": IntervalSchedule(3600)}
+    )
+    scheduler.run_all_now(["a.json"])
+    scheduler.run_due()
+    deadline = time.time() + 2
+    while "a.json" not in seen and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.run_all_now(["b.json"])
+    scheduler.run_due()
+    scheduler.stop()
+    assert seen == {"a.json": "first", "b.json": "second"}
+    # the scheduler thread doesn't take the variables of the batches
+    assert batch_name.get() is None
+
+
+def test_scheduler_run_now_and_on_due():
+    due = []
+    scheduler = ProjectScheduler(lambda project: None, on_due=due.append)
+    scheduler.set_schedules(
+        {"a.json": IntervalSchedule(3600), "b.json": IntervalSchedule(3600)}
+    )
+    # projects without a schedule are skipped
+    scheduler.run_all_now(["a.json", "removed.json"])
+    assert scheduler.run_due() == ["a.json"]
+    scheduler.stop()
+    assert due == ["a.json"]
+
+
+def test_scheduler_sleeps_until_due():
+    runs = []
+    scheduler = ProjectScheduler(runs.append)
+    scheduler.set_schedules({"project.json": IntervalSchedule(0.2)})
+    assert scheduler.next_due() == pytest.approx(time.time() + 0.2, abs=0.1)
+    thread = threading.Thread(target=scheduler.run_forever)
+    thread.start()
+    time.sleep(0.5)
+    scheduler.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert 1 <= len(runs) <= 3
+    scheduler.set_schedules({})
+    assert scheduler.next_due() is None
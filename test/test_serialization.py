@@ -0,0 +1,54 @@
+"""Test serialization of items files."""
+
+import importlib.util
+import json
+
+import pytest
+
+from json_items_handlers import serialization
+
+DATA = {"1": {"name": "Радіатор", "price": "10 390"}}
+
+
+def test_compact_json():
+    raw = serialization.dumps(DATA)
+    assert b"\n" not in raw
+    assert json.loads(raw) == DATA
+
+
+def test_gzip_is_deterministic():
+    raw = serialization.dumps(DATA, "json-gzip")
+    assert raw.startswith(serialization.GZIP_MAGIC)
+    assert raw == serialization.dumps(DATA, "json-gzip")
+    assert serialization.loads(raw) == DATA
+
+
+def test_loads_indented_json():
+    raw = json.dumps(DATA, indent=2, ensure_ascii=False).encode("utf-8")
+    assert serialization.loads(raw) == DATA
+
+
+@pytest.mark.parametrize(
+    "file_format, module_name",
+    [("json-zstd", "zstandard"), ("msgpack", "msgpack")],
+)
+def test_optional_formats(file_format, module_name):
+    if importlib.util.find_spec(module_name) is None:
+        with pytest.raises(ImportError):
+            serialization.dumps(DATA, file_format)
+        return
+    assert serialization.loads(serialization.dumps(DATA, file_format)) == DATA
+
+
+def test_msgpack_list():
+    pytest.importorskip("msgpack")
+    # deltas files are lists, msgpack writes them as arrays of any length
+    for size in (1, 16, 70000):
+        deltas = [{"at": "2024-01-01T00:00:00", "changes": DATA}] * size
+        raw = serialization.dumps(deltas, "msgpack")
+        assert serialization.loads(raw) == deltas
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        serialization.dumps(DATA, "xml")
@@ -0,0 +1,83 @@
+"""Test splitting of projects between workers."""
+
+import time
+
+import pytest
+
+from sharding import LocalRecordStore, Shard, rendezvous_owner
+
+PROJECTS = [f"project_{i}.json" for i in range(300)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalRecordStore(str(tmp_path / "shards"))
+
+
+def make_shard(worker_id: str, store: LocalRecordStore, ttl: float = 60) -> Shard:
+    shard = Shard(worker_id, store, ttl=ttl, settle_seconds=0)
+    shard.join(delay=0)
+    return shard
+
+
+def test_rendezvous_owner():
+    workers = ["a", "b", "c"]
+    owners = {project: rendezvous_owner(project, workers) for project in PROJECTS}
+    counts = [list(owners.values()).count(worker) for worker in workers]
+    assert all(70 < count < 130 for count in counts)
+    # a new worker only takes projects from the others
+    new_owners = {
+        project: rendezvous_owner(project, workers + ["d"]) for project in PROJECTS
+    }
+    moved = [project for project in PROJECTS if owners[project] != new_owners[project]]
+    assert all(new_owners[project] == "d" for project in moved)
+    assert rendezvous_owner("project", []) is None
+
+
+def test_local_record_store(store):
+    assert store.read("workers/a.json") is None
+    assert store.list("workers") == []
+    store.write("workers/a.json", {"worker_id": "a"})
+    assert store.read("workers/a.json") == {"worker_id": "a"}
+    assert store.list("workers") == ["workers/a.json"]
+    store.delete("workers/a.json")
+    assert store.list("workers") == []
+
+
+def test_workers_split_projects(store):
+    first = make_shard("first", store)
+    second = make_shard("second", store)
+    assert first.live_workers() == ["first", "second"]
+    claimed_first = first.claim(PROJECTS)
+    claimed_second = second.claim(PROJECTS)
+    assert claimed_first and claimed_second
+    assert not set(claimed_first) & set(claimed_second)
+    assert sorted(claimed_first + claimed_second) == sorted(PROJECTS)
+    # own leases are taken again
+    assert first.claim(claimed_first) == claimed_first
+    first.leave()
+    second.leave()
+    assert store.list("workers") == []
+
+
+def test_lease_prevents_double_run(store):
+    first = make_shard("first", store)
+    # the first worker doesn't see the second one yet and claims all projects
+    assert first.claim(PROJECTS) == PROJECTS
+    second = make_shard("second", store)
+    assert second.owned(PROJECTS)
+    assert second.claim(PROJECTS) == []
+    first.leave()
+    second.leave()
+
+
+def test_projects_of_crashed_worker_move(store):
+    crashed = Shard("crashed", store, ttl=0.2, settle_seconds=0)
+    crashed._heartbeat()
+    assert crashed.claim(PROJECTS) == PROJECTS
+    second = make_shard("second", store)
+    assert second.live_workers() == ["crashed", "second"]
+    time.sleep(0.3)
+    assert second.live_workers() == ["second"]
+    assert second.claim(PROJECTS) == PROJECTS
+    second.leave()
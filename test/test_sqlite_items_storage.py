@@ -0,0 +1,123 @@
+"""Test SqliteItemsStorage class."""
+
+import gc
+import tempfile
+import unittest
+import weakref
+from pathlib import Path
+
+from json_items_handlers import SqliteItemsStorage, item_fingerprint
+
+
+class TestSqliteItemsStorage(unittest.TestCase):
+    """Test SqliteItemsStorage class."""
+
+    def setUp(self):
+        """Set up test."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        SqliteItemsStorage._file_dir = Path(self.temp_dir.name)
+        self.storage = SqliteItemsStorage("output_project.json")
+
+    def tearDown(self):
+        """Tear down test."""
+        self.storage.close()
+        self.temp_dir.cleanup()
+
+    def test_wal_mode(self):
+        """Test the database is in WAL mode."""
+        mode = self.storage.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_save_and_append(self):
+        """Test save_to_json_file and append_to_json_file methods."""
+        self.assertEqual(self.storage.read_json_file(), {})
+        self.storage.save_to_json_file({"1": {"name": "a"}})
+        self.storage.append_to_json_file({"2": {"name": "b"}})
+        self.assertEqual(
+            self.storage.read_json_file(), {"1": {"name": "a"}, "2": {"name": "b"}}
+        )
+        self.storage.save_to_json_file({"2": {"name": "c"}})
+        self.assertEqual(self.storage.read_json_file(), {"2": {"name": "c"}})
+
+    def test_projects_are_separated(self):
+        """Test items of different projects do not mix."""
+        other = SqliteItemsStorage("output_other.json")
+        self.storage.append_to_json_file({"1": {"name": "a"}})
+        other.append_to_json_file({"1": {"name": "b"}})
+        self.assertEqual(self.storage.read_json_file(), {"1": {"name": "a"}})
+        self.assertEqual(other.read_json_file(), {"1": {"name": "b"}})
+        other.close()
+
+    def test_flush_and_history(self):
+        """Test flush upserts staged items and records their history."""
+        self.assertFalse(self.storage.flush())
+        self.storage.stage_items({"1": {"price": "10"}})
+        self.assertTrue(self.storage.flush())
+        self.storage.stage_items({"1": {"price": "12"}})
+        self.storage.flush()
+        self.assertEqual(self.storage.pending_count, 0)
+        self.assertEqual(
+            self.storage.read_fingerprints(), {"1": item_fingerprint({"price": "12"})}
+        )
+        history = self.storage.get_history("1")
+        self.assertEqual([change["old"] for change in history], [None, {"price": "10"}])
+        self.assertEqual(
+            [change["new"] for change in history], [{"price": "10"}, {"price": "12"}]
+        )
+
+    def test_changes_of_unchanged_and_removed_items(self):
+        """Test only real changes are recorded, removed items have no new value."""
+        self.storage.save_to_json_file({"1": {"name": "a"}, "2": {"name": "b"}})
+        self.storage.changes = {}
+        self.storage.save_to_json_file({"1": {"name": "a"}})
+        self.assertEqual(
+            self.storage.changes, {"2": {"old": {"name": "b"}, "new": None}}
+        )
+        self.assertEqual(len(self.storage.get_history()), 3)
+
+    def test_fingerprint_index(self):
+        """Test fingerprints are looked up in the database and kept until flush."""
+        self.storage.append_to_json_file({"1": {"name": "a"}})
+        index = self.storage.fingerprint_index()
+        self.assertEqual(index["1"], item_fingerprint({"name": "a"}))
+        self.assertNotIn("2", index)
+        index["2"] = item_fingerprint({"name": "b"})
+        self.storage.stage_items({"2": {"name": "b"}})
+        self.assertIn("2", index)
+        self.assertEqual(sorted(index), ["1", "2"])
+        self.storage.flush()
+        self.assertEqual(index._unsaved, {})
+        self.assertEqual(dict(index), self.storage.read_fingerprints())
+        del index["1"]
+        self.assertNotIn("1", index)
+        self.storage.discard()
+        self.assertIn("1", index)
+
+    def test_read_changes_without_keep_changes(self):
+        """Test changes are read back from the history of this instance."""
+        self.storage.append_to_json_file({"1": {"name": "a"}, "2": {"name": "b"}})
+        storage = SqliteItemsStorage("output_project.json", keep_changes=False)
+        storage.append_to_json_file({"1": {"name": "c"}, "3": {"name": "d"}})
+        storage.append_to_json_file({"1": {"name": "e"}, "2": None})
+        self.assertEqual(storage.changes, {})
+        self.assertEqual(
+            storage.read_changes(),
+            {
+                "1": {"old": {"name": "a"}, "new": {"name": "e"}},
+                "2": {"old": {"name": "b"}, "new": None},
+                "3": {"old": None, "new": {"name": "d"}},
+            },
+        )
+        storage.close()
+
+    def test_storage_with_index_is_freed_at_once(self):
+        """Test the storage and its fingerprint index are not a reference cycle."""
+        storage = SqliteItemsStorage("output_project.json", keep_changes=False)
+        storage.fingerprint_index()
+        ref = weakref.ref(storage)
+        gc.disable()
+        try:
+            del storage
+            self.assertIsNone(ref())
+        finally:
+            gc.enable()